@@ -0,0 +1,112 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""All the bbox / sub-category txt annotations of an image set in one table.
+
+The table is a .npz file of flat arrays with one row per box:
+  image_ids      index of the image of the box in 'names'
+  classes        class of the box, the line of the box in its txt file + 1
+  boxes          x1, y1, x2, y2 as written in the txt file
+  sub_categorys  (class - 1) * 3 + sub-category, -1 without sub-categories
+and one row per image:
+  names          image index, as in the image set file
+  offsets        the boxes of image i are rows offsets[i]:offsets[i + 1]
+  sub_valid      whether the sub-category file matches the bbox file
+and has_sub_categorys, whether the sub-category files were read at all.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+def _parse_boxes(lines):
+  classes = []
+  boxes = []
+  for index, line in enumerate(lines):
+    line = line.strip()
+    if line != '':
+      classes.append(index + 1)
+      boxes.append([float(v) for v in line.split(' ')])
+  return classes, boxes
+
+
+def _parse_sub_categorys(lines):
+  subs = []
+  for line in lines:
+    line = line.strip()
+    if line != '':
+      main, sub = line.split(' ')
+      subs.append((int(main) - 1) * 3 + int(sub))
+  return subs
+
+
+def build_table(names, read_boxes, read_sub_categorys=None):
+  """Gather the annotations of the images names into a table.
+
+  read_boxes(name) and read_sub_categorys(name) return the lines of the
+  bbox and sub-category txt files of an image.
+  """
+  num_boxes = []
+  classes = []
+  boxes = []
+  sub_categorys = []
+  sub_valid = []
+  for name in names:
+    im_classes, im_boxes = _parse_boxes(read_boxes(name))
+    num_boxes.append(len(im_classes))
+    classes.extend(im_classes)
+    boxes.extend(im_boxes)
+    im_subs = [-1] * len(im_classes)
+    valid = True
+    if read_sub_categorys is not None:
+      subs = _parse_sub_categorys(read_sub_categorys(name))
+      valid = len(subs) == len(im_classes)
+      if valid:
+        im_subs = subs
+    sub_categorys.extend(im_subs)
+    sub_valid.append(valid)
+
+  offsets = np.zeros((len(names) + 1,), dtype=np.int64)
+  offsets[1:] = np.cumsum(num_boxes)
+  return {'names': np.array(names),
+          'offsets': offsets,
+          'sub_valid': np.array(sub_valid, dtype=np.bool_),
+          'image_ids': np.repeat(np.arange(len(names), dtype=np.int32), num_boxes),
+          'classes': np.array(classes, dtype=np.int32),
+          'boxes': np.array(boxes, dtype=np.float32).reshape((-1, 4)),
+          'sub_categorys': np.array(sub_categorys, dtype=np.int32),
+          'has_sub_categorys': np.array(read_sub_categorys is not None)}
+
+
+def save_table(filename, table):
+  with open(filename, 'wb') as f:
+    np.savez(f, **table)
+
+
+def load_table(filename):
+  """Read a table in one go, see save_table."""
+  with np.load(filename) as data:
+    table = dict((k, data[k]) for k in data.files)
+  table['names'] = [str(name) for name in table['names']]
+  # tables written before the flag existed are taken as without
+  table['has_sub_categorys'] = bool(table.get('has_sub_categorys', False))
+  return table
+
+
+def table_to_recs(table, classes):
+  """Return the annotations of the table in the format of
+  mydataset_eval.parse_rec, {image name: [object dicts]}."""
+  recs = {}
+  offsets = table['offsets']
+  boxes = table['boxes'].astype(np.int64).tolist()
+  obj_classes = table['classes'].tolist()
+  for i, name in enumerate(table['names']):
+    recs[name] = [{'name': classes[obj_classes[j]],
+                   'bbox': boxes[j],
+                   'difficult': True}
+                  for j in range(offsets[i], offsets[i + 1])]
+  return recs
@@ -0,0 +1,113 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Per-class AP computed incrementally, one image at a time."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+from datasets.voc_eval import voc_ap, match_detections
+
+
+class APAccumulator(object):
+  """Running VOC AP of the detections of a test set.
+
+  add_image matches the detections of an image to its gt boxes as voc_eval
+  does, and only keeps a (score, is_tp) pair per detection in growable
+  per-class arrays, plus the number of positives of each class. AP and
+  recall can be computed at any point, and accumulators of disjoint sets
+  of images, e.g. from separate workers, can be merged.
+  """
+
+  def __init__(self, num_classes, ovthresh=0.5, use_07_metric=False,
+               capacity=1024):
+    self.num_classes = num_classes
+    self.ovthresh = ovthresh
+    self.use_07_metric = use_07_metric
+    self.num_images = 0
+    self.num_pos = np.zeros((num_classes,), dtype=np.int64)
+    self._sizes = np.zeros((num_classes,), dtype=np.int64)
+    self._scores = [np.empty((capacity,), dtype=np.float32)
+                    for _ in range(num_classes)]
+    self._is_tp = [np.empty((capacity,), dtype=np.bool_)
+                   for _ in range(num_classes)]
+
+  def _append(self, c, scores, is_tp):
+    start = self._sizes[c]
+    end = start + len(scores)
+    if end > len(self._scores[c]):
+      # grow geometrically, so appending stays amortized O(1)
+      capacity = max(end, 2 * len(self._scores[c]))
+      for arrays in (self._scores, self._is_tp):
+        grown = np.empty((capacity,), dtype=arrays[c].dtype)
+        grown[:start] = arrays[c][:start]
+        arrays[c] = grown
+    self._scores[c][start:end] = scores
+    self._is_tp[c][start:end] = is_tp
+    self._sizes[c] = end
+
+  def add_image(self, dets, gt_boxes, gt_classes, gt_difficult=None):
+    """Add the detections of an image, dets[c] being [] or the N x 5
+    detections of class c (as all_boxes[c][i] of test_net), and its gt
+    boxes. Detections matched to difficult gts are not counted."""
+    if gt_difficult is None:
+      gt_difficult = np.zeros((len(gt_classes),), dtype=np.bool_)
+    for c in range(1, self.num_classes):
+      inds = np.where(gt_classes == c)[0]
+      self.num_pos[c] += np.sum(~gt_difficult[inds])
+      cls_dets = dets[c]
+      if len(cls_dets) == 0:
+        continue
+      cls_dets = cls_dets[np.argsort(-cls_dets[:, -1], kind='mergesort')]
+      class_recs = {0: {'bbox': gt_boxes[inds, :],
+                        'difficult': gt_difficult[inds]}}
+      tp, fp = match_detections(class_recs, [0] * len(cls_dets),
+                                cls_dets[:, :4], self.ovthresh)
+      counted = (tp + fp) > 0
+      self._append(c, cls_dets[counted, -1], tp[counted] > 0)
+    self.num_images += 1
+
+  def merge(self, other):
+    """Add the images of another accumulator of the same classes."""
+    assert other.num_classes == self.num_classes
+    for c in range(self.num_classes):
+      n = other._sizes[c]
+      self._append(c, other._scores[c][:n], other._is_tp[c][:n])
+    self.num_pos += other.num_pos
+    self.num_images += other.num_images
+    return self
+
+  def evaluate_class(self, c):
+    """Return rec, prec, ap of class c so far."""
+    n = self._sizes[c]
+    order = np.argsort(-self._scores[c][:n], kind='mergesort')
+    is_tp = self._is_tp[c][:n][order]
+    tp = np.cumsum(is_tp).astype(np.float64)
+    fp = np.cumsum(~is_tp).astype(np.float64)
+    rec = tp / float(max(self.num_pos[c], 1))
+    prec = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
+    ap = voc_ap(rec, prec, self.use_07_metric)
+    return rec, prec, ap
+
+  def summary(self):
+    """Return the per-class APs and recalls (background excluded), mAP
+    and the overall recall."""
+    aps = np.zeros((self.num_classes - 1,))
+    recs = np.zeros((self.num_classes - 1,))
+    for c in range(1, self.num_classes):
+      rec, _, aps[c - 1] = self.evaluate_class(c)
+      recs[c - 1] = rec[-1] if len(rec) > 0 else 0.
+    num_tp = sum(self._is_tp[c][:self._sizes[c]].sum()
+                 for c in range(self.num_classes))
+    return {'aps': aps, 'recs': recs, 'map': np.mean(aps),
+            'recall': num_tp / float(max(self.num_pos.sum(), 1))}
+
+  def __getstate__(self):
+    # only pickle the used part of the arrays
+    state = self.__dict__.copy()
+    state['_scores'] = [s[:n].copy() for s, n in zip(self._scores, self._sizes)]
+    state['_is_tp'] = [t[:n].copy() for t, n in zip(self._is_tp, self._sizes)]
+    return state
@@ -259,7 +259,7 @@ class coco(imdb):
     results = []
     for im_ind, index in enumerate(self.image_index):
       dets = boxes[im_ind].astype(np.float)
-      if dets == []:
+      if len(dets) == 0:
         continue
       scores = dets[:, -1]
       xs = dets[:, 0]
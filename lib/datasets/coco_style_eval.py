@@ -0,0 +1,163 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""COCO-style detection metrics without pycocotools.
+
+AP is computed at the IoU thresholds 0.50:0.05:0.95 and for the all /
+small / medium / large area ranges following the rules of COCOeval (best
+unmatched gt, gts out of the area range ignored, 101 point interpolated
+precision). The IoUs of an image are computed once and the detections are
+matched for every threshold and area range at the same time.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+from utils.bbox import bbox_overlaps
+
+IOU_THRESHOLDS = np.linspace(.5, .95, 10)
+AREA_NAMES = ('all', 'small', 'medium', 'large')
+AREA_RANGES = np.array([[0 ** 2, 1e5 ** 2],
+                        [0 ** 2, 32 ** 2],
+                        [32 ** 2, 96 ** 2],
+                        [96 ** 2, 1e5 ** 2]])
+RECALL_THRESHOLDS = np.linspace(.0, 1.00, 101)
+
+
+def _box_areas(boxes):
+  return (boxes[:, 2] - boxes[:, 0] + 1.) * (boxes[:, 3] - boxes[:, 1] + 1.)
+
+
+def _out_of_range(areas):
+  """(num area ranges, len(areas)) mask of the areas out of each range."""
+  return (areas[None, :] < AREA_RANGES[:, 0:1]) | \
+         (areas[None, :] > AREA_RANGES[:, 1:2])
+
+
+def match_image(gt_boxes, gt_areas, dets):
+  """Match the detections of one class in one image, sorted by decreasing
+  score, to its gt boxes.
+
+  Returns the tp and fp masks, of shape (thresholds, area ranges, dets).
+  Detections matched to an ignored gt or unmatched and out of the area
+  range are neither.
+  """
+  num_t = len(IOU_THRESHOLDS)
+  num_a = len(AREA_RANGES)
+  num_dets = dets.shape[0]
+  det_ignore = np.tile(_out_of_range(_box_areas(dets)), (num_t, 1))
+  matched = np.zeros((num_t * num_a, num_dets), dtype=np.bool_)
+  num_gts = gt_boxes.shape[0]
+  if num_gts > 0 and num_dets > 0:
+    ious = bbox_overlaps(dets[:, :4].astype(np.float64),
+                         gt_boxes.astype(np.float64))
+    # one row per (threshold, area range)
+    thresholds = np.repeat(IOU_THRESHOLDS, num_a)[:, None]
+    gt_ignore = np.tile(_out_of_range(gt_areas), (num_t, 1))
+    taken = np.zeros((num_t * num_a, num_gts), dtype=np.bool_)
+    # detections below the lowest threshold match nothing
+    for d in np.where(ious.max(axis=1) >= IOU_THRESHOLDS[0])[0]:
+      candidates = (ious[d][None, :] >= thresholds) & ~taken
+      rows = np.where(candidates.any(axis=1))[0]
+      if len(rows) == 0:
+        continue
+      # the best unmatched gt, the ignored gts only if no other is left
+      rank = np.where(candidates, ious[d][None, :] + 2. * ~gt_ignore, -1.)
+      best = rank[rows].argmax(axis=1)
+      taken[rows, best] = True
+      matched[rows, d] = True
+      det_ignore[rows, d] = gt_ignore[rows, best]
+  tp = matched & ~det_ignore
+  fp = ~matched & ~det_ignore
+  return tp.reshape((num_t, num_a, -1)), fp.reshape((num_t, num_a, -1))
+
+
+def class_ap(gt_boxes, gt_areas, dets, max_dets=100):
+  """AP of one class at each IoU threshold and area range, -1 where there
+  is no gt. gt_boxes, gt_areas and dets are per-image lists, dets[i] being
+  [] or the N x 5 detections of image i."""
+  num_t = len(IOU_THRESHOLDS)
+  num_a = len(AREA_RANGES)
+  scores = []
+  tps = []
+  fps = []
+  num_pos = np.zeros((num_a,))
+  for boxes, areas, im_dets in zip(gt_boxes, gt_areas, dets):
+    num_pos += (~_out_of_range(areas)).sum(axis=1)
+    if len(im_dets) == 0:
+      continue
+    order = np.argsort(-im_dets[:, -1], kind='mergesort')[:max_dets]
+    im_dets = im_dets[order]
+    tp, fp = match_image(boxes, areas, im_dets)
+    scores.append(im_dets[:, -1])
+    tps.append(tp)
+    fps.append(fp)
+
+  ap = -np.ones((num_t, num_a))
+  if len(scores) == 0:
+    ap[:, num_pos > 0] = 0.
+    return ap
+  order = np.argsort(-np.concatenate(scores), kind='mergesort')
+  tp = np.cumsum(np.concatenate(tps, axis=2)[:, :, order], axis=2)
+  fp = np.cumsum(np.concatenate(fps, axis=2)[:, :, order], axis=2)
+  rec = tp / np.maximum(num_pos, 1)[None, :, None]
+  prec = tp / np.maximum(tp + fp, np.spacing(1))
+  # precision envelope
+  prec = np.maximum.accumulate(prec[:, :, ::-1], axis=2)[:, :, ::-1]
+  for t in range(num_t):
+    for a in range(num_a):
+      if num_pos[a] == 0:
+        continue
+      inds = np.searchsorted(rec[t, a], RECALL_THRESHOLDS, side='left')
+      inds = inds[inds < rec.shape[2]]
+      ap[t, a] = prec[t, a, inds].sum() / len(RECALL_THRESHOLDS)
+  return ap
+
+
+def coco_style_eval(gt, all_boxes, max_dets=100):
+  """Return the (classes, thresholds, area ranges) APs of all_boxes,
+  all_boxes[cls][image] = [] or N x 5 detections, against gt, one dict of
+  'boxes', 'gt_classes' and 'seg_areas' per image as imdb.evaluation_gt
+  returns. COCO has no difficult objects, all the gts count. The
+  background row is -1."""
+  num_classes = len(all_boxes)
+  aps = -np.ones((num_classes, len(IOU_THRESHOLDS), len(AREA_RANGES)))
+  for cls_ind in range(1, num_classes):
+    gt_boxes = []
+    gt_areas = []
+    for entry in gt:
+      inds = np.where(entry['gt_classes'] == cls_ind)[0]
+      gt_boxes.append(entry['boxes'][inds, :])
+      gt_areas.append(entry['seg_areas'][inds].astype(np.float64))
+    aps[cls_ind] = class_ap(gt_boxes, gt_areas, all_boxes[cls_ind], max_dets)
+  return aps
+
+
+def _mean_ap(aps):
+  valid = aps[aps > -1]
+  return np.mean(valid) if valid.size > 0 else -1.
+
+
+def summarize(aps, classes):
+  """Print the COCO summary of coco_style_eval's aps, and return it as
+  a dict."""
+  aps = aps[1:]
+  stats = {'AP': _mean_ap(aps[:, :, 0]),
+           'AP50': _mean_ap(aps[:, 0, 0]),
+           'AP75': _mean_ap(aps[:, 5, 0])}
+  for a, area in enumerate(AREA_NAMES[1:]):
+    stats['AP_' + area] = _mean_ap(aps[:, :, a + 1])
+  template = ' Average Precision  (AP) @[ IoU={:<9} | area={:>6s} ] = {:0.3f}'
+  print(template.format('0.50:0.95', 'all', stats['AP']))
+  print(template.format('0.50', 'all', stats['AP50']))
+  print(template.format('0.75', 'all', stats['AP75']))
+  for area in AREA_NAMES[1:]:
+    print(template.format('0.50:0.95', area, stats['AP_' + area]))
+  print('~~~~~~~~')
+  print('AP@[.5:.95] per class:')
+  for cls, cls_aps in zip(classes[1:], aps):
+    print('{}: {:.3f}'.format(cls, _mean_ap(cls_aps[:, 0])))
+  return stats
@@ -10,11 +10,14 @@ from __future__ import print_function
 
 import os
 import os.path as osp
-import PIL
+import pickle
 from utils.bbox import bbox_overlaps
 import numpy as np
 import scipy.sparse
 from model.config import cfg
+from datasets.manifest import load_manifest
+from datasets.coco_style_eval import coco_style_eval, summarize
+from datasets.ap_accumulator import APAccumulator
 
 
 class imdb(object):
@@ -31,6 +34,7 @@ class imdb(object):
     self._obj_proposer = 'gt'
     self._roidb = None
     self._roidb_handler = self.default_roidb
+    self._manifest = None
     # Use this dict for storing dataset specific config options
     self.config = {}
 
@@ -91,6 +95,11 @@ class imdb(object):
   def default_roidb(self):
     raise NotImplementedError
 
+  def load_roidb_entry(self, i):
+    """Parse the ground-truth roidb entry of image i on its own, for
+    roi_data_layer.lazy_roidb. Returns None if the annotation is invalid."""
+    raise NotImplementedError
+
   def evaluate_detections(self, all_boxes, output_dir=None):
     """
     all_boxes is a list of length number-of-classes.
@@ -102,8 +111,77 @@ class imdb(object):
     """
     raise NotImplementedError
 
+  def evaluate_in_memory(self, all_boxes, output_dir=None):
+    """
+    Evaluate all_boxes, as for evaluate_detections, without writing the
+    results files and reading them back. Scores and boxes are used at full
+    precision.
+    """
+    raise NotImplementedError
+
+  def evaluation_gt(self):
+    """
+    Ground truth that the python evaluation of evaluate_detections compares
+    the detections to, one dict per image of image_index with 'boxes' in the
+    0-based convention of all_boxes, 'gt_classes', 'seg_areas' and
+    'difficult'. Unlike gt_roidb, no image is dropped.
+    """
+    raise NotImplementedError
+
+  def ap_accumulator(self):
+    """
+    Return an empty APAccumulator set up as the python evaluation of
+    evaluate_detections (overlap threshold and AP metric), to be fed the
+    detections and evaluation_gt of each image.
+    """
+    return APAccumulator(self.num_classes)
+
+  def evaluate_coco_style(self, all_boxes, output_dir=None):
+    """
+    COCO-style AP of all_boxes, laid out as for evaluate_detections, at
+    IoU 0.50:0.95 and for small / medium / large boxes, against the
+    evaluation ground truth. See datasets.coco_style_eval.
+    """
+    gt = self.evaluation_gt()
+    assert len(gt) == self.num_images and len(all_boxes[1]) == self.num_images, \
+      'all_boxes does not match the images of {}'.format(self.name)
+    aps = coco_style_eval(gt, all_boxes)
+    stats = summarize(aps, self.classes)
+    if output_dir is not None:
+      with open(osp.join(output_dir, 'coco_style_eval.pkl'), 'wb') as f:
+        pickle.dump({'aps': aps, 'stats': stats}, f, pickle.HIGHEST_PROTOCOL)
+    return stats
+
+  @property
+  def manifest(self):
+    """Sizes, file sizes and mtimes of the images, see datasets.manifest."""
+    if self._manifest is None:
+      # one row per distinct image, flipped copies share it
+      rows = {}
+      image_paths = []
+      for i, index in enumerate(self._image_index):
+        if index not in rows:
+          rows[index] = len(image_paths)
+          image_paths.append(self.image_path_at(i))
+      cache_file = osp.join(self.cache_path, self.name + '_manifest.pkl')
+      self._manifest = load_manifest(cache_file, image_paths,
+                                     self._manifest_other_paths())
+      self._manifest_rows = rows
+    return self._manifest
+
+  def _manifest_other_paths(self):
+    """Paths besides the images that are checked when the manifest is
+    built."""
+    return []
+
+  def image_size_at(self, i):
+    """Return the (width, height) of image i."""
+    manifest = self.manifest
+    row = self._manifest_rows[self._image_index[i]]
+    return int(manifest['width'][row]), int(manifest['height'][row])
+
   def _get_widths(self):
-    return [PIL.Image.open(self.image_path_at(i)).size[0]
+    return [self.image_size_at(i)[0]
             for i in range(self.num_images)]
 
   def append_flipped_images(self):
@@ -134,6 +212,14 @@ class imdb(object):
             'thresholds': vector of IoU overlap thresholds
             'gt_overlaps': vector of all ground-truth overlaps
     """
+    return self.evaluate_recall_sweep(candidate_boxes, [limit],
+                                      thresholds, area)[0]
+
+  def evaluate_recall_sweep(self, candidate_boxes=None, limits=(None,),
+                            thresholds=None, area='all'):
+    """evaluate_recall for several limits on the number of proposals per
+    image, computing the overlaps of each image once. Returns the list of
+    results, one per limit."""
     # Record max overlap value for each gt box
     # Return vector of overlap values
     areas = {'all': 0, 'small': 1, 'medium': 2, 'large': 3,
@@ -149,69 +235,52 @@ class imdb(object):
                    ]
     assert area in areas, 'unknown area range: {}'.format(area)
     area_range = area_ranges[areas[area]]
-    gt_overlaps = np.zeros(0)
+    max_limit = None if None in limits else max(limits)
+    gt_overlaps = [[] for _ in limits]
     num_pos = 0
     for i in range(self.num_images):
+      entry = self.roidb[i]
       # Checking for max_overlaps == 1 avoids including crowd annotations
       # (...pretty hacking :/)
-      max_gt_overlaps = self.roidb[i]['gt_overlaps'].toarray().max(axis=1)
-      gt_inds = np.where((self.roidb[i]['gt_classes'] > 0) &
+      max_gt_overlaps = entry['gt_overlaps'].toarray().max(axis=1)
+      gt_inds = np.where((entry['gt_classes'] > 0) &
                          (max_gt_overlaps == 1))[0]
-      gt_boxes = self.roidb[i]['boxes'][gt_inds, :]
-      gt_areas = self.roidb[i]['seg_areas'][gt_inds]
-      valid_gt_inds = np.where((gt_areas >= area_range[0]) &
-                               (gt_areas <= area_range[1]))[0]
-      gt_boxes = gt_boxes[valid_gt_inds, :]
+      gt_areas = entry['seg_areas'][gt_inds]
+      valid_gt_inds = gt_inds[(gt_areas >= area_range[0]) &
+                              (gt_areas <= area_range[1])]
+      gt_boxes = entry['boxes'][valid_gt_inds, :]
       num_pos += len(valid_gt_inds)
 
       if candidate_boxes is None:
         # If candidate_boxes is not supplied, the default is to use the
         # non-ground-truth boxes from this roidb
-        non_gt_inds = np.where(self.roidb[i]['gt_classes'] == 0)[0]
-        boxes = self.roidb[i]['boxes'][non_gt_inds, :]
+        non_gt_inds = np.where(entry['gt_classes'] == 0)[0]
+        boxes = entry['boxes'][non_gt_inds, :]
       else:
         boxes = candidate_boxes[i]
       if boxes.shape[0] == 0:
         continue
-      if limit is not None and boxes.shape[0] > limit:
-        boxes = boxes[:limit, :]
-
-      overlaps = bbox_overlaps(boxes.astype(np.float),
-                               gt_boxes.astype(np.float))
-
-      _gt_overlaps = np.zeros((gt_boxes.shape[0]))
-      for j in range(gt_boxes.shape[0]):
-        # find which proposal box maximally covers each gt box
-        argmax_overlaps = overlaps.argmax(axis=0)
-        # and get the iou amount of coverage for each gt box
-        max_overlaps = overlaps.max(axis=0)
-        # find which gt box is 'best' covered (i.e. 'best' = most iou)
-        gt_ind = max_overlaps.argmax()
-        gt_ovr = max_overlaps.max()
-        assert (gt_ovr >= 0)
-        # find the proposal box that covers the best covered gt box
-        box_ind = argmax_overlaps[gt_ind]
-        # record the iou coverage of this gt box
-        _gt_overlaps[j] = overlaps[box_ind, gt_ind]
-        assert (_gt_overlaps[j] == gt_ovr)
-        # mark the proposal box and the gt box as used
-        overlaps[box_ind, :] = -1
-        overlaps[:, gt_ind] = -1
-      # append recorded iou coverage level
-      gt_overlaps = np.hstack((gt_overlaps, _gt_overlaps))
-
-    gt_overlaps = np.sort(gt_overlaps)
+
+      overlaps = bbox_overlaps(
+        np.ascontiguousarray(boxes[:max_limit, :4], dtype=np.float64),
+        np.ascontiguousarray(gt_boxes, dtype=np.float64))
+      for k, limit in enumerate(limits):
+        gt_overlaps[k].append(_greedy_coverage(overlaps[:limit]))
+
     if thresholds is None:
       step = 0.05
       thresholds = np.arange(0.5, 0.95 + 1e-5, step)
-    recalls = np.zeros_like(thresholds)
-    # compute recall for each iou threshold
-    for i, t in enumerate(thresholds):
-      recalls[i] = (gt_overlaps >= t).sum() / float(num_pos)
-    # ar = 2 * np.trapz(recalls, thresholds)
-    ar = recalls.mean()
-    return {'ar': ar, 'recalls': recalls, 'thresholds': thresholds,
-            'gt_overlaps': gt_overlaps}
+    results = []
+    for coverage in gt_overlaps:
+      coverage = np.sort(np.concatenate(coverage)) if coverage else np.zeros(0)
+      # compute recall for each iou threshold
+      num_covered = len(coverage) - np.searchsorted(coverage, thresholds, side='left')
+      recalls = num_covered / float(num_pos)
+      # ar = 2 * np.trapz(recalls, thresholds)
+      ar = recalls.mean()
+      results.append({'ar': ar, 'recalls': recalls, 'thresholds': thresholds,
+                      'gt_overlaps': coverage})
+    return results
 
   def create_roidb_from_box_list(self, box_list, gt_roidb):
     assert len(box_list) == self.num_images, \
@@ -258,3 +327,36 @@ class imdb(object):
   def competition_mode(self, on):
     """Turn competition mode on or off."""
     pass
+
+
+def _greedy_coverage(overlaps):
+  """Overlap of each gt box (column) with the proposal (row) assigned to
+  it, assigning in turn the best covered gt to its best proposal, each
+  proposal being used once. Gts left without a proposal get 0.
+
+  The proposals of each gt are sorted once, and each gt keeps a pointer to
+  its best unused proposal, so each step only looks at one value per gt.
+  """
+  num_boxes, num_gts = overlaps.shape
+  coverage = np.zeros((num_gts,))
+  if num_boxes == 0 or num_gts == 0:
+    return coverage
+  gt_range = np.arange(num_gts)
+  # proposals of each gt from the best to the worst, ties in index order
+  order = np.argsort(-overlaps, axis=0, kind='mergesort')
+  sorted_overlaps = overlaps[order, gt_range]
+  ptr = np.zeros((num_gts,), dtype=np.int64)
+  best = sorted_overlaps[0].copy()
+  used = np.zeros((num_boxes,), dtype=np.bool_)
+  for _ in range(min(num_boxes, num_gts)):
+    gt_ind = best.argmax()
+    box_ind = order[ptr[gt_ind], gt_ind]
+    coverage[gt_ind] = best[gt_ind]
+    # mark the proposal box and the gt box as used
+    used[box_ind] = True
+    best[gt_ind] = -1
+    for j in np.where((best >= 0) & (order[np.minimum(ptr, num_boxes - 1), gt_range] == box_ind))[0]:
+      while ptr[j] < num_boxes and used[order[ptr[j], j]]:
+        ptr[j] += 1
+      best[j] = sorted_overlaps[ptr[j], j] if ptr[j] < num_boxes else -1
+  return coverage
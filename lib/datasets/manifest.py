@@ -0,0 +1,115 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Manifest of the images of an imdb: path, width, height, file size and
+mtime of every image, gathered once in parallel and cached on disk.
+
+The paths are checked here, with one stat per file when the manifest is
+built or reloaded, so that the path accessors of the imdbs do not have to.
+A cached manifest is only trusted for the files whose size and mtime have
+not changed since it was written; the other rows are read again.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import pickle
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from datasets.packed import image_size, PACKED_SEP
+
+
+def _image_record(path):
+  if PACKED_SEP in path:
+    # packed records have no file of their own
+    width, height = image_size(path)
+    return width, height, -1, 0.
+  size, mtime = _stat(path)
+  width, height = image_size(path)
+  return width, height, size, mtime
+
+
+def _check_path(path):
+  if PACKED_SEP not in path and not os.path.exists(path):
+    raise IOError('Path does not exist: {}'.format(path))
+
+
+def _stat(path):
+  if PACKED_SEP in path:
+    return -1, 0.
+  # one stat call, that also checks the path
+  try:
+    st = os.stat(path)
+  except OSError:
+    raise IOError('Path does not exist: {}'.format(path))
+  return st.st_size, st.st_mtime
+
+
+def _map(func, paths, num_threads=16):
+  # the work is IO bound, so it is spread over threads
+  pool = ThreadPool(num_threads)
+  try:
+    return pool.map(func, paths, chunksize=64)
+  finally:
+    pool.close()
+    pool.join()
+
+
+def _to_manifest(image_paths, records):
+  records = np.array(records, dtype=np.float64).reshape((-1, 4))
+  return {'paths': list(image_paths),
+          'width': records[:, 0].astype(np.int32),
+          'height': records[:, 1].astype(np.int32),
+          'size': records[:, 2].astype(np.int64),
+          'mtime': records[:, 3]}
+
+
+def build_manifest(image_paths, other_paths=()):
+  """Read the header and stat of every image, and check that the other
+  paths (e.g. parsing labels) exist."""
+  records = _map(_image_record, image_paths)
+  _map(_check_path, other_paths)
+  return _to_manifest(image_paths, records)
+
+
+def refresh_manifest(manifest, other_paths=()):
+  """Stat the images of manifest again and re-read the rows of those whose
+  size or mtime changed. Returns the number of rows re-read."""
+  stats = np.array(_map(_stat, manifest['paths']), dtype=np.float64).reshape((-1, 2))
+  _map(_check_path, other_paths)
+  stale = np.where((stats[:, 0] != manifest['size']) |
+                   (stats[:, 1] != manifest['mtime']))[0]
+  if len(stale) > 0:
+    records = _map(_image_record, [manifest['paths'][i] for i in stale])
+    fresh = _to_manifest([manifest['paths'][i] for i in stale], records)
+    for key in ('width', 'height', 'size', 'mtime'):
+      manifest[key][stale] = fresh[key]
+  return len(stale)
+
+
+def load_manifest(cache_file, image_paths, other_paths=()):
+  """Return the manifest of image_paths, read from cache_file if it was
+  built for the same paths, built and written there otherwise. The rows of
+  the images changed since the cache was written are re-read."""
+  image_paths = list(image_paths)
+  manifest = None
+  if os.path.exists(cache_file):
+    with open(cache_file, 'rb') as fid:
+      manifest = pickle.load(fid)
+    if manifest['paths'] != image_paths:
+      manifest = None
+  if manifest is None:
+    manifest = build_manifest(image_paths, other_paths)
+  else:
+    num_stale = refresh_manifest(manifest, other_paths)
+    if num_stale == 0:
+      return manifest
+    print('re-read {} changed images of the image manifest'.format(num_stale))
+  with open(cache_file, 'wb') as fid:
+    pickle.dump(manifest, fid, pickle.HIGHEST_PROTOCOL)
+  print('wrote image manifest to {}'.format(cache_file))
+  return manifest
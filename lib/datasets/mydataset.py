@@ -16,12 +16,25 @@ import numpy as np
 import scipy.sparse
 import scipy.io as sio
 import pickle
+import hashlib
+import multiprocessing
 import subprocess
 import uuid
-from .mydataset_eval import mydataset_eval
+from .mydataset_eval import mydataset_eval, load_recs
+from .voc_eval import eval_classes, class_detections, gt_from_recs
+from .packed import packed_path, get_reader
+from .annotation_table import load_table, table_to_recs
+from .ap_accumulator import APAccumulator
 from model.config import cfg
 import matplotlib.pyplot as plt
 import cv2
+
+# mydataset whose annotations the pool of mydataset._load_annotations parses
+_pool_dataset = None
+
+def _load_annotation_in_pool(index):
+  return _pool_dataset._load_annotation(index)
+
 class mydataset(imdb):
   def __init__(self, image_set, dataset):
 
@@ -53,16 +66,33 @@ class mydataset(imdb):
                    'min_size': 2}
     assert os.path.exists(self._root_path), \
       'dataset path does not exist: {}'.format(self._root_path)
-    assert os.path.exists(self._data_path), \
-      'Path does not exist: {}'.format(self._data_path)
+    self._packed_reader = None
+    self._annotation_table = None
+    if cfg.USE_PACKED_DATA:
+      self._packed_reader = get_reader(self.packed_prefix)
+    else:
+      assert os.path.exists(self._data_path), \
+        'Path does not exist: {}'.format(self._data_path)
+
+  @property
+  def packed_prefix(self):
+    """Prefix of the pack of this image set, see datasets.packed."""
+    return os.path.join(self._root_path, 'packed', self._image_set)
+
+  def _manifest_other_paths(self):
+    if cfg.DO_PARSING:
+      return [self.parsing_label_path_at(i) for i in range(self.num_images)]
+    return []
+
   def parsing_label_path_at(self, i):
     return self.parsing_label_path_from_index(self._image_index[i])
 
   def parsing_label_path_from_index(self, index):
+    if self._packed_reader is not None:
+      return packed_path(self.packed_prefix, 'label', index)
+    # checked when the manifest is built or refreshed
     parsing_label_path = os.path.join(self._parsing_label_path,
                               index + self._parsing_label_ext)
-    assert os.path.exists(parsing_label_path), \
-      'Path does not exist: {}'.format(parsing_label_path)
     return parsing_label_path
   def image_path_at(self, i):
     """
@@ -74,10 +104,11 @@ class mydataset(imdb):
     """
     Construct an image path from the image's "index" identifier.
     """
+    if self._packed_reader is not None:
+      return packed_path(self.packed_prefix, 'image', index)
+    # checked when the manifest is built or refreshed
     image_path = os.path.join(self._data_path,
                               index + self._image_ext)
-    assert os.path.exists(image_path), \
-      'Path does not exist: {}'.format(image_path)
     return image_path
 
   def _load_image_set_index(self):
@@ -94,42 +125,168 @@ class mydataset(imdb):
     return image_index
 
 
+  def _gt_roidb_cache_key(self):
+    """
+    What a cached gt roidb depends on besides the annotation files.
+    """
+    image_set_file = os.path.join(self._root_path, self._image_set + '.txt')
+    with open(image_set_file, 'rb') as f:
+      image_set_hash = hashlib.md5(f.read()).hexdigest()
+    return (os.path.abspath(self._root_path), image_set_hash,
+            cfg.SUB_CATEGORY, cfg.DO_PARSING, cfg.USE_PACKED_DATA)
+
+  def _annotation_stamp(self, index):
+    """
+    Modification times of the files the roidb entry of an image is parsed from.
+    """
+    if self._packed_reader is not None:
+      return (os.stat(self.packed_prefix + '.index.pkl').st_mtime,)
+    kinds = ('bbox', 'sub_category_3') if cfg.SUB_CATEGORY else ('bbox',)
+    return tuple(os.stat(self.annotation_path_from_index(kind, index)).st_mtime
+                 for kind in kinds)
+
   def gt_roidb(self):
     """
     Return the database of ground-truth regions of interest.
 
     This function loads/saves from/to a cache file to speed up future calls.
+    The cache is only used for the same dataset, image set and config flags,
+    and entries whose annotation files changed since are parsed again.
     """
+    if cfg.USE_ANNOTATION_TABLE:
+      rows = self.annotation_table_rows
+      return self._drop_invalid_entries(
+        [self._table_entry(rows[index]) for index in self.image_index])
+
     cache_file = os.path.join(self.cache_path, self.name + '_gt_roidb.pkl')
-    # if os.path.exists(cache_file):
-    #   with open(cache_file, 'rb') as fid:
-    #     try:
-    #       roidb = pickle.load(fid)
-    #     except:
-    #       roidb = pickle.load(fid, encoding='bytes')
-    #   print('{} gt roidb loaded from {}'.format(self.name, cache_file))
-    #   return roidb
-
-    # gt_roidb = [self._load_annotation(index)
-    #             for index in self.image_index]
+    key = self._gt_roidb_cache_key()
+    cached = {}
+    if os.path.exists(cache_file):
+      with open(cache_file, 'rb') as fid:
+        try:
+          cache = pickle.load(fid)
+        except (pickle.UnpicklingError, EOFError, ValueError):
+          cache = None
+      if isinstance(cache, dict) and cache.get('key') == key:
+        cached = cache['entries']
+
+    # the cache covers every image of the image set file, image_index may
+    # have lost the invalid ones already
+    full_index = self._load_image_set_index()
+    stamps = dict((index, self._annotation_stamp(index)) for index in full_index)
+    stale = [index for index in full_index
+             if index not in cached or cached[index][0] != stamps[index]]
+    if stale:
+      print('{} gt roidb: parsing {} of {} annotations'.format(
+        self.name, len(stale), len(full_index)))
+      for index, roi in zip(stale, self._load_annotations(stale)):
+        cached[index] = (stamps[index], roi)
+    if stale or len(cached) != len(stamps):
+      # only keep the images of the image set
+      entries = dict((index, cached[index]) for index in full_index)
+      with open(cache_file, 'wb') as fid:
+        pickle.dump({'key': key, 'entries': entries}, fid, pickle.HIGHEST_PROTOCOL)
+      print('wrote gt roidb to {}'.format(cache_file))
+    else:
+      print('{} gt roidb loaded from {}'.format(self.name, cache_file))
+
+    return self._drop_invalid_entries(
+      [cached[index][1] for index in self.image_index])
+
+  def _drop_invalid_entries(self, rois):
+    """
+    Remove the images whose annotation is invalid (None in rois, which
+    follows the image index) and return the roidb of the others.
+    """
     gt_roidb = []
     error_index = []
-    for index in self.image_index:
-      roi = self._load_annotation(index)
+    for index, roi in zip(self.image_index, rois):
       if roi is not None:
         gt_roidb.append(roi)
       else:
         error_index.append(index)
-    for index in error_index:
-      self.image_index.remove(index)
+    if error_index:
+      errors = set(error_index)
+      self.image_index[:] = [index for index in self.image_index if index not in errors]
     print('error images number: ', len(error_index))
     print(error_index)
-    with open(cache_file, 'wb') as fid:
-      pickle.dump(gt_roidb, fid, pickle.HIGHEST_PROTOCOL)
-    print('wrote gt roidb to {}'.format(cache_file))
 
     return gt_roidb
 
+  def load_roidb_entry(self, i):
+    if cfg.USE_ANNOTATION_TABLE:
+      return self._table_entry(self.annotation_table_rows[self._image_index[i]])
+    return self._load_annotation(self._image_index[i])
+
+  @property
+  def annotation_table_file(self):
+    """
+    Table of the annotations written by tools/build_annotation_table.py.
+    """
+    return os.path.join(self._root_path, 'annotations', self._image_set + '.npz')
+
+  @property
+  def annotation_table(self):
+    if self._annotation_table is None:
+      self._annotation_table = load_table(self.annotation_table_file)
+      assert self._annotation_table['has_sub_categorys'] or not cfg.SUB_CATEGORY, \
+        '{} has no sub-categories, rebuild it without --no_sub_category ' \
+        'or turn SUB_CATEGORY off'.format(self.annotation_table_file)
+      self._annotation_table_rows = dict(
+        (name, i) for i, name in enumerate(self._annotation_table['names']))
+    return self._annotation_table
+
+  @property
+  def annotation_table_rows(self):
+    """
+    Row of every image in the annotation table.
+    """
+    self.annotation_table
+    return self._annotation_table_rows
+
+  def _table_entry(self, row):
+    """
+    Same as _load_annotation, from row of the annotation table.
+    """
+    table = self.annotation_table
+    start, end = table['offsets'][row], table['offsets'][row + 1]
+    if cfg.SUB_CATEGORY and not table['sub_valid'][row]:
+      return None
+    num_objs = end - start
+    x = table['boxes'][start:end]
+    boxes = x.astype(np.uint16)
+    gt_classes = table['classes'][start:end].copy()
+    overlaps = np.zeros((num_objs, self.num_classes), dtype=np.float32)
+    overlaps[np.arange(num_objs), gt_classes] = 1.0
+    seg_areas = ((x[:, 2] - x[:, 0] + 1) * (x[:, 3] - x[:, 1] + 1)).astype(np.float32)
+    entry = {'boxes': boxes,
+             'gt_classes': gt_classes,
+             'gt_overlaps': scipy.sparse.csr_matrix(overlaps),
+             'flipped': False,
+             'seg_areas': seg_areas,
+             'do_parsing': cfg.DO_PARSING}
+    if cfg.SUB_CATEGORY:
+      entry['sub_categorys'] = table['sub_categorys'][start:end].copy()
+    return entry
+
+  def _load_annotations(self, indexes):
+    """
+    Parse the annotations of several images, in a process pool when there
+    are many of them.
+    """
+    if len(indexes) < 1000:
+      return [self._load_annotation(index) for index in indexes]
+    global _pool_dataset
+    # the forked workers find the dataset there
+    _pool_dataset = self
+    pool = multiprocessing.Pool()
+    try:
+      return pool.map(_load_annotation_in_pool, indexes, chunksize=256)
+    finally:
+      pool.close()
+      pool.join()
+      _pool_dataset = None
+
   def rpn_roidb(self):
     if int(self._year) == 2007 or self._image_set != 'test':
       gt_roidb = self.gt_roidb()
@@ -149,11 +306,26 @@ class mydataset(imdb):
       box_list = pickle.load(f)
     return self.create_roidb_from_box_list(box_list, gt_roidb)
 
+  def annotation_path_from_index(self, kind, index):
+    """
+    Path of the txt annotation of an image, kind is 'bbox' or 'sub_category_3'.
+    """
+    return os.path.join(self._root_path, kind, self._image_set, index + '.txt')
+
+  def _read_annotation(self, kind, index):
+    """
+    Return the lines of the txt annotation of an image.
+    """
+    if self._packed_reader is not None:
+      return self._packed_reader.read_text(kind, index).splitlines()
+    with open(self.annotation_path_from_index(kind, index), 'r') as f:
+      return f.read().splitlines()
+
   def _load_annotation(self, img_index):
     """
     Load image and bounding boxes info from txt file.
     """
-    bbox_txt = open(os.path.join(self._root_path, 'bbox', self._image_set, img_index+'.txt'),'r')
+    bbox_txt = self._read_annotation('bbox', img_index)
     bboxs = []
     num_objs = 0
     for index, line in enumerate(bbox_txt):
@@ -180,7 +352,7 @@ class mydataset(imdb):
       seg_areas[index] = bbox[2]
     overlaps = scipy.sparse.csr_matrix(overlaps)
     if cfg.SUB_CATEGORY:
-      sub_category_txt = open(os.path.join(self._root_path, 'sub_category_3', self._image_set, img_index + '.txt'), 'r')
+      sub_category_txt = self._read_annotation('sub_category_3', img_index)
       subs = []
       num_subs = 0
       for index, line in enumerate(sub_category_txt):
@@ -228,7 +400,7 @@ class mydataset(imdb):
       with open(filename, 'wt') as f:
         for im_ind, index in enumerate(self.image_index):
           dets = all_boxes[cls_ind][im_ind]
-          if dets == []:
+          if len(dets) == 0:
             continue
           # the VOCdevkit expects 1-based indices
           for k in range(dets.shape[0]):
@@ -237,7 +409,31 @@ class mydataset(imdb):
                            dets[k, 0] + 1, dets[k, 1] + 1,
                            dets[k, 2] + 1, dets[k, 3] + 1))
 
-  def _do_python_eval(self, output_dir='output'):
+  def _load_gt_recs(self):
+    """
+    Return the image names of the image set file and their annotations, as
+    mydataset_eval reads them.
+    """
+    annopath = os.path.join(self._root_path, 'bbox',self._image_set, '{:s}.txt')
+    imagesetfile = os.path.join(self._root_path, self._image_set + '.txt')
+    cachedir = os.path.join(self._root_path, 'annotations_cache')
+    with open(imagesetfile, 'r') as f:
+      imagenames = [x.strip() for x in f.readlines()]
+    if cfg.USE_ANNOTATION_TABLE:
+      gt_recs = table_to_recs(self.annotation_table, self._classes)
+    else:
+      gt_recs = load_recs(annopath, imagesetfile, imagenames, cachedir)
+    return imagenames, gt_recs
+
+  def evaluation_gt(self):
+    _, gt_recs = self._load_gt_recs()
+    return gt_from_recs(gt_recs, self.image_index, self._class_to_ind,
+                        self.config['use_diff'])
+
+  def ap_accumulator(self):
+    return APAccumulator(self.num_classes, cfg.TEST.IOU_THRESH)
+
+  def _do_python_eval(self, output_dir='output', all_boxes=None):
     annopath = os.path.join(self._root_path, 'bbox',self._image_set, '{:s}.txt')
     imagesetfile = os.path.join(self._root_path, self._image_set + '.txt')
     cachedir = os.path.join(self._root_path, 'annotations_cache')
@@ -253,14 +449,24 @@ class mydataset(imdb):
     use_07_metric = False
     if not os.path.isdir(output_dir):
       os.mkdir(output_dir)
-    for i, cls in enumerate(self._classes):
-      if cls == '__background__':
-        continue
+    # load the ground truth once, the workers share it
+    imagenames, gt_recs = self._load_gt_recs()
+
+    def eval_class(cls):
       filename = self._get_results_file_template().format(cls)
+      dets = None
+      if all_boxes is not None:
+        dets = class_detections(all_boxes[self._class_to_ind[cls]],
+                                self.image_index)
       # add npos, tp, fp
-      rec, prec, ap, npos, tp, fp = mydataset_eval(
+      return mydataset_eval(
         filename, annopath, imagesetfile, cls, cachedir, ovthresh=cfg.TEST.IOU_THRESH,
-        use_07_metric=use_07_metric, use_diff=self.config['use_diff'])
+        use_07_metric=use_07_metric, use_diff=self.config['use_diff'],
+        recs=gt_recs, imagenames=imagenames, dets=dets)
+
+    classes = [cls for cls in self._classes if cls != '__background__']
+    results = eval_classes(eval_class, classes, cfg.TEST.EVAL_WORKERS)
+    for cls, (rec, prec, ap, npos, tp, fp) in zip(classes, results):
       # plt.plot(rec, prec, lw=2, label=cls)
       # plt.xlabel('Recall')
       # plt.ylabel('Precision')
@@ -323,6 +529,9 @@ class mydataset(imdb):
         filename = self._get_results_file_template().format(cls)
         os.remove(filename)
 
+  def evaluate_in_memory(self, all_boxes, output_dir):
+    self._do_python_eval(output_dir, all_boxes)
+
 
 if __name__ == '__main__':
   from mydataset.mydataset import mydataset
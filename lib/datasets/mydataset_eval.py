@@ -12,6 +12,8 @@ import xml.etree.ElementTree as ET
 import os
 import pickle
 import numpy as np
+from .voc_eval import voc_ap, match_detections
+from .voc_eval import load_recs as voc_load_recs
 
 def parse_rec(filename):
     # classes = ['__background__',  # always index 0
@@ -38,38 +40,12 @@ def parse_rec(filename):
     return objects
 
 
-def voc_ap(rec, prec, use_07_metric=False):
-  """ ap = voc_ap(rec, prec, [use_07_metric])
-  Compute VOC AP given precision and recall.
-  If use_07_metric is true, uses the
-  VOC 07 11 point method (default:False).
-  """
-  if use_07_metric:
-    # 11 point metric
-    ap = 0.
-    for t in np.arange(0., 1.1, 0.1):
-      if np.sum(rec >= t) == 0:
-        p = 0
-      else:
-        p = np.max(prec[rec >= t])
-      ap = ap + p / 11.
-  else:
-    # correct AP calculation
-    # first append sentinel values at the end
-    mrec = np.concatenate(([0.], rec, [1.]))
-    mpre = np.concatenate(([0.], prec, [0.]))
-
-    # compute the precision envelope
-    for i in range(mpre.size - 1, 0, -1):
-      mpre[i - 1] = np.maximum(mpre[i - 1], mpre[i])
-
-    # to calculate area under PR curve, look for points
-    # where X axis (recall) changes value
-    i = np.where(mrec[1:] != mrec[:-1])[0]
-
-    # and sum (\Delta recall) * prec
-    ap = np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1])
-  return ap
+def load_recs(annopath, imagesetfile, imagenames, cachedir):
+  """Return the annotations of imagenames, {image name: parse_rec
+  objects}, from the cache pickle of imagesetfile in cachedir or parsed
+  from annopath."""
+  return voc_load_recs(annopath, imagesetfile, imagenames, cachedir,
+                       parse_rec=parse_rec)
 
 '''
 Pascal voc本身有difficult和非difficult, 设置use_diff=True, 测试所有样本, 否则只测试非difficult的
@@ -82,7 +58,10 @@ def mydataset_eval(detpath,
              cachedir,
              ovthresh=0.5,
              use_07_metric=False,
-             use_diff=True):
+             use_diff=True,
+             recs=None,
+             imagenames=None,
+             dets=None):
   """rec, prec, ap = voc_eval(detpath,
                               annopath,
                               imagesetfile,
@@ -102,40 +81,27 @@ def mydataset_eval(detpath,
   [ovthresh]: Overlap threshold (default = 0.5)
   [use_07_metric]: Whether to use VOC07's 11 point AP computation
       (default False)
+  [recs]: Annotations already loaded, as returned by parse_rec for each
+      image (e.g. by annotation_table.table_to_recs), annopath and
+      cachedir are not used then
+  [imagenames]: Images of imagesetfile, if already read
+  [dets]: image_ids, confidence and BB of the detections, as returned by
+      class_detections, detpath is not used then
   """
   # assumes detections are in detpath.format(classname)
   # assumes annotations are in annopath.format(imagename)
   # assumes imagesetfile is a text file with each line an image name
   # cachedir caches the annotations in a pickle file
 
-  # first load gt
-  if not os.path.isdir(cachedir):
-    os.mkdir(cachedir)
-  cachefile = os.path.join(cachedir, '%s_annots.pkl' % imagesetfile)
   # read list of images
-  with open(imagesetfile, 'r') as f:
-    lines = f.readlines()
-  imagenames = [x.strip() for x in lines]
-
-  if not os.path.isfile(cachefile):
-    # load annotations
-    recs = {}
-    for i, imagename in enumerate(imagenames):
-      recs[imagename] = parse_rec(annopath.format(imagename))
-      if i % 100 == 0:
-        print('Reading annotation for {:d}/{:d}'.format(
-          i + 1, len(imagenames)))
-    # save
-    print('Saving cached annotations to {:s}'.format(cachefile))
-    with open(cachefile, 'wb') as f:
-      pickle.dump(recs, f)
-  else:
-    # load
-    with open(cachefile, 'rb') as f:
-      try:
-        recs = pickle.load(f)
-      except:
-        recs = pickle.load(f, encoding='bytes')
+  if imagenames is None:
+    with open(imagesetfile, 'r') as f:
+      lines = f.readlines()
+    imagenames = [x.strip() for x in lines]
+
+  # first load gt
+  if recs is None:
+    recs = load_recs(annopath, imagesetfile, imagenames, cachedir)
 
   # extract gt objects for this class
   class_recs = {}
@@ -147,69 +113,30 @@ def mydataset_eval(detpath,
       difficult = np.array([False for x in R]).astype(np.bool)
     else:
       difficult = np.array([x['difficult'] for x in R]).astype(np.bool)
-    det = [False] * len(R)
     npos = npos + sum(~difficult)
     class_recs[imagename] = {'bbox': bbox,
-                             'difficult': difficult,
-                             'det': det}
+                             'difficult': difficult}
 
   # read dets
-  detfile = detpath.format(classname)
-  with open(detfile, 'r') as f:
-    lines = f.readlines()
-
-  splitlines = [x.strip().split(' ') for x in lines]
-  image_ids = [x[0] for x in splitlines] # if float(x[1]) > 0.5
-  confidence = np.array([float(x[1]) for x in splitlines])# if float(x[1]) > 0.5
-  BB = np.array([[float(z) for z in x[2:]] for x in splitlines])# if float(x[1]) > 0.5
-  nd = len(image_ids)
-  tp = np.zeros(nd)
-  fp = np.zeros(nd)
+  if dets is not None:
+    image_ids, confidence, BB = dets
+  else:
+    detfile = detpath.format(classname)
+    with open(detfile, 'r') as f:
+      lines = f.readlines()
+
+    splitlines = [x.strip().split(' ') for x in lines]
+    image_ids = [x[0] for x in splitlines] # if float(x[1]) > 0.5
+    confidence = np.array([float(x[1]) for x in splitlines])# if float(x[1]) > 0.5
+    BB = np.array([[float(z) for z in x[2:]] for x in splitlines])# if float(x[1]) > 0.5
   if BB.shape[0] > 0:
-
-    # sort by confidence *sort: from small to large 1 2 3 4*
-    # -0.9 -0.1
+    # sort by confidence
     sorted_ind = np.argsort(-confidence)
-    sorted_scores = np.sort(-confidence)
     BB = BB[sorted_ind, :]
     image_ids = [image_ids[x] for x in sorted_ind]
 
-    # go down dets and mark TPs and FPs
-    for d in range(nd):
-      R = class_recs[image_ids[d]]
-      bb = BB[d, :].astype(float)
-      ovmax = -np.inf
-      BBGT = R['bbox'].astype(float)
-
-      if BBGT.size > 0:
-        # compute overlaps
-        # intersection
-        ixmin = np.maximum(BBGT[:, 0], bb[0])
-        iymin = np.maximum(BBGT[:, 1], bb[1])
-        ixmax = np.minimum(BBGT[:, 2], bb[2])
-        iymax = np.minimum(BBGT[:, 3], bb[3])
-        iw = np.maximum(ixmax - ixmin + 1., 0.)
-        ih = np.maximum(iymax - iymin + 1., 0.)
-        inters = iw * ih
-
-        # union
-        uni = ((bb[2] - bb[0] + 1.) * (bb[3] - bb[1] + 1.) +
-               (BBGT[:, 2] - BBGT[:, 0] + 1.) *
-               (BBGT[:, 3] - BBGT[:, 1] + 1.) - inters)
-
-        overlaps = inters / uni
-        ovmax = np.max(overlaps)
-        jmax = np.argmax(overlaps)
-
-      if ovmax > ovthresh:
-        if not R['difficult'][jmax]:
-          if not R['det'][jmax]:
-            tp[d] = 1.
-            R['det'][jmax] = 1
-          else:
-            fp[d] = 1.
-      else:
-        fp[d] = 1.
+  # mark TPs and FPs
+  tp, fp = match_detections(class_recs, image_ids, BB, ovthresh)
   # compute precision recall
   fp = np.cumsum(fp)
   tp = np.cumsum(tp)
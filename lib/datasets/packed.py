@@ -0,0 +1,150 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Packed storage of a dataset's small files in a few large shard files.
+
+A pack with prefix P is made of the shards P.0.shard, P.1.shard, ... and of
+the index P.index.pkl, which maps every (kind, name) record, e.g.
+('image', '1000_1234'), to its (shard, offset, length, shape). Records hold
+the original file bytes, so images stay encoded; shape is the
+(height, width) of image records and None otherwise.
+
+Inside the code base a record is designated by a virtual path
+'P.pack:kind/name' (see packed_path), which imread and image_size accept
+as well as regular file paths.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import mmap
+import pickle
+
+import numpy as np
+import cv2
+import PIL.Image
+
+PACKED_SEP = '.pack:'
+
+
+def packed_path(prefix, kind, name):
+  """Return the virtual path of a record of the pack at prefix."""
+  return '{}{}{}/{}'.format(prefix, PACKED_SEP, kind, name)
+
+
+def _split_packed_path(path):
+  prefix, record = path.split(PACKED_SEP, 1)
+  kind, name = record.split('/', 1)
+  return prefix, kind, name
+
+
+def pack_files(prefix, records, shard_size=1 << 30, image_kinds=('image', 'label')):
+  """Write the files of records, an iterable of (kind, name, file path), to
+  the pack at prefix. A new shard is started once a shard holds
+  shard_size bytes.
+  """
+  index = {}
+  shard_id = 0
+  offset = 0
+  shard = open('{}.{}.shard'.format(prefix, shard_id), 'wb')
+  for kind, name, path in records:
+    with open(path, 'rb') as f:
+      data = f.read()
+    if offset > 0 and offset + len(data) > shard_size:
+      shard.close()
+      shard_id += 1
+      offset = 0
+      shard = open('{}.{}.shard'.format(prefix, shard_id), 'wb')
+    shape = None
+    if kind in image_kinds:
+      # PIL only reads the header
+      width, height = PIL.Image.open(path).size
+      shape = (height, width)
+    shard.write(data)
+    index[(kind, name)] = (shard_id, offset, len(data), shape)
+    offset += len(data)
+  shard.close()
+
+  with open(prefix + '.index.pkl', 'wb') as f:
+    pickle.dump({'num_shards': shard_id + 1, 'records': index}, f,
+                pickle.HIGHEST_PROTOCOL)
+  return index
+
+
+class PackedReader(object):
+  """Read the records of a pack through memory-mapped shards."""
+
+  def __init__(self, prefix):
+    self._prefix = prefix
+    with open(prefix + '.index.pkl', 'rb') as f:
+      index = pickle.load(f)
+    self._records = index['records']
+    self._num_shards = index['num_shards']
+    # Shards are mapped on first access, so that every process that
+    # receives the reader maps them itself
+    self._shards = {}
+
+  def __contains__(self, key):
+    return key in self._records
+
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['_shards'] = {}
+    return state
+
+  def _shard(self, shard_id):
+    shard = self._shards.get(shard_id)
+    if shard is None:
+      with open('{}.{}.shard'.format(self._prefix, shard_id), 'rb') as f:
+        shard = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      self._shards[shard_id] = shard
+    return shard
+
+  def shape(self, kind, name):
+    """Return the (height, width) of an image record."""
+    return self._records[(kind, name)][3]
+
+  def read(self, kind, name):
+    """Return the bytes of a record as a uint8 array backed by the shard."""
+    shard_id, offset, length, _ = self._records[(kind, name)]
+    if length == 0:
+      return np.zeros((0,), dtype=np.uint8)
+    return np.frombuffer(self._shard(shard_id), dtype=np.uint8,
+                         count=length, offset=offset)
+
+  def read_text(self, kind, name):
+    return self.read(kind, name).tobytes().decode('utf-8')
+
+  def imread(self, kind, name, flags=cv2.IMREAD_COLOR):
+    return cv2.imdecode(self.read(kind, name), flags)
+
+
+_readers = {}
+
+
+def get_reader(prefix):
+  """Return the reader of the pack at prefix, opened once per process."""
+  reader = _readers.get(prefix)
+  if reader is None:
+    reader = PackedReader(prefix)
+    _readers[prefix] = reader
+  return reader
+
+
+def imread(path, flags=cv2.IMREAD_COLOR):
+  """cv2.imread that also accepts virtual paths of packed records."""
+  if PACKED_SEP not in path:
+    return cv2.imread(path, flags)
+  prefix, kind, name = _split_packed_path(path)
+  return get_reader(prefix).imread(kind, name, flags)
+
+
+def image_size(path):
+  """Return the (width, height) of an image, like PIL's Image.size."""
+  if PACKED_SEP not in path:
+    return PIL.Image.open(path).size
+  prefix, kind, name = _split_packed_path(path)
+  height, width = get_reader(prefix).shape(kind, name)
+  return width, height
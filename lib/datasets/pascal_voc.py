@@ -18,7 +18,9 @@ import scipy.io as sio
 import pickle
 import subprocess
 import uuid
-from .voc_eval import voc_eval
+from .voc_eval import voc_eval, load_recs, eval_classes, class_detections, \
+  gt_from_recs
+from .ap_accumulator import APAccumulator
 from model.config import cfg
 
 
@@ -208,7 +210,7 @@ class pascal_voc(imdb):
       with open(filename, 'wt') as f:
         for im_ind, index in enumerate(self.image_index):
           dets = all_boxes[cls_ind][im_ind]
-          if dets == []:
+          if len(dets) == 0:
             continue
           # the VOCdevkit expects 1-based indices
           for k in range(dets.shape[0]):
@@ -217,7 +219,38 @@ class pascal_voc(imdb):
                            dets[k, 0] + 1, dets[k, 1] + 1,
                            dets[k, 2] + 1, dets[k, 3] + 1))
 
-  def _do_python_eval(self, output_dir='output'):
+  def _load_gt_recs(self):
+    """
+    Return the image names of the image set file and their annotations, as
+    voc_eval reads them.
+    """
+    annopath = os.path.join(
+      self._devkit_path,
+      'VOC' + self._year,
+      'Annotations',
+      '{:s}.xml')
+    imagesetfile = os.path.join(
+      self._devkit_path,
+      'VOC' + self._year,
+      'ImageSets',
+      'Main',
+      self._image_set + '.txt')
+    cachedir = os.path.join(self._devkit_path, 'annotations_cache')
+    with open(imagesetfile, 'r') as f:
+      imagenames = [x.strip() for x in f.readlines()]
+    return imagenames, load_recs(annopath, imagesetfile, imagenames, cachedir)
+
+  def evaluation_gt(self):
+    _, gt_recs = self._load_gt_recs()
+    return gt_from_recs(gt_recs, self.image_index, self._class_to_ind,
+                        self.config['use_diff'])
+
+  def ap_accumulator(self):
+    # The PASCAL VOC metric changed in 2010
+    use_07_metric = True if int(self._year) < 2010 else False
+    return APAccumulator(self.num_classes, 0.5, use_07_metric)
+
+  def _do_python_eval(self, output_dir='output', all_boxes=None):
     annopath = os.path.join(
       self._devkit_path,
       'VOC' + self._year,
@@ -236,13 +269,23 @@ class pascal_voc(imdb):
     print('VOC07 metric? ' + ('Yes' if use_07_metric else 'No'))
     if not os.path.isdir(output_dir):
       os.mkdir(output_dir)
-    for i, cls in enumerate(self._classes):
-      if cls == '__background__':
-        continue
+    # load the ground truth once, the workers share it
+    imagenames, gt_recs = self._load_gt_recs()
+
+    def eval_class(cls):
       filename = self._get_voc_results_file_template().format(cls)
-      rec, prec, ap = voc_eval(
+      dets = None
+      if all_boxes is not None:
+        dets = class_detections(all_boxes[self._class_to_ind[cls]],
+                                self.image_index)
+      return voc_eval(
         filename, annopath, imagesetfile, cls, cachedir, ovthresh=0.5,
-        use_07_metric=use_07_metric, use_diff=self.config['use_diff'])
+        use_07_metric=use_07_metric, use_diff=self.config['use_diff'],
+        recs=gt_recs, imagenames=imagenames, dets=dets)
+
+    classes = [cls for cls in self._classes if cls != '__background__']
+    results = eval_classes(eval_class, classes, cfg.TEST.EVAL_WORKERS)
+    for cls, (rec, prec, ap) in zip(classes, results):
       aps += [ap]
       print(('AP for {} = {:.4f}'.format(cls, ap)))
       with open(os.path.join(output_dir, cls + '_pr.pkl'), 'wb') as f:
@@ -289,6 +332,9 @@ class pascal_voc(imdb):
         filename = self._get_voc_results_file_template().format(cls)
         os.remove(filename)
 
+  def evaluate_in_memory(self, all_boxes, output_dir):
+    self._do_python_eval(output_dir, all_boxes)
+
   def competition_mode(self, on):
     if on:
       self.config['use_salt'] = False
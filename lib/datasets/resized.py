@@ -0,0 +1,82 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Images and parsing labels pre-resized to the training and testing scales.
+
+tools/resize_dataset.py writes every image of an imdb resized like
+utils.blob.resize_im_for_blob, and its parsing label resized with nearest
+interpolation, under <dir>/<target_size>_<max_size>/{image,label}/. The
+index <dir>/index.pkl maps the path of every source image to
+{(target_size, max_size): (image path, label path or None, im_scale)}.
+Images are stored as png, so a variant holds the very pixels the data
+layer would have computed.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import pickle
+
+import cv2
+from utils.blob import resize_im_for_blob
+from datasets.packed import imread
+
+
+def _index_file(out_dir):
+  return os.path.join(out_dir, 'index.pkl')
+
+
+_indexes = {}
+
+
+def load_index(out_dir):
+  """Return the index of the variants under out_dir, read once per process."""
+  index = _indexes.get(out_dir)
+  if index is None:
+    index = {}
+    if os.path.exists(_index_file(out_dir)):
+      with open(_index_file(out_dir), 'rb') as f:
+        index = pickle.load(f)
+    _indexes[out_dir] = index
+  return index
+
+
+def save_index(out_dir, records):
+  """Merge records, {source path: {(target_size, max_size): variant}}, into
+  the index of out_dir."""
+  index = load_index(out_dir)
+  for path, variants in records.items():
+    index.setdefault(path, {}).update(variants)
+  tmp_file = _index_file(out_dir) + '.tmp'
+  with open(tmp_file, 'wb') as f:
+    pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+  os.rename(tmp_file, _index_file(out_dir))
+
+
+def resize_image(task):
+  """Write the variants of one image, task is (out_dir, name, image path,
+  label path or None, [(target_size, max_size), ...]). Returns the image
+  path and its variants; meant for a multiprocessing pool.
+  """
+  out_dir, name, image_path, label_path, sizes = task
+  im = imread(image_path)
+  label = None
+  if label_path is not None:
+    label = imread(label_path, cv2.IMREAD_GRAYSCALE)
+  variants = {}
+  for target_size, max_size in sizes:
+    size_dir = os.path.join(out_dir, '{}_{}'.format(target_size, max_size))
+    im_resized, im_scale = resize_im_for_blob(im, target_size, max_size)
+    im_file = os.path.join(size_dir, 'image', name + '.png')
+    cv2.imwrite(im_file, im_resized)
+    label_file = None
+    if label is not None:
+      label_resized = cv2.resize(label, None, None, fx=im_scale, fy=im_scale,
+                                 interpolation=cv2.INTER_NEAREST)
+      label_file = os.path.join(size_dir, 'label', name + '.png')
+      cv2.imwrite(label_file, label_resized)
+    variants[(target_size, max_size)] = (im_file, label_file, im_scale)
+  return image_path, variants
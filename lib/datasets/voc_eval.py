@@ -10,6 +10,7 @@ from __future__ import print_function
 import xml.etree.ElementTree as ET
 import os
 import pickle
+import multiprocessing
 import numpy as np
 
 def parse_rec(filename):
@@ -54,8 +55,7 @@ def voc_ap(rec, prec, use_07_metric=False):
     mpre = np.concatenate(([0.], prec, [0.]))
 
     # compute the precision envelope
-    for i in range(mpre.size - 1, 0, -1):
-      mpre[i - 1] = np.maximum(mpre[i - 1], mpre[i])
+    mpre = np.maximum.accumulate(mpre[::-1])[::-1]
 
     # to calculate area under PR curve, look for points
     # where X axis (recall) changes value
@@ -66,6 +66,167 @@ def voc_ap(rec, prec, use_07_metric=False):
   return ap
 
 
+def match_detections(class_recs, image_ids, BB, ovthresh=0.5):
+  """tp, fp = match_detections(class_recs, image_ids, BB, [ovthresh])
+
+  Mark the detections of one class as true or false positives, the same
+  way as going down the detections one by one does: a detection is matched
+  to the ground truth box it overlaps most, the first detection matched to
+  a box is a TP and the next ones are FPs, detections matched to difficult
+  boxes are neither.
+
+  class_recs: {image name: {'bbox', 'difficult'}} ground truth of the class
+  image_ids: image name of each detection
+  BB: detection boxes, sorted by decreasing confidence
+  """
+  nd = len(image_ids)
+  if nd == 0:
+    return np.zeros(nd), np.zeros(nd)
+  ovmax = np.full((nd,), -np.inf)
+  jmax = np.zeros((nd,), dtype=np.int64)
+  difficult = np.zeros((nd,), dtype=np.bool_)
+
+  # group the detections by image, keeping their order
+  names, image_inds = np.unique(image_ids, return_inverse=True)
+  order = np.argsort(image_inds, kind='mergesort')
+  bounds = np.searchsorted(image_inds[order], np.arange(len(names) + 1))
+  for k, imagename in enumerate(names):
+    R = class_recs[imagename]
+    BBGT = R['bbox'].astype(float)
+    if BBGT.size == 0:
+      continue
+    inds = order[bounds[k]:bounds[k + 1]]
+    bb = BB[inds, :].astype(float)
+
+    # overlaps between the detections and the gt boxes of the image
+    # intersection
+    ixmin = np.maximum(BBGT[None, :, 0], bb[:, 0:1])
+    iymin = np.maximum(BBGT[None, :, 1], bb[:, 1:2])
+    ixmax = np.minimum(BBGT[None, :, 2], bb[:, 2:3])
+    iymax = np.minimum(BBGT[None, :, 3], bb[:, 3:4])
+    iw = np.maximum(ixmax - ixmin + 1., 0.)
+    ih = np.maximum(iymax - iymin + 1., 0.)
+    inters = iw * ih
+
+    # union
+    uni = ((bb[:, 2:3] - bb[:, 0:1] + 1.) * (bb[:, 3:4] - bb[:, 1:2] + 1.) +
+           (BBGT[None, :, 2] - BBGT[None, :, 0] + 1.) *
+           (BBGT[None, :, 3] - BBGT[None, :, 1] + 1.) - inters)
+
+    overlaps = inters / uni
+    ovmax[inds] = np.max(overlaps, axis=1)
+    jmax[inds] = np.argmax(overlaps, axis=1)
+    difficult[inds] = R['difficult'][jmax[inds]]
+
+  hit = ovmax > ovthresh
+  counted = np.where(hit & ~difficult)[0]
+  # the first detection of each gt box is the TP, the later ones duplicates
+  gt_keys = image_inds[counted].astype(np.int64) * (jmax.max() + 1) + jmax[counted]
+  _, first = np.unique(gt_keys, return_index=True)
+  tp = np.zeros(nd)
+  tp[counted[first]] = 1.
+  fp = (~hit).astype(float)
+  fp[counted] = 1.
+  fp[counted[first]] = 0.
+  return tp, fp
+
+
+def load_recs(annopath, imagesetfile, imagenames, cachedir,
+              parse_rec=parse_rec):
+  """Return the annotations of imagenames, {image name: parse_rec
+  objects}, from the cache pickle of imagesetfile in cachedir or parsed
+  from annopath."""
+  if not os.path.isdir(cachedir):
+    os.mkdir(cachedir)
+  cachefile = os.path.join(cachedir, '%s_annots.pkl' % imagesetfile)
+  if not os.path.isfile(cachefile):
+    # load annotations
+    recs = {}
+    for i, imagename in enumerate(imagenames):
+      recs[imagename] = parse_rec(annopath.format(imagename))
+      if i % 100 == 0:
+        print('Reading annotation for {:d}/{:d}'.format(
+          i + 1, len(imagenames)))
+    # save
+    print('Saving cached annotations to {:s}'.format(cachefile))
+    with open(cachefile, 'wb') as f:
+      pickle.dump(recs, f)
+  else:
+    # load
+    with open(cachefile, 'rb') as f:
+      try:
+        recs = pickle.load(f)
+      except:
+        recs = pickle.load(f, encoding='bytes')
+  return recs
+
+
+def gt_from_recs(recs, image_index, class_to_ind, use_diff=False):
+  """Return the ground truth of recs that voc_eval compares the detections
+  of the images of image_index to, as one dict per image with 'boxes',
+  'gt_classes', 'seg_areas' and 'difficult'. voc_eval adds 1 to the
+  detections, so the boxes are the annotated ones minus 1, which compares
+  them to all_boxes with the same overlaps."""
+  gt = []
+  for index in image_index:
+    objs = [obj for obj in recs[index] if obj['name'] in class_to_ind]
+    boxes = np.array([obj['bbox'] for obj in objs],
+                     dtype=np.float64).reshape((-1, 4)) - 1.
+    difficult = np.array([obj['difficult'] for obj in objs],
+                         dtype=np.bool_).reshape((-1,))
+    if use_diff:
+      difficult[:] = False
+    gt.append({'boxes': boxes,
+               'gt_classes': np.array([class_to_ind[obj['name']] for obj in objs],
+                                      dtype=np.int32).reshape((-1,)),
+               'seg_areas': (boxes[:, 2] - boxes[:, 0] + 1.) *
+                            (boxes[:, 3] - boxes[:, 1] + 1.),
+               'difficult': difficult})
+  return gt
+
+
+# per-class evaluation function of the pool of eval_classes
+_pool_eval = None
+
+def _eval_class_in_pool(classname):
+  return _pool_eval(classname)
+
+
+def eval_classes(eval_class, classnames, num_workers=1):
+  """Return [eval_class(c) for c in classnames], the classes being spread
+  over num_workers forked processes (one per cpu if 0). The workers share
+  whatever eval_class refers to, e.g. the annotations, without copying it.
+  """
+  if num_workers <= 0:
+    num_workers = multiprocessing.cpu_count()
+  num_workers = min(num_workers, len(classnames))
+  if num_workers <= 1:
+    return [eval_class(c) for c in classnames]
+  global _pool_eval
+  _pool_eval = eval_class
+  pool = multiprocessing.Pool(num_workers)
+  try:
+    return pool.map(_eval_class_in_pool, classnames, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+    _pool_eval = None
+
+
+def class_detections(boxes, image_index):
+  """Return the image_ids, confidence and BB of the detections of one
+  class as voc_eval reads them from a results file (1-based boxes), without
+  the rounding of the file. boxes[i] is [] or the N x 5 detections of image
+  image_index[i]."""
+  image_ids = [index for index, dets in zip(image_index, boxes)
+               for _ in range(len(dets))]
+  dets = [dets for dets in boxes if len(dets) > 0]
+  dets = np.vstack(dets).astype(float) if dets else np.zeros((0, 5))
+  confidence = dets[:, -1]
+  BB = dets[:, :4] + 1
+  return image_ids, confidence, BB
+
+
 def voc_eval(detpath,
              annopath,
              imagesetfile,
@@ -73,7 +234,10 @@ def voc_eval(detpath,
              cachedir,
              ovthresh=0.5,
              use_07_metric=False,
-             use_diff=False):
+             use_diff=False,
+             recs=None,
+             imagenames=None,
+             dets=None):
   """rec, prec, ap = voc_eval(detpath,
                               annopath,
                               imagesetfile,
@@ -93,40 +257,26 @@ def voc_eval(detpath,
   [ovthresh]: Overlap threshold (default = 0.5)
   [use_07_metric]: Whether to use VOC07's 11 point AP computation
       (default False)
+  [recs]: Annotations already loaded by load_recs, annopath and cachedir
+      are not used then
+  [imagenames]: Images of imagesetfile, if already read
+  [dets]: image_ids, confidence and BB of the detections, as returned by
+      class_detections, detpath is not used then
   """
   # assumes detections are in detpath.format(classname)
   # assumes annotations are in annopath.format(imagename)
   # assumes imagesetfile is a text file with each line an image name
   # cachedir caches the annotations in a pickle file
 
-  # first load gt
-  if not os.path.isdir(cachedir):
-    os.mkdir(cachedir)
-  cachefile = os.path.join(cachedir, '%s_annots.pkl' % imagesetfile)
   # read list of images
-  with open(imagesetfile, 'r') as f:
-    lines = f.readlines()
-  imagenames = [x.strip() for x in lines]
+  if imagenames is None:
+    with open(imagesetfile, 'r') as f:
+      lines = f.readlines()
+    imagenames = [x.strip() for x in lines]
 
-  if not os.path.isfile(cachefile):
-    # load annotations
-    recs = {}
-    for i, imagename in enumerate(imagenames):
-      recs[imagename] = parse_rec(annopath.format(imagename))
-      if i % 100 == 0:
-        print('Reading annotation for {:d}/{:d}'.format(
-          i + 1, len(imagenames)))
-    # save
-    print('Saving cached annotations to {:s}'.format(cachefile))
-    with open(cachefile, 'wb') as f:
-      pickle.dump(recs, f)
-  else:
-    # load
-    with open(cachefile, 'rb') as f:
-      try:
-        recs = pickle.load(f)
-      except:
-        recs = pickle.load(f, encoding='bytes')
+  # first load gt
+  if recs is None:
+    recs = load_recs(annopath, imagesetfile, imagenames, cachedir)
 
   # extract gt objects for this class
   class_recs = {}
@@ -138,69 +288,31 @@ def voc_eval(detpath,
       difficult = np.array([False for x in R]).astype(np.bool)
     else:
       difficult = np.array([x['difficult'] for x in R]).astype(np.bool)
-    det = [False] * len(R)
     npos = npos + sum(~difficult)
     class_recs[imagename] = {'bbox': bbox,
-                             'difficult': difficult,
-                             'det': det}
+                             'difficult': difficult}
 
   # read dets
-  detfile = detpath.format(classname)
-  with open(detfile, 'r') as f:
-    lines = f.readlines()
-
-  splitlines = [x.strip().split(' ') for x in lines]
-  image_ids = [x[0] for x in splitlines]
-  confidence = np.array([float(x[1]) for x in splitlines])
-  BB = np.array([[float(z) for z in x[2:]] for x in splitlines])
+  if dets is not None:
+    image_ids, confidence, BB = dets
+  else:
+    detfile = detpath.format(classname)
+    with open(detfile, 'r') as f:
+      lines = f.readlines()
 
-  nd = len(image_ids)
-  tp = np.zeros(nd)
-  fp = np.zeros(nd)
+    splitlines = [x.strip().split(' ') for x in lines]
+    image_ids = [x[0] for x in splitlines]
+    confidence = np.array([float(x[1]) for x in splitlines])
+    BB = np.array([[float(z) for z in x[2:]] for x in splitlines])
 
   if BB.shape[0] > 0:
     # sort by confidence
     sorted_ind = np.argsort(-confidence)
-    sorted_scores = np.sort(-confidence)
     BB = BB[sorted_ind, :]
     image_ids = [image_ids[x] for x in sorted_ind]
 
-    # go down dets and mark TPs and FPs
-    for d in range(nd):
-      R = class_recs[image_ids[d]]
-      bb = BB[d, :].astype(float)
-      ovmax = -np.inf
-      BBGT = R['bbox'].astype(float)
-
-      if BBGT.size > 0:
-        # compute overlaps
-        # intersection
-        ixmin = np.maximum(BBGT[:, 0], bb[0])
-        iymin = np.maximum(BBGT[:, 1], bb[1])
-        ixmax = np.minimum(BBGT[:, 2], bb[2])
-        iymax = np.minimum(BBGT[:, 3], bb[3])
-        iw = np.maximum(ixmax - ixmin + 1., 0.)
-        ih = np.maximum(iymax - iymin + 1., 0.)
-        inters = iw * ih
-
-        # union
-        uni = ((bb[2] - bb[0] + 1.) * (bb[3] - bb[1] + 1.) +
-               (BBGT[:, 2] - BBGT[:, 0] + 1.) *
-               (BBGT[:, 3] - BBGT[:, 1] + 1.) - inters)
-
-        overlaps = inters / uni
-        ovmax = np.max(overlaps)
-        jmax = np.argmax(overlaps)
-
-      if ovmax > ovthresh:
-        if not R['difficult'][jmax]:
-          if not R['det'][jmax]:
-            tp[d] = 1.
-            R['det'][jmax] = 1
-          else:
-            fp[d] = 1.
-      else:
-        fp[d] = 1.
+  # mark TPs and FPs
+  tp, fp = match_detections(class_recs, image_ids, BB, ovthresh)
 
   # compute precision recall
   fp = np.cumsum(fp)
@@ -16,8 +16,29 @@ from utils.bbox import bbox_overlaps
 from model.bbox_transform import bbox_transform
 import torch
 
-def anchor_target_layer(rpn_cls_score, gt_boxes, im_info, _feat_stride, all_anchors, num_anchors):
-  """Same as the anchor target layer in original Fast/er RCNN """
+def anchor_target_layer(rpn_cls_score, gt_boxes, im_info, _feat_stride, all_anchors, num_anchors,
+                        gt_batch_inds=None):
+  """Same as the anchor target layer in original Fast/er RCNN
+
+  For a batch of several images, im_info has one row per image and
+  gt_batch_inds gives the image each ground-truth box belongs to. Targets
+  are computed for every image on its own and stacked along the batch axis.
+  """
+  im_info = np.asarray(im_info).reshape((-1, 3))
+  num_images = rpn_cls_score.shape[0]
+  if num_images == 1:
+    return _anchor_target_layer_single(rpn_cls_score, gt_boxes, im_info[0], all_anchors, num_anchors)
+
+  targets = []
+  for i in range(num_images):
+    im_gt_boxes = gt_boxes[gt_batch_inds == i, :]
+    targets.append(_anchor_target_layer_single(rpn_cls_score[i:i + 1], im_gt_boxes, im_info[i],
+                                               all_anchors, num_anchors))
+  return tuple(np.concatenate(t, axis=0) for t in zip(*targets))
+
+
+def _anchor_target_layer_single(rpn_cls_score, gt_boxes, im_info, all_anchors, num_anchors):
+  """Compute the anchor targets of a single image."""
   A = num_anchors
   total_anchors = all_anchors.shape[0]
   K = total_anchors / num_anchors
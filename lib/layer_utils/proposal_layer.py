@@ -20,16 +20,37 @@ from torch.autograd import Variable
 def proposal_layer(rpn_cls_prob, rpn_bbox_pred, im_info, cfg_key, _feat_stride, anchors, num_anchors):
   """A simplified version compared to fast/er RCNN
      For details please see the technical report
+
+  im_info holds one (height, width, scale) row per image in the batch; the
+  proposals of every image are selected independently and tagged with the
+  index of the image they belong to.
   """
   if type(cfg_key) == bytes:
       cfg_key = cfg_key.decode('utf-8')
+  im_info = np.asarray(im_info).reshape((-1, 3))
+  num_images = rpn_cls_prob.size(0)
+
+  blobs = []
+  all_scores = []
+  for i in range(num_images):
+    blob, scores = _proposal_layer_single(rpn_cls_prob[i:i + 1], rpn_bbox_pred[i:i + 1],
+                                          im_info[i], cfg_key, anchors, num_anchors, i)
+    blobs.append(blob)
+    all_scores.append(scores)
+  if num_images == 1:
+    return blobs[0], all_scores[0]
+  return torch.cat(blobs, 0), torch.cat(all_scores, 0)
+
+
+def _proposal_layer_single(rpn_cls_prob, rpn_bbox_pred, im_info, cfg_key, anchors, num_anchors, batch_ind):
+  """Select the proposals of a single image of the batch."""
   pre_nms_topN = cfg[cfg_key].RPN_PRE_NMS_TOP_N
   post_nms_topN = cfg[cfg_key].RPN_POST_NMS_TOP_N
   nms_thresh = cfg[cfg_key].RPN_NMS_THRESH
 
   # Get the scores and bounding boxes
   scores = rpn_cls_prob[:, :, :, num_anchors:]
-  rpn_bbox_pred = rpn_bbox_pred.view((-1, 4))
+  rpn_bbox_pred = rpn_bbox_pred.contiguous().view((-1, 4))
   scores = scores.contiguous().view(-1, 1)
   proposals = bbox_transform_inv(anchors, rpn_bbox_pred)
   proposals = clip_boxes(proposals, im_info[:2])
@@ -50,10 +71,8 @@ def proposal_layer(rpn_cls_prob, rpn_bbox_pred, im_info, cfg_key, _feat_stride,
   proposals = proposals[keep, :]  # test(300,4)
   scores = scores[keep,]
 
-  # Our RPN implementation only supports a single input image,
-  # so all batch inds are 0
-  # 即这些roi都属于一个图片，如果后续实现了多个输入图片，这个roi要区分它属于哪一个图片(即哪一个batch)
-  batch_inds = Variable(proposals.data.new(proposals.size(0), 1).zero_())
+  # 第0列记录这些roi属于batch中的哪一张图片
+  batch_inds = Variable(proposals.data.new(proposals.size(0), 1).fill_(batch_ind))
   blob = torch.cat((batch_inds, proposals), 1)
 
   return blob, scores
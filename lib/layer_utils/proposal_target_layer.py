@@ -19,52 +19,73 @@ import torch.nn.functional as F
 import torch
 from torch.autograd import Variable
 
-def proposal_target_layer(rpn_rois, rpn_scores, gt_boxes, _num_classes, parsing_labels=None):
+def proposal_target_layer(rpn_rois, rpn_scores, gt_boxes, _num_classes, parsing_labels=None,
+                          gt_batch_inds=None, num_images=1):
   """
   Assign object detection proposals to ground-truth targets. Produces proposal
   classification labels and bounding-box regression targets.
-  """
 
-  # Proposal ROIs (0, x1, y1, x2, y2) coming from RPN
-  # (i.e., rpn.proposal_layer.ProposalLayer), or any other source
-  all_rois = rpn_rois  # (2000, 5) 训练时RPN_POST_NMS_TOP_N=2000 测试时RPN_POST_NMS_TOP_N=300 (300, 5)
-  all_scores = rpn_scores  # (2000, 1)
-
-  # Include ground-truth boxes in the set of candidate rois
-  # 训练时把gtbox也送到后面的fast进行分类和回归
-  if cfg.TRAIN.USE_GT:
-    #  设该张图片gtbox有15个  gt_boxes(15, 5) 0-3是x1 y1 x2 y2 4是所属cls
-    zeros = rpn_rois.data.new(gt_boxes.shape[0], 1)  # 假zeros(15,1)个0
-    all_rois = torch.cat(
-      (all_rois, torch.cat((zeros, gt_boxes[:, :-1]), 1)), 0)  # (15, 1+4) -> (2000+15, 1+4) 忽略gt_boxes的cls 只考虑是不是object
-    # not sure if it a wise appending, but anyway i am not using it
-    all_scores = torch.cat((all_scores, zeros), 0)  # (2000, 1) -> (2000+15, 1)
-
-  num_images = 1
+  With several images in the minibatch, RoIs are sampled for every image
+  against its own ground-truth boxes (gt_batch_inds gives the image of each
+  box) and TRAIN.BATCH_SIZE is split evenly between the images.
+  """
   rois_per_image = cfg.TRAIN.BATCH_SIZE / num_images
   fg_rois_per_image = int(round(cfg.TRAIN.FG_FRACTION * rois_per_image))  # 0.25*256
 
-  # Sample rois with classification labels and bounding box regression
-  # targets
+  samples = []
+  for i in range(num_images):
+    # Proposal ROIs (0, x1, y1, x2, y2) coming from RPN
+    # (i.e., rpn.proposal_layer.ProposalLayer), or any other source
+    if num_images == 1:
+      all_rois = rpn_rois  # (2000, 5) 训练时RPN_POST_NMS_TOP_N=2000 测试时RPN_POST_NMS_TOP_N=300 (300, 5)
+      all_scores = rpn_scores  # (2000, 1)
+      im_gt_boxes = gt_boxes
+      im_parsing_labels = parsing_labels
+    else:
+      roi_inds = (rpn_rois.data[:, 0] == i).nonzero().view(-1)
+      gt_inds = torch.from_numpy(np.where(gt_batch_inds == i)[0]).long().cuda()
+      all_rois = rpn_rois[roi_inds]
+      all_scores = rpn_scores[roi_inds]
+      im_gt_boxes = gt_boxes[gt_inds]
+      im_parsing_labels = parsing_labels[i:i + 1] if parsing_labels is not None else None
+
+    # Include ground-truth boxes in the set of candidate rois
+    # 训练时把gtbox也送到后面的fast进行分类和回归
+    if cfg.TRAIN.USE_GT:
+      #  设该张图片gtbox有15个  gt_boxes(15, 5) 0-3是x1 y1 x2 y2 4是所属cls
+      batch_inds = Variable(all_rois.data.new(im_gt_boxes.size(0), 1).fill_(i))
+      all_rois = torch.cat(
+        (all_rois, torch.cat((batch_inds, im_gt_boxes[:, :4]), 1)), 0)  # (15, 1+4) -> (2000+15, 1+4) 忽略gt_boxes的cls 只考虑是不是object
+      # not sure if it a wise appending, but anyway i am not using it
+      all_scores = torch.cat((all_scores, batch_inds * 0), 0)  # (2000, 1) -> (2000+15, 1)
+
+    # Sample rois with classification labels and bounding box regression
+    # targets
+    if cfg.DO_PARSING:
+      samples.append(_sample_rois(
+        all_rois, all_scores, im_gt_boxes, fg_rois_per_image,
+        rois_per_image, _num_classes, im_parsing_labels))
+    else:
+      samples.append(_sample_rois(
+        all_rois, all_scores, im_gt_boxes, fg_rois_per_image,
+        rois_per_image, _num_classes))
+
+  if num_images == 1:
+    sample = samples[0]
+  else:
+    sample = [_cat_samples(parts) for parts in zip(*samples)]
+
   if cfg.SUB_CATEGORY:
     if cfg.DO_PARSING:
-      labels, sub_labels, rois, roi_scores, bbox_targets, bbox_inside_weights, mask_unit = _sample_rois(
-        all_rois, all_scores, gt_boxes, fg_rois_per_image,
-        rois_per_image, _num_classes, parsing_labels)
+      labels, sub_labels, rois, roi_scores, bbox_targets, bbox_inside_weights, mask_unit = sample
     else:
-      labels, sub_labels, rois, roi_scores, bbox_targets, bbox_inside_weights = _sample_rois(
-        all_rois, all_scores, gt_boxes, fg_rois_per_image,
-        rois_per_image, _num_classes)
+      labels, sub_labels, rois, roi_scores, bbox_targets, bbox_inside_weights = sample
     sub_labels = sub_labels.view(-1, 1)
   else:
     if cfg.DO_PARSING:
-      labels, rois, roi_scores, bbox_targets, bbox_inside_weights, mask_unit = _sample_rois(
-        all_rois, all_scores, gt_boxes, fg_rois_per_image,
-        rois_per_image, _num_classes, parsing_labels)
+      labels, rois, roi_scores, bbox_targets, bbox_inside_weights, mask_unit = sample
     else:
-      labels, rois, roi_scores, bbox_targets, bbox_inside_weights = _sample_rois(
-        all_rois, all_scores, gt_boxes, fg_rois_per_image,
-        rois_per_image, _num_classes)
+      labels, rois, roi_scores, bbox_targets, bbox_inside_weights = sample
 
   rois = rois.view(-1, 5)
   roi_scores = roi_scores.view(-1)
@@ -88,6 +109,12 @@ def proposal_target_layer(rpn_rois, rpn_scores, gt_boxes, _num_classes, parsing_
     else:
       return rois, roi_scores, labels, Variable(bbox_targets), Variable(bbox_inside_weights), Variable(bbox_outside_weights)
 
+def _cat_samples(parts):
+  """Concatenate one output of _sample_rois over the images of a batch."""
+  if isinstance(parts[0], dict):
+    return {k: torch.cat([p[k] for p in parts], 0) for k in parts[0]}
+  return torch.cat(parts, 0)
+
 #  bbox_target_data (256, 5) 类别和4个回归值
 #  函数作用，产生两个（len(rois),4*21）大小的矩阵，其中一个对fg-roi对应引索行的对应类别的4个位置填上（dx,dy,dw,dh），
 #  另一个对fg-roi对应引索行的对应类别的4个位置填上（1,1,1,1）
@@ -170,30 +197,35 @@ def _compute_targets(ex_rois, gt_rois, labels):
   return torch.cat(
     [labels.unsqueeze(1), targets], 1)  # (128, 5) 类别和4个回归值
 
-def gen_mask_parsing_labels(parsing_labels, mask_rois):
-  # parsing_labels (48, 320, 320)  mask_rois (48, 5)
-  # rois = rois.detach()
-
-  x1 = mask_rois[:, 1::4]
-  y1 = mask_rois[:, 2::4]
-  x2 = mask_rois[:, 3::4]
-  y2 = mask_rois[:, 4::4]
-
-  height = parsing_labels.size(1)
-  width = parsing_labels.size(2)
-  # affine theta
-  theta = Variable(mask_rois.data.new(mask_rois.size(0), 2, 3).zero_())
-  theta[:, 0, 0] = (x2 - x1) / (width - 1)
-  theta[:, 0, 2] = (x1 + x2 - width + 1) / (width - 1)
-  theta[:, 1, 1] = (y2 - y1) / (height - 1)
-  theta[:, 1, 2] = (y1 + y2 - height + 1) / (height - 1)
+def gen_mask_parsing_labels(parsing_labels, mask_rois, mask_cls_labels):
+  """Binary mask targets of the foreground RoIs.
+
+  parsing_labels is the (H, W) class index map of the image. Every RoI is
+  resampled to a POOLING_SIZE * 8 square grid with nearest sampling (the
+  grid of F.affine_grid, corners on the box corners) and compared to the
+  class of the RoI. Samples outside of the image are background.
+  Returns a (num_rois, 1, size, size) float Variable.
+  """
+  rois = mask_rois.data
+  labels = parsing_labels.data.view(-1)
+  height = parsing_labels.size(0)
+  width = parsing_labels.size(1)
   pre_pool_size = cfg.POOLING_SIZE * 8
-  grid = F.affine_grid(theta, torch.Size((mask_rois.size(0), 1, pre_pool_size, pre_pool_size)))
-  mask_parsing_labels = F.grid_sample(parsing_labels.unsqueeze(1), grid) # (48,1, 320, 320)
-  mask_parsing_labels = torch.round(mask_parsing_labels)
-  # mask_parsing_labels[mask_parsing_labels >=0.5] = 1
-  # mask_parsing_labels[mask_parsing_labels < 0.5] = 0
-  return mask_parsing_labels
+  steps = torch.arange(0, pre_pool_size).type_as(rois) / (pre_pool_size - 1)
+  xs = torch.round(rois[:, 1:2] + (rois[:, 3:4] - rois[:, 1:2]) * steps.view(1, -1)).long()
+  ys = torch.round(rois[:, 2:3] + (rois[:, 4:5] - rois[:, 2:3]) * steps.view(1, -1)).long()
+  valid_x = ((xs >= 0) * (xs < width)).float()
+  valid_y = ((ys >= 0) * (ys < height)).float()
+  xs = xs.clamp(0, width - 1)
+  ys = ys.clamp(0, height - 1)
+  # (num_rois, size, size) flat indices into the label map
+  inds = ys.unsqueeze(2) * width + xs.unsqueeze(1)
+  sampled = labels[inds.view(-1)].view(inds.size()).long()
+  cls = mask_cls_labels.data.long().view(-1, 1, 1)
+  mask = (sampled == cls.expand_as(sampled)).float()
+  mask = mask * valid_y.unsqueeze(2).expand_as(mask) * valid_x.unsqueeze(1).expand_as(mask)
+  return Variable(mask.unsqueeze(1))
+
 def _sample_rois(all_rois, all_scores, gt_boxes, fg_rois_per_image, rois_per_image, num_classes, parsing_labels=None):
   """Generate a random sample of RoIs comprising foreground and background
   examples.
@@ -243,15 +275,8 @@ def _sample_rois(all_rois, all_scores, gt_boxes, fg_rois_per_image, rois_per_ima
     mask_cls_labels = labels[fg_inds]#.contiguous()
     #print(mask_cls_labels.size())
     assert parsing_labels.size(0) == 1
-    # parsing_labels (48, 320, 320) -> (48, 1, 28, 28)
-    # TODO : parsing_labels = parsing_labels[0][gt_assignment[fg_inds], :, :]
-    # gt_assignment只是指定的gt box序号，但是label是对应gtbox的第五个维度，也就是说第1个box的label不一定是1
-    # print (gt_assignment.size(), labels.size())
-    # print (type(gt_assignment), type(labels))
-    parsing_labels = parsing_labels[0][labels.data.long()[fg_inds], :, :]  # batch channel h w  batch == 1
-    #print(parsing_labels.size())
-
-    mask_parsing_labels = gen_mask_parsing_labels(parsing_labels, mask_rois)
+    # parsing_labels (1, h, w) -> (64, 1, 28*8, 28*8)
+    mask_parsing_labels = gen_mask_parsing_labels(parsing_labels[0], mask_rois, mask_cls_labels)
     #print(mask_parsing_labels.size())
     mask_unit = {}
     mask_unit['mask_rois'] = mask_rois
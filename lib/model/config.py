@@ -53,6 +53,44 @@ __C.TRAIN.USE_GT = False
 # GPU memory
 __C.TRAIN.ASPECT_GROUPING = False
 
+# Whether to batch images of similar scaled size together (see
+# roi_data_layer.bucketing), which limits the padding of multi-image
+# minibatches. Takes precedence over ASPECT_GROUPING
+__C.TRAIN.BUCKET_SAMPLING = False
+
+# Size in pixels of the (height, width) buckets used by BUCKET_SAMPLING
+__C.TRAIN.BUCKET_SIZE = 32
+
+# Whether to store the training roidb as concatenated arrays
+# (see roi_data_layer.compact_roidb) instead of a list of dicts
+__C.TRAIN.COMPACT_ROIDB = False
+
+# Whether to load the roidb entries on first use (see
+# roi_data_layer.lazy_roidb) instead of parsing them all before training.
+# The imdb has to implement load_roidb_entry. Images with an invalid
+# annotation or no usable RoI are left out of the sampling once loaded
+__C.TRAIN.LAZY_ROIDB = False
+
+# Number of entries a lazy roidb keeps in memory
+__C.TRAIN.LAZY_ROIDB_CACHE = 10000
+
+# Build minibatches in background worker processes while the network trains
+__C.TRAIN.USE_PREFETCH = False
+
+# Number of worker processes used when USE_PREFETCH is on
+__C.TRAIN.PREFETCH_WORKERS = 4
+
+# Maximum number of minibatches being prepared ahead of the training loop
+__C.TRAIN.PREFETCH_QUEUE_SIZE = 8
+
+# Memory budget in MB of the decoded image cache of the data layer
+# (see utils.image_cache), 0 to disable. Each prefetch worker has its own
+__C.TRAIN.IMAGE_CACHE_MB = 0
+
+# Directory of the on-disk tier of the decoded image cache, shared by the
+# prefetch workers and kept between runs. Empty to disable
+__C.TRAIN.IMAGE_CACHE_DIR = ''
+
 # The number of snapshots kept, older ones are deleted to save space
 __C.TRAIN.SNAPSHOT_KEPT = 10 #3
 
@@ -292,6 +330,21 @@ __C.RPN_CHANNELS = 512
 # 如果为true，则清除test的结果，重新test然后计算ap等，否则则利用之前的结果，直接计算ap等
 __C.TEST.CLEAN_PRE_RESULT = True
 __C.TEST.IOU_THRESH = 0.5
+# Number of processes evaluating the classes in _do_python_eval, 1 to
+# evaluate them in turn and 0 for one per cpu. The workers are forked, so
+# only use several from a process that has not initialized CUDA
+__C.TEST.EVAL_WORKERS = 1
+# Evaluate the detections with imdb.evaluate_in_memory, without writing the
+# per-class results files
+__C.TEST.EVAL_IN_MEMORY = False
+# Also report the COCO-style AP@[.5:.95] and small / medium / large APs
+__C.TEST.COCO_STYLE_EVAL = False
+# Track the AP while testing and print it every that many images (0: off)
+__C.TEST.STREAMING_AP = 0
+# Also save the top-N raw detections of each class per image, before the
+# threshold and NMS, as float16 in raw_detections.pkl (0: off), see
+# tools/sweep_postprocess.py
+__C.TEST.RAW_CACHE_TOP_N = 0
 __C.FC6_IN_CHANNEL = 512
 __C.FC7_OUT_CHANNEL = 4096
 __C.FIX_FEAT = False
@@ -300,6 +353,18 @@ __C.SUB_CATEGORY = False
 __C.LOSS_SUB_CATEGORY_W = 1.
 __C.ZDF_GAUSSIAN = False
 __C.DO_PARSING = False
+# Read images, parsing labels and annotations of mydataset from the pack
+# written by tools/pack_dataset.py instead of from the individual files
+__C.USE_PACKED_DATA = False
+# Directory written by tools/resize_dataset.py, images that have a variant at
+# the wanted scale are read from it instead of being resized. Empty to disable
+__C.RESIZED_DIR = ''
+# Decode JPEG images at 1/2, 1/4 or 1/8 of their resolution when they are
+# downscaled at least that much anyway (see utils.blob.reduced_imread_flags)
+__C.REDUCED_DECODE = False
+# Read the annotations of mydataset, for training and evaluation, from the
+# table written by tools/build_annotation_table.py
+__C.USE_ANNOTATION_TABLE = False
 __C.LIGHT_RCNN = False
 
 def get_output_dir(imdb, weights_filename):
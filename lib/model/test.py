@@ -16,10 +16,14 @@ except ImportError:
   import pickle
 import os
 import math
+import multiprocessing
 
 from utils.timer import Timer
 from model.nms_wrapper import nms
-from utils.blob import im_list_to_blob
+from utils.blob import resize_im_for_blob, BlobBuffer, get_im_scale, \
+  reduced_imread_flags, resize_im_to_scale
+from datasets.packed import imread
+from datasets.resized import load_index
 
 from model.config import cfg, get_output_dir
 from model.bbox_transform import clip_boxes, bbox_transform_inv
@@ -28,44 +32,48 @@ import torch
 label_map = ['__background__', 'Hat', 'Hair', 'Glove', 'Sunglasses', 'Upper-clothes', 'Dress', 'Coat', 'Socks',
                    'Pants', 'Jumpsuits', 'Scarf', 'Skirt', 'Face', 'Left-arm', 'Right-arm', 'Left-leg', 'Right-leg',
                    'Left-shoe', 'Right-shoe']
-def _get_image_blob(im):
+# Input blobs for testing are built into reused storage
+_blob_buffer = None
+
+def _get_image_blob(im, resized=None):
   """Converts an image into a network input.
   Arguments:
     im (ndarray): a color image in BGR order
+    resized (list): optional (image, im_scale) pairs holding im already
+      resized to each of TEST.SCALES, im is not used then
   Returns:
-    blob (ndarray): a data blob holding an image pyramid
+    blob (ndarray): a NCHW data blob holding an image pyramid, only valid
+      until the next call
     im_scale_factors (list): list of image scales (relative to im) used
       in the image pyramid
   """
-  im_orig = im.astype(np.float32, copy=True)
-  im_orig -= cfg.PIXEL_MEANS
-
-  im_shape = im_orig.shape
-  im_size_min = np.min(im_shape[0:2])
-  im_size_max = np.max(im_shape[0:2])
+  global _blob_buffer
+  if _blob_buffer is None:
+    _blob_buffer = BlobBuffer(cfg.PIXEL_MEANS)
 
   processed_ims = []
   im_scale_factors = []
 
-  for target_size in cfg.TEST.SCALES:
-    im_scale = float(target_size) / float(im_size_min)
-    # Prevent the biggest axis from being more than MAX_SIZE
-    if np.round(im_scale * im_size_max) > cfg.TEST.MAX_SIZE:
-      im_scale = float(cfg.TEST.MAX_SIZE) / float(im_size_max)
-    im = cv2.resize(im_orig, None, None, fx=im_scale, fy=im_scale,
-            interpolation=cv2.INTER_LINEAR)
-    im_scale_factors.append(im_scale)
-    processed_ims.append(im)
+  if resized is not None:
+    processed_ims = [im_resized for im_resized, _ in resized]
+    im_scale_factors = [im_scale for _, im_scale in resized]
+  else:
+    for target_size in cfg.TEST.SCALES:
+      # Resize in uint8, the means are subtracted when filling the blob
+      im_resized, im_scale = resize_im_for_blob(im, target_size,
+                                                cfg.TEST.MAX_SIZE)
+      im_scale_factors.append(im_scale)
+      processed_ims.append(im_resized)
 
   # Create a blob to hold the input images
-  blob = im_list_to_blob(processed_ims)
+  blob = _blob_buffer.im_list_to_blob(processed_ims)
 
   return blob, np.array(im_scale_factors)
 
-def _get_blobs(im):
+def _get_blobs(im, resized=None):
   """Convert an image and RoIs within that image into network inputs."""
   blobs = {}
-  blobs['data'], im_scale_factors = _get_image_blob(im)
+  blobs['data'], im_scale_factors = _get_image_blob(im, resized)
 
   return blobs, im_scale_factors
 
@@ -88,14 +96,19 @@ def _rescale_boxes(boxes, inds, scales):
 
   return boxes
 
-def im_detect(net, im, label=None):
-  #im = cv2.imread(imdb.image_path_at(i))
-  ori_img = im.copy()
-  blobs, im_scales = _get_blobs(im)
+def im_detect(net, im, label=None, resized=None, im_shape=None):
+  """Detect objects in im. With resized, the (image, im_scale) variants of
+  im at TEST.SCALES, im may be None and im_shape gives its (height, width).
+  """
+  #im = imread(imdb.image_path_at(i))
+  if im_shape is None:
+    im_shape = im.shape
+  ori_img = im
+  blobs, im_scales = _get_blobs(im, resized)
   assert len(im_scales) == 1, "Only single-image batch implemented"
 
   im_blob = blobs['data']
-  blobs['im_info'] = np.array([im_blob.shape[1], im_blob.shape[2], im_scales[0]], dtype=np.float32)
+  blobs['im_info'] = np.array([im_blob.shape[2], im_blob.shape[3], im_scales[0]], dtype=np.float32)
 
   # scores(300,num_classes) bbox_pred(300, num_classes*4) rois(300,4)
   # 对于300个roi，每个roi 4个值 x1 y1 x2 y2
@@ -122,7 +135,7 @@ def im_detect(net, im, label=None):
     box_deltas = bbox_pred
     # 每个roi对于不同类别进行对应偏移
     pred_boxes = bbox_transform_inv(torch.from_numpy(boxes), torch.from_numpy(box_deltas)).numpy()
-    pred_boxes = _clip_boxes(pred_boxes, im.shape)  # (300, num_classes*4)
+    pred_boxes = _clip_boxes(pred_boxes, im_shape)  # (300, num_classes*4)
   else:
     # Simply repeat the boxes, once for each class
     pred_boxes = np.tile(boxes, (1, scores.shape[1]))  # test时不再回归了  (300, num_classes*4)
@@ -141,35 +154,101 @@ def im_detect(net, im, label=None):
     return scores, pred_boxes, mask_score_map
   return scores, pred_boxes
 
-def apply_nms(all_boxes, thresh):
+def _nms_dets(dets, thresh):
+  if len(dets) == 0:
+    return []
+  x1 = dets[:, 0]
+  y1 = dets[:, 1]
+  x2 = dets[:, 2]
+  y2 = dets[:, 3]
+  inds = np.where((x2 > x1) & (y2 > y1))[0]
+  dets = dets[inds,:]
+  if len(dets) == 0:
+    return []
+
+  keep = nms(torch.from_numpy(dets), thresh).numpy()
+  if len(keep) == 0:
+    return []
+  return dets[keep, :].copy()
+
+# detections and threshold of the pool of apply_nms
+_nms_boxes = None
+_nms_thresh = None
+
+def _apply_nms_chunk(chunk):
+  cls_ind, start, end = chunk
+  return [_nms_dets(_nms_boxes[cls_ind][im_ind], _nms_thresh)
+          for im_ind in range(start, end)]
+
+def apply_nms(all_boxes, thresh, num_workers=1, chunk_size=500):
   """Apply non-maximum suppression to all predicted boxes output by the
   test_net method.
+
+  With num_workers > 1, the (class, images) chunks of chunk_size images are
+  spread over forked processes, which share all_boxes.
   """
+  global _nms_boxes, _nms_thresh
   num_classes = len(all_boxes)
   num_images = len(all_boxes[0])
+  chunks = [(cls_ind, start, min(start + chunk_size, num_images))
+            for cls_ind in range(num_classes)
+            for start in range(0, num_images, chunk_size)]
+  _nms_boxes = all_boxes
+  _nms_thresh = thresh
+  try:
+    if num_workers > 1 and len(chunks) > 1:
+      pool = multiprocessing.Pool(min(num_workers, len(chunks)))
+      try:
+        results = pool.map(_apply_nms_chunk, chunks, chunksize=1)
+      finally:
+        pool.close()
+        pool.join()
+    else:
+      results = [_apply_nms_chunk(chunk) for chunk in chunks]
+  finally:
+    _nms_boxes = None
   nms_boxes = [[[] for _ in range(num_images)] for _ in range(num_classes)]
-  for cls_ind in range(num_classes):
-    for im_ind in range(num_images):
-      dets = all_boxes[cls_ind][im_ind]
-      if dets == []:
-        continue
-
-      x1 = dets[:, 0]
-      y1 = dets[:, 1]
-      x2 = dets[:, 2]
-      y2 = dets[:, 3]
-      scores = dets[:, 4]
-      inds = np.where((x2 > x1) & (y2 > y1))[0]
-      dets = dets[inds,:]
-      if dets == []:
-        continue
-
-      keep = nms(torch.from_numpy(dets), thresh).numpy()
-      if len(keep) == 0:
-        continue
-      nms_boxes[cls_ind][im_ind] = dets[keep, :].copy()
+  for (cls_ind, start, end), dets in zip(chunks, results):
+    nms_boxes[cls_ind][start:end] = dets
   return nms_boxes
 
+def _limit_detections(all_boxes, i, max_per_image):
+  """Keep the max_per_image best detections of image i over all classes."""
+  num_classes = len(all_boxes)
+  if max_per_image > 0:
+    image_scores = np.hstack([all_boxes[j][i][:, -1]
+                  for j in range(1, num_classes)])
+    if len(image_scores) > max_per_image:
+      image_thresh = np.sort(image_scores)[-max_per_image]
+      for j in range(1, num_classes):
+        keep = np.where(all_boxes[j][i][:, -1] >= image_thresh)[0]
+        all_boxes[j][i] = all_boxes[j][i][keep, :]
+
+def postprocess_detections(raw_dets, nms_thresh, thresh=0., max_per_image=100):
+  """Redo the score threshold, per-class NMS and max_per_image limit of
+  test_net on the raw detections it cached (TEST.RAW_CACHE_TOP_N), and
+  return all_boxes."""
+  num_classes = len(raw_dets)
+  num_images = len(raw_dets[1])
+  all_boxes = [[[] for _ in range(num_images)]
+         for _ in range(num_classes)]
+  for i in range(num_images):
+    for j in range(1, num_classes):
+      cls_dets = raw_dets[j][i].astype(np.float32)
+      cls_dets = cls_dets[cls_dets[:, -1] > thresh, :]
+      keep = nms(torch.from_numpy(cls_dets), nms_thresh).numpy() if cls_dets.size > 0 else []
+      all_boxes[j][i] = cls_dets[keep, :]
+    _limit_detections(all_boxes, i, max_per_image)
+  return all_boxes
+
+def _evaluate(imdb, all_boxes, output_dir):
+  if cfg.TEST.EVAL_IN_MEMORY:
+    imdb.evaluate_in_memory(all_boxes, output_dir)
+  else:
+    imdb.evaluate_detections(all_boxes, output_dir)
+  if cfg.TEST.COCO_STYLE_EVAL:
+    imdb.evaluate_coco_style(all_boxes, output_dir)
+
 def test_net(net, imdb, weights_filename, max_per_image=100, thresh=0.,clean_pre_result=True):
   np.random.seed(cfg.RNG_SEED)
   """Test a Fast R-CNN network on an image database."""
@@ -188,23 +267,55 @@ def test_net(net, imdb, weights_filename, max_per_image=100, thresh=0.,clean_pre
     if os.path.isfile(det_file):
       all_boxes = pickle.load(open(det_file, 'rb'))
       print('Evaluating detections')
-      imdb.evaluate_detections(all_boxes, output_dir)
+      _evaluate(imdb, all_boxes, output_dir)
     else:
       print('no previous result')
   else:
     # timers
     _t = {'im_detect' : Timer(), 'misc' : Timer()}
+    resized_index = load_index(cfg.RESIZED_DIR) if cfg.RESIZED_DIR else {}
+    # top-N raw detections of each class, before thresholding and NMS
+    raw_dets = None
+    if cfg.TEST.RAW_CACHE_TOP_N > 0:
+      raw_dets = [[[] for _ in range(num_images)]
+             for _ in range(imdb.num_classes)]
+    accumulator = None
+    if cfg.TEST.STREAMING_AP > 0:
+      # the ground truth of the final evaluation, read before the loop as
+      # gt_roidb may drop images from the image index
+      eval_gt = imdb.evaluation_gt()
+      assert len(eval_gt) == num_images
+      accumulator = imdb.ap_accumulator()
     for i in range(num_images):
       img_dir = imdb.image_path_at(i)
       img_name = img_dir[img_dir.rfind('/')+1:]
       img_name = img_name[:img_name.rfind('.')]
-      im = cv2.imread(imdb.image_path_at(i))
+      # read the pre-resized variants if every scale has one
+      variants = resized_index.get(img_dir, {})
+      variants = [variants.get((s, cfg.TEST.MAX_SIZE)) for s in cfg.TEST.SCALES]
+      if all(v is not None for v in variants):
+        resized = [(imread(v[0]), v[2]) for v in variants]
+        im = None
+        width, height = imdb.image_size_at(i)
+        im_shape = (height, width)
+      elif cfg.REDUCED_DECODE:
+        # one reduced decode that is large enough for every scale
+        width, height = imdb.image_size_at(i)
+        im_shape = (height, width)
+        im_scales = [get_im_scale(im_shape, s, cfg.TEST.MAX_SIZE) for s in cfg.TEST.SCALES]
+        im = imread(img_dir, reduced_imread_flags(max(im_scales)))
+        resized = [(resize_im_to_scale(im, im_shape, s), s) for s in im_scales]
+        im = None
+      else:
+        resized = None
+        im = imread(img_dir)
+        im_shape = im.shape
       label = None
       _t['im_detect'].tic()
       if cfg.DO_PARSING:
-        label = cv2.imread(imdb.parsing_label_path_at(i), cv2.IMREAD_GRAYSCALE)
+        label = imread(imdb.parsing_label_path_at(i), cv2.IMREAD_GRAYSCALE)
         # scores(300,num_classes) boxes(300, num_classes*4) mask_score_map_sigmoid(300, 20, h, w)
-        scores, boxes, mask_score_map = im_detect(net, im, label)
+        scores, boxes, mask_score_map = im_detect(net, im, label, resized, im_shape)
         '''
         # print(mask_score_map_sigmoid.shape)
         mask_target_channel = scores.argmax(1)  # (300,)
@@ -229,10 +340,15 @@ def test_net(net, imdb, weights_filename, max_per_image=100, thresh=0.,clean_pre
         a = raw_input()
         '''
       else:
-        scores, boxes = im_detect(net, im)
+        scores, boxes = im_detect(net, im, resized=resized, im_shape=im_shape)
       _t['im_detect'].toc()
 
       _t['misc'].tic()
+      if raw_dets is not None:
+        for j in range(1, imdb.num_classes):
+          order = np.argsort(-scores[:, j], kind='mergesort')[:cfg.TEST.RAW_CACHE_TOP_N]
+          raw_dets[j][i] = np.hstack((boxes[order, j*4:(j+1)*4], scores[order, j, np.newaxis])) \
+            .astype(np.float16)
       out = np.zeros((320,320,1),np.uint8)
       # skip j = 0, because it's the background class
       for j in range(1, imdb.num_classes):
@@ -267,24 +383,34 @@ def test_net(net, imdb, weights_filename, max_per_image=100, thresh=0.,clean_pre
 
 
       # Limit to max_per_image detections *over all classes*
-      if max_per_image > 0:
-        image_scores = np.hstack([all_boxes[j][i][:, -1]
-                      for j in range(1, imdb.num_classes)])
-        if len(image_scores) > max_per_image:
-          image_thresh = np.sort(image_scores)[-max_per_image]
-          for j in range(1, imdb.num_classes):
-            keep = np.where(all_boxes[j][i][:, -1] >= image_thresh)[0]
-            all_boxes[j][i] = all_boxes[j][i][keep, :]
+      _limit_detections(all_boxes, i, max_per_image)
       _t['misc'].toc()
 
       print('im_detect: {:d}/{:d} {:.3f}s {:.3f}s' \
           .format(i + 1, num_images, _t['im_detect'].average_time(),
               _t['misc'].average_time()))
 
+      if accumulator is not None:
+        accumulator.add_image([all_boxes[j][i] for j in range(imdb.num_classes)],
+                              eval_gt[i]['boxes'], eval_gt[i]['gt_classes'],
+                              eval_gt[i]['difficult'])
+        if (i + 1) % cfg.TEST.STREAMING_AP == 0 or i + 1 == num_images:
+          summary = accumulator.summary()
+          print('running mAP after {:d} images: {:.4f}, recall: {:.4f}' \
+              .format(i + 1, summary['map'], summary['recall']))
+
     det_file = os.path.join(output_dir, 'detections.pkl')
     with open(det_file, 'wb') as f:
       pickle.dump(all_boxes, f, pickle.HIGHEST_PROTOCOL)
+    if raw_dets is not None:
+      # with the images they belong to, to check them against the imdb
+      with open(os.path.join(output_dir, 'raw_detections.pkl'), 'wb') as f:
+        pickle.dump({'image_index': list(imdb.image_index), 'dets': raw_dets},
+                    f, pickle.HIGHEST_PROTOCOL)
+    if accumulator is not None:
+      with open(os.path.join(output_dir, 'ap_accumulator.pkl'), 'wb') as f:
+        pickle.dump(accumulator, f, pickle.HIGHEST_PROTOCOL)
 
     print('Evaluating detections')
-    imdb.evaluate_detections(all_boxes, output_dir)
+    _evaluate(imdb, all_boxes, output_dir)
 
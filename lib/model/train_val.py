@@ -12,6 +12,8 @@ import tensorboardX as tb
 from model.config import cfg
 import roi_data_layer.roidb as rdl_roidb
 from roi_data_layer.layer import RoIDataLayer
+from roi_data_layer.compact_roidb import CompactRoidb
+from roi_data_layer.lazy_roidb import LazyRoidb
 import utils.timer
 try:
   import cPickle as pickle
@@ -237,7 +239,9 @@ class SolverWrapper(object):
 
   def train_model(self, max_iters):
     # Build data layers for both training and validation set
-    self.data_layer = RoIDataLayer(self.roidb, self.imdb.num_classes)
+    # Only the training images are flipped
+    self.data_layer = RoIDataLayer(self.roidb, self.imdb.num_classes,
+                                   use_flipped=cfg.TRAIN.USE_FLIPPED)
     self.data_layer_val = RoIDataLayer(self.valroidb, self.imdb.num_classes, random=True)
 
     # Construct the computation graph
@@ -297,6 +301,9 @@ class SolverWrapper(object):
               '>>> rpn_loss_box: %.6f\n >>> loss_cls: %.6f\n >>> loss_box: %.6f\n >>> lr: %f' % \
               (iter, max_iters, total_loss, rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, lr))
         print('speed: {:.3f}s / iter'.format(utils.timer.timer.average_time()))
+        image_cache_stats = self.data_layer.image_cache_stats()
+        if image_cache_stats is not None:
+          print(image_cache_stats)
 
         # for k in utils.timer.timer._average_time.keys():
         #   print(k, utils.timer.timer.average_time(k))
@@ -323,37 +330,43 @@ class SolverWrapper(object):
 
 def get_training_roidb(imdb):
   """Returns a roidb (Region of Interest database) for use in training."""
-  if cfg.TRAIN.USE_FLIPPED:
-    print('Appending horizontally-flipped training examples...')
-    imdb.append_flipped_images()
-    print('done')
+  # With TRAIN.USE_FLIPPED, the training data layer samples flipped views
+  # of the entries on the fly (see roi_data_layer.roidb.roidb_entry)
+
+  if cfg.TRAIN.LAZY_ROIDB:
+    print('Entries are loaded on demand')
+    return LazyRoidb([imdb], cfg.TRAIN.LAZY_ROIDB_CACHE)
 
   print('Preparing training data...')
   rdl_roidb.prepare_roidb(imdb)
   print('done')
 
+  if cfg.TRAIN.COMPACT_ROIDB:
+    # the imdb does not keep the list of dicts
+    return CompactRoidb.from_imdb(imdb)
   return imdb.roidb
 
 
 def filter_roidb(roidb):
   """Remove roidb entries that have no usable RoIs."""
 
-  def is_valid(entry):
-    # Valid images have:
-    #   (1) At least one foreground RoI OR
-    #   (2) At least one background RoI
-    overlaps = entry['max_overlaps']
-    # find boxes with sufficient overlap
-    fg_inds = np.where(overlaps >= cfg.TRAIN.FG_THRESH)[0]
-    # Select background RoIs as those within [BG_THRESH_LO, BG_THRESH_HI)
-    bg_inds = np.where((overlaps < cfg.TRAIN.BG_THRESH_HI) &
-                       (overlaps >= cfg.TRAIN.BG_THRESH_LO))[0]
-    # image is only valid if such boxes exist
-    valid = len(fg_inds) > 0 or len(bg_inds) > 0
-    return valid
-
   num = len(roidb)
-  filtered_roidb = [entry for entry in roidb if is_valid(entry)]
+  if isinstance(roidb, LazyRoidb):
+    # filtering would load every entry, the data layer drops the invalid
+    # ones as they are loaded
+    print('Lazy roidb, filtered while training')
+    return roidb
+  if isinstance(roidb, CompactRoidb):
+    # the same test over the boxes of all the images at once
+    overlaps = roidb.box_data['max_overlaps']
+    valid_boxes = (overlaps >= cfg.TRAIN.FG_THRESH) | \
+                  ((overlaps < cfg.TRAIN.BG_THRESH_HI) &
+                   (overlaps >= cfg.TRAIN.BG_THRESH_LO))
+    valid = np.bincount(roidb.box_image_inds(), weights=valid_boxes,
+                        minlength=num) > 0
+    filtered_roidb = roidb.subset(np.where(valid)[0])
+  else:
+    filtered_roidb = [entry for entry in roidb if rdl_roidb.is_valid_entry(entry)]
   num_after = len(filtered_roidb)
   print('Filtered {} roidb entries: {} -> {}'.format(num - num_after,
                                                      num, num_after))
@@ -49,17 +49,20 @@ class Network(nn.Module):
     self._variables_to_fix = {}
 
   def _add_gt_image(self):
-    # add back mean
-    image = self._image_gt_summaries['image'] + cfg.PIXEL_MEANS
-    image = imresize(image[0], self._im_info[:2] / self._im_info[2])
+    # add back mean, the blob is NCHW and padded to the largest image
+    height, width = int(self._im_info[0, 0]), int(self._im_info[0, 1])
+    image = self._image_gt_summaries['image'][0, :, :height, :width].transpose((1, 2, 0)) + cfg.PIXEL_MEANS
+    image = imresize(image, self._im_info[0, :2] / self._im_info[0, 2])
     # BGR to RGB (opencv uses BGR)
     self._gt_image = image[np.newaxis, :,:,::-1].copy(order='C')
 
   def _add_gt_image_summary(self):
     # use a customized visualization function to visualize the boxes
+    # only the first image of the batch is shown
     self._add_gt_image()
+    gt_boxes = self._image_gt_summaries['gt_boxes'][self._gt_batch_inds == 0]
     image = draw_bounding_boxes(\
-                      self._gt_image, self._image_gt_summaries['gt_boxes'], self._image_gt_summaries['im_info'])
+                      self._gt_image, gt_boxes, self._im_info[0])
 
     return tb.summary.image('GROUND_TRUTH', image[0].astype('float32')/255.0)
 
@@ -75,8 +78,9 @@ class Network(nn.Module):
     return tb.summary.histogram('TRAIN/' + key, var.data.cpu().numpy(), bins='auto')
 
   def _proposal_top_layer(self, rpn_cls_prob, rpn_bbox_pred):
+    # only used for testing, where the batch holds a single image
     rois, rpn_scores = proposal_top_layer(\
-                                    rpn_cls_prob, rpn_bbox_pred, self._im_info,
+                                    rpn_cls_prob, rpn_bbox_pred, self._im_info[0],
                                      self._feat_stride, self._anchors, self._num_anchors)
     return rois, rpn_scores
 
@@ -120,25 +124,43 @@ class Network(nn.Module):
     theta[:, 1, 2] = (y1 + y2 - height + 1) / (height - 1)
     if use_for_parsing:
       pre_pool_size = cfg.POOLING_SIZE * 4
-      grid = F.affine_grid(theta, torch.Size((rois.size(0), 1, pre_pool_size, pre_pool_size)))
-      crops = F.grid_sample(bottom.expand(rois.size(0), bottom.size(1), bottom.size(2), bottom.size(3)), grid,
-                            mode=mode)
+    elif max_pool:
+      pre_pool_size = cfg.POOLING_SIZE * 2
     else:
-      if max_pool:
-        pre_pool_size = cfg.POOLING_SIZE * 2
-        grid = F.affine_grid(theta, torch.Size((rois.size(0), 1, pre_pool_size, pre_pool_size)))
-        crops = F.grid_sample(bottom.expand(rois.size(0), bottom.size(1), bottom.size(2), bottom.size(3)), grid, mode=mode)
-        crops = F.max_pool2d(crops, 2, 2)
-      else:
-        grid = F.affine_grid(theta, torch.Size((rois.size(0), 1, cfg.POOLING_SIZE, cfg.POOLING_SIZE)))
-        crops = F.grid_sample(bottom.expand(rois.size(0), bottom.size(1), bottom.size(2), bottom.size(3)), grid)
-    
+      pre_pool_size = cfg.POOLING_SIZE
+      mode = 'bilinear'
+
+    def crop(image, image_theta):
+      # expand is a view, the feature map is not copied per roi
+      image = image.expand(image_theta.size(0), image.size(1), image.size(2), image.size(3))
+      grid = F.affine_grid(image_theta, torch.Size((image_theta.size(0), 1, pre_pool_size, pre_pool_size)))
+      return F.grid_sample(image, grid, mode=mode)
+
+    # every roi samples from the feature map of its own image
+    if bottom.size(0) == 1:
+      crops = crop(bottom, theta)
+    else:
+      batch_inds = rois.data[:, 0].cpu().numpy().astype(np.int64)
+      image_crops = []
+      order = []
+      for b in np.unique(batch_inds):
+        inds = np.where(batch_inds == b)[0]
+        inds_var = Variable(torch.from_numpy(inds).cuda())
+        image_crops.append(crop(bottom[int(b):int(b) + 1], theta.index_select(0, inds_var)))
+        order.append(inds)
+      # back to the order of the rois
+      restore = np.argsort(np.concatenate(order))
+      crops = torch.cat(image_crops, 0).index_select(0, Variable(torch.from_numpy(restore).cuda()))
+    if max_pool and not use_for_parsing:
+      crops = F.max_pool2d(crops, 2, 2)
+
     return crops
 
   def _anchor_target_layer(self, rpn_cls_score):
     rpn_labels, rpn_bbox_targets, rpn_bbox_inside_weights, rpn_bbox_outside_weights = \
       anchor_target_layer(
-      rpn_cls_score.data, self._gt_boxes.data.cpu().numpy(), self._im_info, self._feat_stride, self._anchors.data.cpu().numpy(), self._num_anchors)
+      rpn_cls_score.data, self._gt_boxes.data.cpu().numpy(), self._im_info, self._feat_stride, self._anchors.data.cpu().numpy(), self._num_anchors,
+      self._gt_batch_inds)
 
     rpn_labels = Variable(torch.from_numpy(rpn_labels).float().cuda()) #.set_shape([1, 1, None, None])
     rpn_bbox_targets = Variable(torch.from_numpy(rpn_bbox_targets).float().cuda())#.set_shape([1, None, None, self._num_anchors * 4])
@@ -161,20 +183,24 @@ class Network(nn.Module):
       if cfg.DO_PARSING:
         rois, roi_scores, labels, sub_labels, bbox_targets, bbox_inside_weights, bbox_outside_weights, mask_unit = \
           proposal_target_layer(
-            rois, roi_scores, self._gt_boxes, self._num_classes, self._parsing_labels)
+            rois, roi_scores, self._gt_boxes, self._num_classes, self._parsing_labels,
+            self._gt_batch_inds, self._num_images)
       else:
         rois, roi_scores, labels, sub_labels, bbox_targets, bbox_inside_weights, bbox_outside_weights = \
           proposal_target_layer(
-            rois, roi_scores, self._gt_boxes, self._num_classes)
+            rois, roi_scores, self._gt_boxes, self._num_classes,
+            gt_batch_inds=self._gt_batch_inds, num_images=self._num_images)
     else:
       if cfg.DO_PARSING:
         rois, roi_scores, labels, bbox_targets, bbox_inside_weights, bbox_outside_weights, mask_unit = \
           proposal_target_layer(
-            rois, roi_scores, self._gt_boxes, self._num_classes, self._parsing_labels)
+            rois, roi_scores, self._gt_boxes, self._num_classes, self._parsing_labels,
+            self._gt_batch_inds, self._num_images)
       else:
         rois, roi_scores, labels, bbox_targets, bbox_inside_weights, bbox_outside_weights = \
           proposal_target_layer(
-          rois, roi_scores, self._gt_boxes, self._num_classes)
+          rois, roi_scores, self._gt_boxes, self._num_classes,
+          gt_batch_inds=self._gt_batch_inds, num_images=self._num_images)
     if cfg.SUB_CATEGORY:
       self._proposal_targets['sub_labels'] = sub_labels.long()
     if cfg.DO_PARSING:
@@ -288,7 +314,7 @@ class Network(nn.Module):
     rpn_cls_score = self.rpn_cls_score_net(rpn) # batch * (num_anchors * 2) * h * w
 
     # change it so that the score has 2 as its channel size
-    rpn_cls_score_reshape = rpn_cls_score.view(1, 2, -1, rpn_cls_score.size()[-1]) # batch * 2 * (num_anchors*h) * w
+    rpn_cls_score_reshape = rpn_cls_score.view(rpn_cls_score.size(0), 2, -1, rpn_cls_score.size()[-1]) # batch * 2 * (num_anchors*h) * w
     rpn_cls_prob_reshape = F.softmax(rpn_cls_score_reshape)
     
     # Move channel to the last dimenstion, to fit the input of python functions
@@ -309,14 +335,15 @@ class Network(nn.Module):
       #print('proposal_target: roi', rois.size())
     else:
       if cfg.TEST.MODE == 'nms':
-        rois, _ = self._proposal_layer(rpn_cls_prob, rpn_bbox_pred)
+        rois, roi_scores = self._proposal_layer(rpn_cls_prob, rpn_bbox_pred)
         mask_unit= {}
         mask_unit['mask_rois'] = rois
         self._proposal_targets['mask_unit'] = mask_unit
       elif cfg.TEST.MODE == 'top':
-        rois, _ = self._proposal_top_layer(rpn_cls_prob, rpn_bbox_pred)
+        rois, roi_scores = self._proposal_top_layer(rpn_cls_prob, rpn_bbox_pred)
       else:
         raise NotImplementedError
+      self._predictions["roi_scores"] = roi_scores
 
     self._predictions["rpn_cls_score"] = rpn_cls_score
     self._predictions["rpn_cls_score_reshape"] = rpn_cls_score_reshape
@@ -513,9 +540,7 @@ class Network(nn.Module):
       #newrois = Variable(newrois, requires_grad=False)
       pyramid_rois.append(newrois)
     return pyramid_rois
-  def _predict(self):
-    # This is just _build_network in tf-faster-rcnn
-    torch.backends.cudnn.benchmark = False
+  def _image_to_rpn_input(self):
     net_conv = self._image_to_head() # 1 512 h/16 w/16
     if cfg.LIGHT_RCNN:
       lightrcnn_conv1 = nn.ReLU()(self.lightrcnn_conv1(net_conv))
@@ -537,6 +562,12 @@ class Network(nn.Module):
 
     # build the anchors for the image
     self._anchor_component(net_conv.size(2), net_conv.size(3))
+    return net_conv
+
+  def _predict(self):
+    # This is just _build_network in tf-faster-rcnn
+    torch.backends.cudnn.benchmark = False
+    net_conv = self._image_to_rpn_input()
 
     # 256 5 (1-4是x1 y1 x2 y2 第0维是指这个proposal来自哪个图片，本工程中输入都是一张，该维都是0没用
     rois = self._region_proposal(net_conv)
@@ -548,14 +579,14 @@ class Network(nn.Module):
       pool5 = self._roi_pool_layer(net_conv, rois)
     elif cfg.POOLING_MODE == 'pyramid_crop':
       pool5 = self._crop_pool_layer(net_conv, rois)
-      pyramid_rois = self._gen_pyramid_rois(rois, max_h=self._im_info[0], max_w=self._im_info[1])
+      pyramid_rois = self._gen_pyramid_rois(rois, max_h=self._im_info[0, 0], max_w=self._im_info[0, 1])
       for p_rois in pyramid_rois:
         pyramid_pool5 = self._crop_pool_layer(net_conv, p_rois)
         pool5 = torch.cat((pool5, pyramid_pool5), 1)
       pool5 = self.dec_channel(pool5)
     elif cfg.POOLING_MODE == 'pyramid_crop_sum':
       pool5 = self._crop_pool_layer(net_conv, rois)
-      pyramid_rois = self._gen_pyramid_rois(rois, max_h=self._im_info[0], max_w=self._im_info[1])
+      pyramid_rois = self._gen_pyramid_rois(rois, max_h=self._im_info[0, 0], max_w=self._im_info[0, 1])
       pool5 = 0.5 * pool5 + \
               0.3 * self._crop_pool_layer(net_conv, pyramid_rois[0]) +\
               0.2 * self._crop_pool_layer(net_conv, pyramid_rois[1])
@@ -623,14 +654,21 @@ class Network(nn.Module):
 
     return rois, cls_prob, bbox_pred
 
-  def forward(self, image, im_info, gt_boxes=None, parsing_labels=None, mode='TRAIN'):
+  def forward(self, image, im_info, gt_boxes=None, parsing_labels=None, mode='TRAIN', gt_batch_inds=None):
     self._image_gt_summaries['image'] = image
     self._image_gt_summaries['gt_boxes'] = gt_boxes
     self._image_gt_summaries['im_info'] = im_info
-    self._image = Variable(torch.from_numpy(image.transpose([0,3,1,2])).cuda(), volatile=mode == 'TEST')
+    # image blobs are already NCHW, see utils.blob.BlobBuffer
+    self._image = Variable(torch.from_numpy(image).cuda(), volatile=mode == 'TEST')
+    self._num_images = image.shape[0]
     self._parsing_labels = Variable(torch.from_numpy(parsing_labels).cuda(), volatile=mode == 'TEST')if parsing_labels is not None else None
-    self._im_info = im_info # No need to change; actually it can be an list
+    # one (height, width, scale) row per image
+    self._im_info = np.asarray(im_info).reshape((-1, 3))
     self._gt_boxes = Variable(torch.from_numpy(gt_boxes).cuda()) if gt_boxes is not None else None
+    # the image each gt box belongs to, all in the first one by default
+    if gt_batch_inds is None and gt_boxes is not None:
+      gt_batch_inds = np.zeros((gt_boxes.shape[0],), dtype=np.int64)
+    self._gt_batch_inds = gt_batch_inds
     self._mode = mode
 
     rois, cls_prob, bbox_pred = self._predict()
@@ -711,7 +749,7 @@ class Network(nn.Module):
   # Extract the head feature maps, for example for vgg16 it is conv5_3
   # only useful during testing mode
   def extract_head(self, image):
-    feat = self._layers["head"](Variable(torch.from_numpy(image.transpose([0,3,1,2])).cuda(), volatile=True))
+    feat = self._layers["head"](Variable(torch.from_numpy(image).cuda(), volatile=True))
     return feat
 
   # only useful during testing mode
@@ -729,6 +767,20 @@ class Network(nn.Module):
       return cls_score, cls_prob, bbox_pred, rois, mask_score_map.data.cpu().numpy()
     return cls_score, cls_prob, bbox_pred, rois
 
+  # only runs the head and the RPN, e.g. to benchmark the proposals
+  def test_rpn(self, image, im_info):
+    self.eval()
+    self._image = Variable(torch.from_numpy(image).cuda(), volatile=True)
+    self._num_images = image.shape[0]
+    self._im_info = np.asarray(im_info).reshape((-1, 3))
+    self._gt_boxes = None
+    self._mode = 'TEST'
+    torch.backends.cudnn.benchmark = False
+    net_conv = self._image_to_rpn_input()
+    self._region_proposal(net_conv)
+    return self._predictions['rois'].data.cpu().numpy(), \
+           self._predictions['roi_scores'].data.cpu().numpy()
+
   def delete_intermediate_states(self):
     # Delete intermediate result to save memory
     for d in [self._losses, self._predictions, self._anchor_targets, self._proposal_targets]:
@@ -737,14 +789,16 @@ class Network(nn.Module):
 
   def get_summary(self, blobs):
     self.eval()
-    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], blobs['parsing_labels'])
+    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], blobs['parsing_labels'],
+                 gt_batch_inds=blobs.get('gt_batch_inds'))
     self.train()
     summary = self._run_summary_op(True)
 
     return summary
 
   def train_step(self, blobs, train_op):
-    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], blobs['parsing_labels'])
+    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], blobs['parsing_labels'],
+                 gt_batch_inds=blobs.get('gt_batch_inds'))
     rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss = self._losses["rpn_cross_entropy"].data[0], \
                                                                         self._losses['rpn_loss_box'].data[0], \
                                                                         self._losses['cross_entropy'].data[0], \
@@ -761,7 +815,8 @@ class Network(nn.Module):
     return rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss
 
   def train_step_with_summary(self, blobs, train_op):
-    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], blobs['parsing_labels'])
+    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], blobs['parsing_labels'],
+                 gt_batch_inds=blobs.get('gt_batch_inds'))
     rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss = self._losses["rpn_cross_entropy"].data[0], \
                                                                         self._losses['rpn_loss_box'].data[0], \
                                                                         self._losses['cross_entropy'].data[0], \
@@ -777,7 +832,7 @@ class Network(nn.Module):
     return rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss, summary
 
   def train_step_no_return(self, blobs, train_op):
-    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'])
+    self.forward(blobs['data'], blobs['im_info'], blobs['gt_boxes'], gt_batch_inds=blobs.get('gt_batch_inds'))
     train_op.zero_grad()
     self._losses['total_loss'].backward()
     train_op.step()
@@ -0,0 +1,75 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Group images of similar scaled size to limit padding in a minibatch."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+def scaled_sizes(heights, widths, target_size, max_size):
+  """Vectorized utils.blob.get_im_scale: return the (heights, widths) the
+  images will have in the blob.
+  """
+  heights = np.asarray(heights, dtype=np.float64)
+  widths = np.asarray(widths, dtype=np.float64)
+  size_min = np.minimum(heights, widths)
+  size_max = np.maximum(heights, widths)
+  scales = float(target_size) / size_min
+  # Prevent the biggest axis from being more than MAX_SIZE
+  too_big = np.round(scales * size_max) > max_size
+  scales[too_big] = float(max_size) / size_max[too_big]
+  return np.round(heights * scales), np.round(widths * scales)
+
+
+def bucket_perm(heights, widths, ims_per_batch, bucket_size=32, shuffle=True):
+  """Order images so that every run of ims_per_batch consecutive entries
+  holds images of similar (height, width).
+
+  Images are sorted by their size quantized to bucket_size pixels, so a
+  minibatch only mixes two buckets at a bucket boundary. With shuffle the
+  order inside a bucket and the order of the minibatches are random, and
+  the images that do not fill a last minibatch are drawn at random and put
+  at the end, so that no bucket is always left out. Without shuffle the
+  ordering is deterministic, which suits batched inference.
+  """
+  heights = np.asarray(heights)
+  widths = np.asarray(widths)
+  num_images = len(heights)
+  bucket_h = (heights // bucket_size).astype(np.int64)
+  bucket_w = (widths // bucket_size).astype(np.int64)
+  num_left = num_images % ims_per_batch
+  if shuffle:
+    tie_break = np.random.permutation(num_images)
+    left = np.sort(np.random.choice(num_images, num_left, replace=False))
+    kept = np.setdiff1d(np.arange(num_images), left)
+  else:
+    tie_break = np.arange(num_images)
+    left = np.zeros((0,), dtype=np.int64)
+    kept = np.arange(num_images)
+  order = kept[np.lexsort((tie_break[kept], bucket_w[kept], bucket_h[kept]))]
+
+  num_full = len(kept) // ims_per_batch * ims_per_batch
+  batches = order[:num_full].reshape((-1, ims_per_batch))
+  if shuffle:
+    batches = batches[np.random.permutation(batches.shape[0])]
+  return np.concatenate((batches.reshape(-1), order[num_full:], left))
+
+
+def padding_overhead(heights, widths, perm, ims_per_batch):
+  """Return the fraction of blob pixels that are padding when the images
+  are batched in the order given by perm.
+  """
+  num_full = len(perm) // ims_per_batch * ims_per_batch
+  if num_full == 0:
+    return 0.
+  inds = np.asarray(perm[:num_full]).reshape((-1, ims_per_batch))
+  heights = np.asarray(heights, dtype=np.float64)[inds]
+  widths = np.asarray(widths, dtype=np.float64)[inds]
+  blob_area = heights.max(axis=1) * widths.max(axis=1) * ims_per_batch
+  image_area = (heights * widths).sum(axis=1)
+  return 1. - image_area.sum() / blob_area.sum()
@@ -0,0 +1,126 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""A roidb stored as a few concatenated arrays instead of a list of dicts."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import scipy.sparse
+
+# Keys holding one row per box
+BOX_KEYS = ('boxes', 'gt_classes', 'seg_areas', 'sub_categorys',
+            'max_classes', 'max_overlaps')
+# Keys holding one number per image
+IMAGE_KEYS = ('width', 'height', 'flipped')
+
+
+class CompactRoidb(object):
+  """Struct-of-arrays roidb.
+
+  The per-box arrays of all the images are concatenated, image i owning the
+  rows offsets[i]:offsets[i + 1], and gt_overlaps is one csr matrix. Width,
+  height and flipped are arrays over the images, any other key is kept in a
+  list. Indexing returns the usual entry dict, whose arrays are views of the
+  concatenated ones, so the roidb can stand in for a list of entries as
+  long as these are not modified.
+  """
+
+  def __init__(self, offsets, box_data, gt_overlaps, image_data, image_lists):
+    self.offsets = offsets
+    self.box_data = box_data
+    self.gt_overlaps = gt_overlaps
+    self.image_data = image_data
+    self.image_lists = image_lists
+
+  @classmethod
+  def from_entries(cls, roidb):
+    """Build a CompactRoidb from a list of entries, all with the same keys."""
+    assert len(roidb) > 0
+    offsets = np.zeros((len(roidb) + 1,), dtype=np.int64)
+    offsets[1:] = np.cumsum([len(r['boxes']) for r in roidb])
+    keys = roidb[0].keys()
+    box_data = dict((k, np.concatenate([r[k] for r in roidb]))
+                    for k in BOX_KEYS if k in keys)
+    gt_overlaps = None
+    if 'gt_overlaps' in keys:
+      gt_overlaps = scipy.sparse.vstack([r['gt_overlaps'] for r in roidb]).tocsr()
+    image_data = dict((k, np.array([r[k] for r in roidb]))
+                      for k in IMAGE_KEYS if k in keys)
+    image_lists = dict((k, [r[k] for r in roidb]) for k in keys
+                       if k not in box_data and k not in image_data
+                       and k != 'gt_overlaps')
+    return cls(offsets, box_data, gt_overlaps, image_data, image_lists)
+
+  @classmethod
+  def concatenate(cls, roidbs):
+    """Build the CompactRoidb of the images of roidbs, CompactRoidbs with
+    the same keys, one after the other."""
+    offsets = np.zeros((sum(len(r) for r in roidbs) + 1,), dtype=np.int64)
+    offsets[1:] = np.cumsum(np.concatenate([np.diff(r.offsets) for r in roidbs]))
+    box_data = dict((k, np.concatenate([r.box_data[k] for r in roidbs]))
+                    for k in roidbs[0].box_data)
+    gt_overlaps = None
+    if roidbs[0].gt_overlaps is not None:
+      gt_overlaps = scipy.sparse.vstack([r.gt_overlaps for r in roidbs]).tocsr()
+    image_data = dict((k, np.concatenate([r.image_data[k] for r in roidbs]))
+                      for k in roidbs[0].image_data)
+    image_lists = dict((k, [v for r in roidbs for v in r.image_lists[k]])
+                       for k in roidbs[0].image_lists)
+    return cls(offsets, box_data, gt_overlaps, image_data, image_lists)
+
+  @classmethod
+  def from_imdb(cls, imdb, chunk_size=1000):
+    """Build the CompactRoidb of the prepared roidb of imdb, which then no
+    longer holds it. The entries are converted a chunk at a time and
+    released as they go, so they and the arrays are never both whole."""
+    roidb = imdb.roidb
+    imdb._roidb = None
+    chunks = []
+    for start in range(0, len(roidb), chunk_size):
+      end = min(start + chunk_size, len(roidb))
+      chunks.append(cls.from_entries(roidb[start:end]))
+      roidb[start:end] = [None] * (end - start)
+    return cls.concatenate(chunks)
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, i):
+    start, end = self.offsets[i], self.offsets[i + 1]
+    entry = dict((k, v[start:end]) for k, v in self.box_data.items())
+    if self.gt_overlaps is not None:
+      entry['gt_overlaps'] = self.gt_overlaps[start:end]
+    for k, v in self.image_data.items():
+      entry[k] = v[i].item()
+    for k, v in self.image_lists.items():
+      entry[k] = v[i]
+    return entry
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def box_image_inds(self):
+    """Return the index of the image of every box."""
+    return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+  def subset(self, inds):
+    """Return a CompactRoidb of the images inds, in that order."""
+    inds = np.asarray(inds, dtype=np.int64)
+    counts = self.offsets[inds + 1] - self.offsets[inds]
+    offsets = np.zeros((len(inds) + 1,), dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    # row of the kept boxes in the concatenated arrays
+    box_inds = np.repeat(self.offsets[inds] - offsets[:-1], counts) + \
+               np.arange(offsets[-1])
+    box_data = dict((k, v[box_inds]) for k, v in self.box_data.items())
+    gt_overlaps = None
+    if self.gt_overlaps is not None:
+      gt_overlaps = self.gt_overlaps[box_inds]
+    image_data = dict((k, v[inds]) for k, v in self.image_data.items())
+    image_lists = dict((k, [v[i] for i in inds]) for k, v in self.image_lists.items())
+    return CompactRoidb(offsets, box_data, gt_overlaps, image_data, image_lists)
@@ -14,75 +14,266 @@ from __future__ import division
 from __future__ import print_function
 
 from model.config import cfg
-from roi_data_layer.minibatch import get_minibatch
+from roi_data_layer.minibatch import get_minibatch, get_image_cache
+from roi_data_layer.roidb import num_entries, roidb_entry
+from roi_data_layer.bucketing import scaled_sizes, bucket_perm, padding_overhead
+from utils.blob import BlobBuffer
+from utils.image_cache import format_stats
 import numpy as np
 import time
+from collections import deque
+from multiprocessing import Process, Queue
 
 class RoIDataLayer(object):
   """Fast R-CNN data layer used for training."""
 
-  def __init__(self, roidb, num_classes, random=False):
-    """Set the roidb to be used by this layer during training."""
+  def __init__(self, roidb, num_classes, random=False, use_flipped=False):
+    """Set the roidb to be used by this layer during training. With
+    use_flipped, the flipped view of every entry is sampled as well."""
     self._roidb = roidb
+    # flipped views included
+    self._num_entries = num_entries(roidb, use_flipped)
     self._num_classes = num_classes
     # Also set a random flag
     self._random = random
+    # Input blobs are built into reused storage
+    self._blob_buffer = BlobBuffer(cfg.PIXEL_MEANS)
     self._shuffle_roidb_inds()
 
-  def _shuffle_roidb_inds(self):
-    """Randomly permute the training roidb."""
-    # If the random flag is set, 
+    if cfg.TRAIN.USE_PREFETCH:
+      self._start_prefetch()
+
+  def _permute_roidb_inds(self):
+    """Return a random permutation of the training roidb."""
+    # If the random flag is set,
     # then the database is shuffled according to system time
     # Useful for the validation set
     if self._random:
       st0 = np.random.get_state()
       millis = int(round(time.time() * 1000)) % 4294967295
       np.random.seed(millis)
-    
-    if cfg.TRAIN.ASPECT_GROUPING:
-      widths = np.array([r['width'] for r in self._roidb])
-      heights = np.array([r['height'] for r in self._roidb])
+
+    # entries known to be invalid are left out
+    valid = self._valid_entries()
+    if cfg.TRAIN.BUCKET_SAMPLING:
+      perm = self._bucket_perm(valid)
+    elif cfg.TRAIN.ASPECT_GROUPING:
+      heights, widths = self._entry_sizes()
       horz = (widths >= heights)
       vert = np.logical_not(horz)
-      horz_inds = np.where(horz)[0]
-      vert_inds = np.where(vert)[0]
+      horz_inds = np.where(horz & valid)[0]
+      vert_inds = np.where(vert & valid)[0]
       inds = np.hstack((
           np.random.permutation(horz_inds),
           np.random.permutation(vert_inds)))
-      inds = np.reshape(inds, (-1, 2))
+      inds = np.reshape(inds[:len(inds) // 2 * 2], (-1, 2))
       row_perm = np.random.permutation(np.arange(inds.shape[0]))
       inds = np.reshape(inds[row_perm, :], (-1,))
-      self._perm = inds
+      perm = inds
     else:
-      self._perm = np.random.permutation(np.arange(len(self._roidb)))
+      perm = np.random.permutation(np.where(valid)[0])
     # Restore the random state
     if self._random:
       np.random.set_state(st0)
-      
+
+    return perm
+
+  def _entry_sizes(self):
+    """Return the heights and widths of the entries, flipped views included."""
+    image_data = getattr(self._roidb, 'image_data', None)
+    if image_data is not None:
+      # CompactRoidb and LazyRoidb know them without building the entries
+      heights = image_data['height']
+      widths = image_data['width']
+    else:
+      heights = np.array([r['height'] for r in self._roidb])
+      widths = np.array([r['width'] for r in self._roidb])
+    reps = self._num_entries // max(len(self._roidb), 1)
+    return np.tile(heights, reps), np.tile(widths, reps)
+
+  def _valid_entries(self):
+    """Return a mask of the entries not known to be invalid, flipped views
+    included. Only LazyRoidb learns of invalid entries, as it loads them."""
+    invalid = getattr(self._roidb, 'invalid_mask', None)
+    if invalid is None:
+      return np.ones((self._num_entries,), dtype=np.bool_)
+    reps = self._num_entries // max(len(self._roidb), 1)
+    return ~np.tile(invalid, reps)
+
+  def _entry_is_valid(self, i):
+    is_valid = getattr(self._roidb, 'is_valid', None)
+    return is_valid is None or is_valid(i % len(self._roidb))
+
+  def _bucket_perm(self, valid):
+    """Return a permutation of the valid entries that batches images of
+    similar scaled size."""
+    first = not hasattr(self, '_scaled_sizes')
+    if first:
+      # the largest training scale gives the biggest blobs
+      heights, widths = self._entry_sizes()
+      self._scaled_sizes = scaled_sizes(heights, widths,
+        max(cfg.TRAIN.SCALES), cfg.TRAIN.MAX_SIZE)
+    inds = np.where(valid)[0]
+    heights, widths = self._scaled_sizes[0][inds], self._scaled_sizes[1][inds]
+    perm = inds[bucket_perm(heights, widths, cfg.TRAIN.IMS_PER_BATCH,
+                            cfg.TRAIN.BUCKET_SIZE)]
+    if first:
+      # logged once, the overhead barely changes between shuffles
+      print('Bucketed sampling, padding overhead: {:.2f}%'.format(
+        100. * padding_overhead(self._scaled_sizes[0], self._scaled_sizes[1],
+                                perm, cfg.TRAIN.IMS_PER_BATCH)))
+    return perm
+
+  def _shuffle_roidb_inds(self):
+    """Randomly permute the training roidb."""
+    self._perm = self._permute_roidb_inds()
     self._cur = 0
 
+  def _advance(self, perm, cur):
+    """Return the roidb indices of the minibatch found at position cur of
+    perm, together with the position that follows it. Entries found to be
+    invalid are removed from perm, and the next ones take their place.
+    """
+    while True:
+      if cur + cfg.TRAIN.IMS_PER_BATCH >= len(perm):
+        perm = self._permute_roidb_inds()
+        cur = 0
+
+      db_inds = perm[cur:cur + cfg.TRAIN.IMS_PER_BATCH]
+      invalid = [k for k, i in enumerate(db_inds) if not self._entry_is_valid(i)]
+      if not invalid:
+        break
+      perm = np.delete(perm, cur + np.array(invalid))
+    assert len(db_inds) > 0, 'No valid roidb entry'
+    cur += cfg.TRAIN.IMS_PER_BATCH
+
+    return db_inds, perm, cur
+
   def _get_next_minibatch_inds(self):
     """Return the roidb indices for the next minibatch."""
-    
-    if self._cur + cfg.TRAIN.IMS_PER_BATCH >= len(self._roidb):
-      self._shuffle_roidb_inds()
-
-    db_inds = self._perm[self._cur:self._cur + cfg.TRAIN.IMS_PER_BATCH]
-    self._cur += cfg.TRAIN.IMS_PER_BATCH
+    db_inds, self._perm, self._cur = self._advance(self._perm, self._cur)
 
     return db_inds
 
+  def _start_prefetch(self):
+    """Start the worker processes that fill self._blob_queue.
+
+    Minibatch k is always built by worker k % PREFETCH_WORKERS, and each
+    worker is seeded deterministically, so the stream of blobs does not
+    depend on process scheduling.
+    """
+    num_workers = max(cfg.TRAIN.PREFETCH_WORKERS, 1)
+    if self._random:
+      seed = int(round(time.time() * 1000)) % 4294967295
+    else:
+      seed = cfg.RNG_SEED
+    self._task_queues = [Queue() for _ in range(num_workers)]
+    self._blob_queue = [Queue() for _ in range(num_workers)]
+    self._prefetch_procs = []
+    # image cache counters last sent by each worker
+    self._worker_cache_counters = [None] * num_workers
+    for i in range(num_workers):
+      proc = BlobFetcher(self._task_queues[i], self._blob_queue[i],
+                         self._roidb, self._num_classes,
+                         (seed + i + 1) % 4294967295)
+      proc.start()
+      self._prefetch_procs.append(proc)
+    # Pending minibatches are submitted lazily on the first forward, so
+    # that a position restored from a snapshot is honored
+    self._pending = None
+    self._num_submitted = 0
+    self._num_received = 0
+
+    def cleanup():
+      print('Terminating BlobFetcher')
+      for proc in self._prefetch_procs:
+        proc.terminate()
+        proc.join()
+    import atexit
+    atexit.register(cleanup)
+
+  def _submit_minibatch(self):
+    """Hand the next minibatch to its worker, running ahead of self._cur."""
+    db_inds, self._fetch_perm, self._fetch_cur = \
+      self._advance(self._fetch_perm, self._fetch_cur)
+    worker = self._num_submitted % len(self._task_queues)
+    self._task_queues[worker].put(db_inds)
+    self._pending.append((self._fetch_perm, self._fetch_cur))
+    self._num_submitted += 1
+
+  def _get_prefetched_minibatch(self):
+    if self._pending is None:
+      self._pending = deque()
+      self._fetch_perm, self._fetch_cur = self._perm, self._cur
+      for _ in range(max(cfg.TRAIN.PREFETCH_QUEUE_SIZE, 1)):
+        self._submit_minibatch()
+
+    worker = self._num_received % len(self._blob_queue)
+    blobs, self._worker_cache_counters[worker] = self._blob_queue[worker].get()
+    self._num_received += 1
+    # The position now points right after the minibatch being returned
+    self._perm, self._cur = self._pending.popleft()
+    self._submit_minibatch()
+    return blobs
+
   def _get_next_minibatch(self):
     """Return the blobs to be used for the next minibatch.
 
     If cfg.TRAIN.USE_PREFETCH is True, then blobs will be computed in a
     separate process and made available through self._blob_queue.
     """
+    if cfg.TRAIN.USE_PREFETCH:
+      return self._get_prefetched_minibatch()
+
     db_inds = self._get_next_minibatch_inds()
-    minibatch_db = [self._roidb[i] for i in db_inds]
-    return get_minibatch(minibatch_db, self._num_classes)
-      
+    minibatch_db = [roidb_entry(self._roidb, i) for i in db_inds]
+    return get_minibatch(minibatch_db, self._num_classes, self._blob_buffer)
+
   def forward(self):
     """Get blobs and copy them into this layer's top blob vector."""
     blobs = self._get_next_minibatch()
     return blobs
+
+  def image_cache_stats(self):
+    """Return the counters of the decoded image cache as a printable
+    string, summed over the prefetch workers, or None without a cache."""
+    if cfg.TRAIN.USE_PREFETCH:
+      counters = [c for c in self._worker_cache_counters if c is not None]
+      if not counters:
+        return None
+      return format_stats(np.sum(counters, axis=0)) + \
+        ' over {} workers'.format(len(counters))
+    image_cache = get_image_cache()
+    if image_cache is None:
+      return None
+    return image_cache.stats()
+
+
+class BlobFetcher(Process):
+  """Experimental class for prefetching blobs in a separate process."""
+
+  def __init__(self, task_queue, blob_queue, roidb, num_classes, seed):
+    super(BlobFetcher, self).__init__()
+    self.daemon = True
+    self._task_queue = task_queue
+    self._blob_queue = blob_queue
+    self._roidb = roidb
+    self._num_classes = num_classes
+    self._seed = seed
+
+  def run(self):
+    print('BlobFetcher started')
+    # OpenCV's own thread pool does not survive a fork reliably
+    import cv2
+    cv2.setNumThreads(0)
+    np.random.seed(self._seed)
+    while True:
+      db_inds = self._task_queue.get()
+      minibatch_db = [roidb_entry(self._roidb, i) for i in db_inds]
+      # The blob is pickled asynchronously by the queue, so it must not
+      # live in a reused buffer
+      blobs = get_minibatch(minibatch_db, self._num_classes)
+      # the counters of the image cache of this process go along
+      image_cache = get_image_cache()
+      counters = image_cache.counters() if image_cache is not None else None
+      self._blob_queue.put((blobs, counters))
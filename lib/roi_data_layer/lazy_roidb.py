@@ -0,0 +1,105 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""A roidb whose entries are loaded when they are first used."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import OrderedDict
+
+import numpy as np
+from model.config import cfg
+from datasets.resized import load_index
+from roi_data_layer.roidb import prepare_entry, is_valid_entry
+
+
+class LazyRoidb(object):
+  """Roidb over the images of one or more imdbs, loaded on demand.
+
+  Entry i is parsed by imdb.load_roidb_entry and prepared like
+  prepare_roidb does on first access, then kept in an LRU of at most
+  cache_size entries. Image sizes come from the imdb manifests, so
+  sampling does not need the entries. An image whose annotation is invalid
+  (load_roidb_entry returns None) or that has no usable RoIs, which
+  filter_roidb would remove, is invalid: is_valid tells, loading the entry
+  if needed, and the data layer leaves such images out of its sampling.
+  """
+
+  def __init__(self, imdbs, cache_size=10000):
+    self._imdbs = list(imdbs)
+    self._offsets = np.cumsum([0] + [imdb.num_images for imdb in self._imdbs])
+    self._cache_size = cache_size
+    self._cache = OrderedDict()
+    # 1 valid, 0 invalid, -1 not loaded yet
+    self._valid = -np.ones((len(self),), dtype=np.int8)
+    self._image_data = None
+    self._resized_index = load_index(cfg.RESIZED_DIR) if cfg.RESIZED_DIR else {}
+
+  @property
+  def imdbs(self):
+    return self._imdbs
+
+  def __len__(self):
+    return int(self._offsets[-1])
+
+  def __getitem__(self, i):
+    entry = self._cache.pop(i, None)
+    if entry is None:
+      entry = self._load_entry(i)
+      if entry is None:
+        raise ValueError('Invalid roidb entry {}'.format(i))
+    self._remember(i, entry)
+    return entry
+
+  def _remember(self, i, entry):
+    # Most recently used last
+    self._cache[i] = entry
+    while len(self._cache) > self._cache_size:
+      self._cache.popitem(last=False)
+
+  def is_valid(self, i):
+    """Whether entry i is valid, which loads it the first time."""
+    if self._valid[i] < 0:
+      entry = self._load_entry(i)
+      if entry is not None:
+        self._remember(i, entry)
+    return self._valid[i] == 1
+
+  @property
+  def invalid_mask(self):
+    """Mask of the entries known to be invalid so far."""
+    return self._valid == 0
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield self[i]
+
+  def _load_entry(self, i):
+    k = np.searchsorted(self._offsets, i, side='right') - 1
+    imdb = self._imdbs[k]
+    j = i - self._offsets[k]
+    entry = imdb.load_roidb_entry(j)
+    if entry is None:
+      print('Skipping image {} of {}: invalid annotation'.format(
+        imdb.image_index[j], imdb.name))
+    else:
+      prepare_entry(imdb, j, entry, imdb.image_size_at(j), self._resized_index)
+      if not is_valid_entry(entry):
+        print('Skipping image {} of {}: no usable RoI'.format(
+          imdb.image_index[j], imdb.name))
+        entry = None
+    self._valid[i] = entry is not None
+    return entry
+
+  @property
+  def image_data(self):
+    """Per-image 'width' and 'height' arrays, as in CompactRoidb."""
+    if self._image_data is None:
+      sizes = np.array([imdb.image_size_at(j) for imdb in self._imdbs
+                        for j in range(imdb.num_images)],
+                       dtype=np.int32).reshape((-1, 2))
+      self._image_data = {'width': sizes[:, 0], 'height': sizes[:, 1]}
+    return self._image_data
@@ -15,10 +15,29 @@ import numpy as np
 import numpy.random as npr
 import cv2
 from model.config import cfg
-from utils.blob import prep_im_for_blob, im_list_to_blob
+from utils.blob import resize_im_for_blob, BlobBuffer, get_im_scale, \
+  reduced_imread_flags, resize_im_to_scale
+from utils.image_cache import ImageCache
+from datasets.packed import imread
 
-def get_minibatch(roidb, num_classes):
-  """Given a roidb, construct a minibatch sampled from it."""
+# Decoded image cache of this process, see get_image_cache
+_image_cache = None
+
+def get_image_cache():
+  """Return the decoded image cache configured by TRAIN.IMAGE_CACHE_MB and
+  TRAIN.IMAGE_CACHE_DIR, or None if both are unset."""
+  global _image_cache
+  if _image_cache is None and (cfg.TRAIN.IMAGE_CACHE_MB > 0 or cfg.TRAIN.IMAGE_CACHE_DIR):
+    _image_cache = ImageCache(int(cfg.TRAIN.IMAGE_CACHE_MB * 1024 ** 2),
+                              cfg.TRAIN.IMAGE_CACHE_DIR or None, imread)
+  return _image_cache
+
+def get_minibatch(roidb, num_classes, blob_buffer=None):
+  """Given a roidb, construct a minibatch sampled from it.
+
+  If blob_buffer is given the image blob is built inside it and is only
+  valid until the buffer is used again.
+  """
   num_images = len(roidb)
   # Sample random scales to use for each image in this batch
   random_scale_inds = npr.randint(0, high=len(cfg.TRAIN.SCALES),
@@ -28,68 +47,112 @@ def get_minibatch(roidb, num_classes):
     format(num_images, cfg.TRAIN.BATCH_SIZE)
 
   # Get the input image blob, formatted for caffe
-  im_blob, im_scales = _get_image_blob(roidb, random_scale_inds)
+  im_blob, im_scales, im_shapes = _get_image_blob(roidb, random_scale_inds, blob_buffer)
 
   blobs = {'data': im_blob}
   parsing_labels = None
   if cfg.DO_PARSING:
-    label = cv2.imread(roidb[0]['parsing_labels'], cv2.IMREAD_GRAYSCALE)
-    label = cv2.resize(label, None, None, fx=im_scales[0], fy=im_scales[0],
-                       interpolation=cv2.INTER_NEAREST)
-    parsing_labels = np.zeros((num_classes, label.shape[0], label.shape[1]))
-    for i in range(num_classes):
-      mask = label == i
-      parsing_labels[i][mask] = 1
-
-    parsing_labels = parsing_labels[np.newaxis, ...]
-    parsing_labels = parsing_labels.astype(np.float32, copy=False)
+    # (N, H, W) class index maps padded to the blob size with the
+    # background class, the per-RoI binary masks are made from them in
+    # proposal_target_layer.gen_mask_parsing_labels
+    parsing_labels = np.zeros((num_images, im_blob.shape[2], im_blob.shape[3]),
+                              dtype=np.uint8)
+    for n in range(num_images):
+      variant = _get_resized_variant(roidb[n], random_scale_inds[n])
+      if variant is not None and variant[1] is not None:
+        label = _imread(variant[1], cv2.IMREAD_GRAYSCALE)
+        if roidb[n]['flipped']:
+          label = label[:, ::-1]
+      else:
+        label = _imread(roidb[n]['parsing_labels'], cv2.IMREAD_GRAYSCALE)
+        if roidb[n]['flipped']:
+          label = label[:, ::-1]
+        label = cv2.resize(label, None, None, fx=im_scales[n], fy=im_scales[n],
+                           interpolation=cv2.INTER_NEAREST)
+      parsing_labels[n, :label.shape[0], :label.shape[1]] = label
   blobs['parsing_labels'] = parsing_labels
-  assert len(im_scales) == 1, "Single batch only"
-  assert len(roidb) == 1, "Single batch only"
-  
-  # gt boxes: (x1, y1, x2, y2, cls)
-  if cfg.TRAIN.USE_ALL_GT:
-    # Include all ground truth boxes
-    gt_inds = np.where(roidb[0]['gt_classes'] != 0)[0]  # roidb[0]['gt_classes'] (num_objs, )
-  else:
-    # For the COCO ground truth boxes, exclude the ones that are ''iscrowd'' 
-    gt_inds = np.where(roidb[0]['gt_classes'] != 0 & np.all(roidb[0]['gt_overlaps'].toarray() > -1.0, axis=1))[0]
-  # gt_boxes = np.empty((len(gt_inds), 5), dtype=np.float32)
-  if cfg.SUB_CATEGORY:
-    gt_boxes = np.ones((len(gt_inds), 6), dtype=np.float32)
-    gt_boxes[:, 5] = roidb[0]['sub_categorys'][gt_inds]
-  else:
-    gt_boxes = np.ones((len(gt_inds), 5), dtype=np.float32)
-  gt_boxes[:, 0:4] = roidb[0]['boxes'][gt_inds, :] * im_scales[0]  # roidb[0]['boxes'] (num_objs, 4) num_objs该图实际bbox的数量
-  gt_boxes[:, 4] = roidb[0]['gt_classes'][gt_inds]
-
-  blobs['gt_boxes'] = gt_boxes
+
+  # gt boxes: (x1, y1, x2, y2, cls), gt_batch_inds holds the image of each box
+  all_gt_boxes = []
+  gt_batch_inds = []
+  for n in range(num_images):
+    if cfg.TRAIN.USE_ALL_GT:
+      # Include all ground truth boxes
+      gt_inds = np.where(roidb[n]['gt_classes'] != 0)[0]  # roidb[n]['gt_classes'] (num_objs, )
+    else:
+      # For the COCO ground truth boxes, exclude the ones that are ''iscrowd''
+      gt_inds = np.where(roidb[n]['gt_classes'] != 0 & np.all(roidb[n]['gt_overlaps'].toarray() > -1.0, axis=1))[0]
+    if cfg.SUB_CATEGORY:
+      gt_boxes = np.ones((len(gt_inds), 6), dtype=np.float32)
+      gt_boxes[:, 5] = roidb[n]['sub_categorys'][gt_inds]
+    else:
+      gt_boxes = np.ones((len(gt_inds), 5), dtype=np.float32)
+    gt_boxes[:, 0:4] = roidb[n]['boxes'][gt_inds, :] * im_scales[n]  # roidb[n]['boxes'] (num_objs, 4) num_objs该图实际bbox的数量
+    gt_boxes[:, 4] = roidb[n]['gt_classes'][gt_inds]
+    all_gt_boxes.append(gt_boxes)
+    gt_batch_inds.append(np.full((len(gt_inds),), n, dtype=np.int64))
+
+  blobs['gt_boxes'] = np.concatenate(all_gt_boxes, axis=0)
+  blobs['gt_batch_inds'] = np.concatenate(gt_batch_inds, axis=0)
+  # one (height, width, scale) row per image, the sizes exclude the padding
   blobs['im_info'] = np.array(
-    [im_blob.shape[1], im_blob.shape[2], im_scales[0]],
+    [[shape[0], shape[1], scale] for shape, scale in zip(im_shapes, im_scales)],
     dtype=np.float32)
 
-
   return blobs
 
-def _get_image_blob(roidb, scale_inds):
+def _imread(path, flags=cv2.IMREAD_COLOR):
+  """Read an image through the image cache if there is one."""
+  image_cache = get_image_cache()
+  if image_cache is not None:
+    return image_cache.imread(path, flags)
+  return imread(path, flags)
+
+def _get_resized_variant(entry, scale_ind):
+  """Return the (image path, label path, im_scale) of the pre-resized
+  variant of a roidb entry at TRAIN.SCALES[scale_ind], or None."""
+  resized = entry.get('resized')
+  if not resized:
+    return None
+  return resized.get((cfg.TRAIN.SCALES[scale_ind], cfg.TRAIN.MAX_SIZE))
+
+def _get_image_blob(roidb, scale_inds, blob_buffer=None):
   """Builds an input blob from the images in the roidb at the specified
   scales.
   """
+  if blob_buffer is None:
+    blob_buffer = BlobBuffer(cfg.PIXEL_MEANS)
   num_images = len(roidb)
   processed_ims = []
   im_scales = []
   for i in range(num_images):
-    im = cv2.imread(roidb[i]['image'])
-    if roidb[i]['flipped']:
-      im = im[:, ::-1, :]
-    target_size = cfg.TRAIN.SCALES[scale_inds[i]]
-    im, im_scale = prep_im_for_blob(im, cfg.PIXEL_MEANS, target_size,
-                    cfg.TRAIN.MAX_SIZE)
+    variant = _get_resized_variant(roidb[i], scale_inds[i])
+    if variant is not None:
+      im = _imread(variant[0])
+      im_scale = variant[2]
+      if roidb[i]['flipped']:
+        im = im[:, ::-1, :]
+    elif cfg.REDUCED_DECODE:
+      im_size = (roidb[i]['height'], roidb[i]['width'])
+      im_scale = get_im_scale(im_size, cfg.TRAIN.SCALES[scale_inds[i]],
+                              cfg.TRAIN.MAX_SIZE)
+      im = _imread(roidb[i]['image'], reduced_imread_flags(im_scale))
+      if roidb[i]['flipped']:
+        im = im[:, ::-1, :]
+      im = resize_im_to_scale(im, im_size, im_scale)
+    else:
+      # with an image cache, flipped entries share the decoded image
+      im = _imread(roidb[i]['image'])
+      if roidb[i]['flipped']:
+        im = im[:, ::-1, :]
+      target_size = cfg.TRAIN.SCALES[scale_inds[i]]
+      im, im_scale = resize_im_for_blob(im, target_size, cfg.TRAIN.MAX_SIZE)
     im_scales.append(im_scale)
     processed_ims.append(im)
 
 
-  # Create a blob to hold the input images
-  blob = im_list_to_blob(processed_ims)
+  # Mean subtract the images into a (reused) NCHW blob
+  blob = blob_buffer.im_list_to_blob(processed_ims)
+  im_shapes = [im.shape[:2] for im in processed_ims]
 
-  return blob, im_scales
\ No newline at end of file
+  return blob, im_scales, im_shapes
\ No newline at end of file
@@ -12,7 +12,7 @@ from __future__ import print_function
 
 import numpy as np
 from model.config import cfg
-import PIL
+from datasets.resized import load_index
 
 def prepare_roidb(imdb):
   """Enrich the imdb's roidb by adding some derived quantities that
@@ -23,27 +23,86 @@ def prepare_roidb(imdb):
   """
   roidb = imdb.roidb
   if not (imdb.name.startswith('coco')):
-    sizes = [PIL.Image.open(imdb.image_path_at(i)).size
+    sizes = [imdb.image_size_at(i)
          for i in range(imdb.num_images)]
+  resized_index = load_index(cfg.RESIZED_DIR) if cfg.RESIZED_DIR else {}
   for i in range(len(imdb.image_index)):
-    roidb[i]['image'] = imdb.image_path_at(i)
-    if cfg.DO_PARSING:
-      roidb[i]['parsing_labels'] = imdb.parsing_label_path_at(i)
-    if not (imdb.name.startswith('coco')):
-      roidb[i]['width'] = sizes[i][0]
-      roidb[i]['height'] = sizes[i][1]
-    # need gt_overlaps as a dense array for argmax
-    gt_overlaps = roidb[i]['gt_overlaps'].toarray()
-    # max overlap with gt over classes (columns)
-    max_overlaps = gt_overlaps.max(axis=1)
-    # gt class that had the max overlap
-    max_classes = gt_overlaps.argmax(axis=1)
-    roidb[i]['max_classes'] = max_classes
-    roidb[i]['max_overlaps'] = max_overlaps
-    # sanity checks
-    # max overlap of 0 => class should be zero (background)
-    zero_inds = np.where(max_overlaps == 0)[0]
-    assert all(max_classes[zero_inds] == 0)
-    # max overlap > 0 => class should not be zero (must be a fg class)
-    nonzero_inds = np.where(max_overlaps > 0)[0]
-    assert all(max_classes[nonzero_inds] != 0)
+    size = None if imdb.name.startswith('coco') else sizes[i]
+    prepare_entry(imdb, i, roidb[i], size, resized_index)
+
+
+def prepare_entry(imdb, i, entry, size=None, resized_index=None):
+  """Add the derived quantities of prepare_roidb to the roidb entry of
+  image i of imdb. size is the (width, height) of the image, if known."""
+  entry['image'] = imdb.image_path_at(i)
+  # pre-resized variants, keyed by (target_size, max_size)
+  entry['resized'] = resized_index.get(entry['image'], {}) if resized_index else {}
+  if cfg.DO_PARSING:
+    entry['parsing_labels'] = imdb.parsing_label_path_at(i)
+  if size is not None:
+    entry['width'] = size[0]
+    entry['height'] = size[1]
+  # need gt_overlaps as a dense array for argmax
+  gt_overlaps = entry['gt_overlaps'].toarray()
+  # max overlap with gt over classes (columns)
+  max_overlaps = gt_overlaps.max(axis=1)
+  # gt class that had the max overlap
+  max_classes = gt_overlaps.argmax(axis=1)
+  entry['max_classes'] = max_classes
+  entry['max_overlaps'] = max_overlaps
+  # sanity checks
+  # max overlap of 0 => class should be zero (background)
+  zero_inds = np.where(max_overlaps == 0)[0]
+  assert all(max_classes[zero_inds] == 0)
+  # max overlap > 0 => class should not be zero (must be a fg class)
+  nonzero_inds = np.where(max_overlaps > 0)[0]
+  assert all(max_classes[nonzero_inds] != 0)
+
+
+def is_valid_entry(entry):
+  """Whether a prepared roidb entry has usable RoIs, see
+  model.train_val.filter_roidb."""
+  # Valid images have:
+  #   (1) At least one foreground RoI OR
+  #   (2) At least one background RoI
+  overlaps = entry['max_overlaps']
+  # find boxes with sufficient overlap
+  fg_inds = np.where(overlaps >= cfg.TRAIN.FG_THRESH)[0]
+  # Select background RoIs as those within [BG_THRESH_LO, BG_THRESH_HI)
+  bg_inds = np.where((overlaps < cfg.TRAIN.BG_THRESH_HI) &
+                     (overlaps >= cfg.TRAIN.BG_THRESH_LO))[0]
+  # image is only valid if such boxes exist
+  return len(fg_inds) > 0 or len(bg_inds) > 0
+
+
+def flipped_entry(entry):
+  """Return the horizontally flipped view of a roidb entry.
+
+  Only the boxes are recomputed, everything else is shared with entry; the
+  pixels are flipped when the minibatch is built.
+  """
+  boxes = entry['boxes'].copy()
+  oldx1 = boxes[:, 0].copy()
+  oldx2 = boxes[:, 2].copy()
+  boxes[:, 0] = entry['width'] - oldx2 - 1
+  boxes[:, 2] = entry['width'] - oldx1 - 1
+  assert (boxes[:, 2] >= boxes[:, 0]).all()
+  flipped = dict(entry)
+  flipped['boxes'] = boxes
+  flipped['flipped'] = True
+  return flipped
+
+
+def num_entries(roidb, use_flipped):
+  """Number of entries the data layer samples from: with use_flipped
+  indices len(roidb) and above designate the flipped views."""
+  if use_flipped:
+    return 2 * len(roidb)
+  return len(roidb)
+
+
+def roidb_entry(roidb, i):
+  """Return entry i of roidb, flipped views included (see num_entries)."""
+  if i < len(roidb):
+    return roidb[i]
+  return flipped_entry(roidb[i - len(roidb)])
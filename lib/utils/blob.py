@@ -30,17 +30,103 @@ def im_list_to_blob(ims):
   return blob
 
 
-def prep_im_for_blob(im, pixel_means, target_size, max_size):
-  """Mean subtract and scale an image for use in a blob."""
-  im = im.astype(np.float32, copy=False)
-  im -= pixel_means
-  im_shape = im.shape
+def get_im_scale(im_shape, target_size, max_size):
+  """Compute the factor that scales an image's shortest side to target_size
+  while keeping its longest side within max_size.
+  """
   im_size_min = np.min(im_shape[0:2])
   im_size_max = np.max(im_shape[0:2])
   im_scale = float(target_size) / float(im_size_min)
   # Prevent the biggest axis from being more than MAX_SIZE
   if np.round(im_scale * im_size_max) > max_size:
     im_scale = float(max_size) / float(im_size_max)
+  return im_scale
+
+
+def prep_im_for_blob(im, pixel_means, target_size, max_size):
+  """Mean subtract and scale an image for use in a blob."""
+  im = im.astype(np.float32, copy=False)
+  im -= pixel_means
+  im_scale = get_im_scale(im.shape, target_size, max_size)
+  im = cv2.resize(im, None, None, fx=im_scale, fy=im_scale,
+                  interpolation=cv2.INTER_LINEAR)
+  return im, im_scale
+
+
+def resize_im_for_blob(im, target_size, max_size):
+  """Scale a uint8 image for use in a blob.
+
+  Unlike prep_im_for_blob the image stays in uint8 and the means are not
+  subtracted; that is done by BlobBuffer when the blob is filled.
+  """
+  im_scale = get_im_scale(im.shape, target_size, max_size)
   im = cv2.resize(im, None, None, fx=im_scale, fy=im_scale,
                   interpolation=cv2.INTER_LINEAR)
   return im, im_scale
+
+
+def reduced_imread_flags(im_scale):
+  """Return the cv2.imread flags that decode a color image at the smallest
+  resolution (1/2, 1/4 or 1/8) it can be downscaled by im_scale from.
+
+  For JPEG files the reduction is done by libjpeg in the DCT domain, which
+  is several times faster than a full decode.
+  """
+  for factor, flags in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                        (4, cv2.IMREAD_REDUCED_COLOR_4),
+                        (2, cv2.IMREAD_REDUCED_COLOR_2)):
+    if im_scale * factor <= 1.:
+      return flags
+  return cv2.IMREAD_COLOR
+
+
+def resize_im_to_scale(im, im_size, im_scale):
+  """Scale a possibly reduced decode of an image of (height, width) im_size
+  to the size cv2.resize(fx=im_scale, fy=im_scale) gives the full image."""
+  height = int(np.round(im_size[0] * im_scale))
+  width = int(np.round(im_size[1] * im_scale))
+  if im.shape[0] == height and im.shape[1] == width:
+    return im
+  return cv2.resize(im, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+class BlobBuffer(object):
+  """Reusable float32 storage for NCHW network input blobs.
+
+  Images are mean subtracted and transposed straight from uint8 into the
+  buffer, so a frame costs a single float32 copy. The storage only grows,
+  and it is sized with the height and width rounded up to a multiple of
+  `bucket` so that small shape changes do not trigger a reallocation.
+
+  The returned blob is a view of the storage: it is only valid until the
+  next call to im_list_to_blob on the same buffer.
+  """
+
+  def __init__(self, pixel_means, bucket=32):
+    self._pixel_means = np.asarray(pixel_means, dtype=np.float32) \
+      .reshape((3, 1, 1))
+    self._bucket = bucket
+    self._storage = np.zeros((0,), dtype=np.float32)
+
+  def _get_blob(self, num_images, height, width):
+    bucket = self._bucket
+    size = num_images * 3 * (-(-height // bucket) * bucket) * \
+      (-(-width // bucket) * bucket)
+    if self._storage.size < size:
+      self._storage = np.empty((size,), dtype=np.float32)
+    count = num_images * 3 * height * width
+    return self._storage[:count].reshape((num_images, 3, height, width))
+
+  def im_list_to_blob(self, ims):
+    """Convert a list of uint8 BGR images into an NCHW network input."""
+    max_shape = np.array([im.shape for im in ims]).max(axis=0)
+    height, width = int(max_shape[0]), int(max_shape[1])
+    blob = self._get_blob(len(ims), height, width)
+    for i, im in enumerate(ims):
+      h, w = im.shape[0], im.shape[1]
+      np.subtract(im.transpose((2, 0, 1)), self._pixel_means,
+                  out=blob[i, :, :h, :w], casting='unsafe')
+      # The storage is reused, so clear the padding explicitly
+      blob[i, :, h:, :] = 0
+      blob[i, :, :h, w:] = 0
+    return blob
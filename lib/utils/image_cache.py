@@ -0,0 +1,137 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Cache of decoded uint8 images."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import cv2
+
+
+class ImageCache(object):
+  """Two-tier cache of decoded images.
+
+  The first tier is an in-memory LRU holding at most max_bytes of arrays.
+  The second, optional, tier is a directory of pre-decoded .npy files that
+  are memory-mapped on access; it is shared by every process that points to
+  the same directory and survives between runs. Its files are named after
+  the image path, size and modification time, so an edited image is
+  decoded again.
+
+  The arrays handed out are shared with the cache and must not be modified
+  in place.
+  """
+
+  def __init__(self, max_bytes, disk_dir=None, imread=cv2.imread):
+    self._max_bytes = max_bytes
+    # the decoder, any function with the signature of cv2.imread
+    self._imread = imread
+    self._disk_dir = disk_dir
+    if disk_dir and not os.path.exists(disk_dir):
+      os.makedirs(disk_dir)
+    self._entries = OrderedDict()
+    self._num_bytes = 0
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+
+  def _disk_path(self, path):
+    if os.path.isfile(path):
+      st = os.stat(path)
+      key = '{}:{}:{}'.format(os.path.abspath(path), st.st_size, st.st_mtime)
+    else:
+      # a path only the decoder knows about, e.g. a packed record
+      key = path
+    name = hashlib.md5(key.encode('utf-8')).hexdigest()
+    return os.path.join(self._disk_dir, name + '.npy')
+
+  def _load(self, path, flags):
+    """Decode an image, going through the disk tier if there is one."""
+    if not self._disk_dir:
+      self.misses += 1
+      return self._imread(path, flags)
+
+    disk_path = self._disk_path(path)
+    if flags != cv2.IMREAD_COLOR:
+      disk_path = disk_path[:-4] + '_{}.npy'.format(flags)
+    if os.path.exists(disk_path):
+      self.disk_hits += 1
+      return np.load(disk_path, mmap_mode='r')
+
+    self.misses += 1
+    im = self._imread(path, flags)
+    if im is None:
+      return im
+    # Write then rename, other processes may read the same file
+    tmp_path = '{}.{}.tmp'.format(disk_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+      np.save(f, im)
+    os.rename(tmp_path, disk_path)
+    return im
+
+  def put(self, key, im):
+    """Add an array to the memory tier, evicting the least recently used
+    ones to stay within the byte budget."""
+    if key in self._entries:
+      self._num_bytes -= self._entries.pop(key).nbytes
+    if im.nbytes > self._max_bytes:
+      return
+    self._entries[key] = im
+    self._num_bytes += im.nbytes
+    while self._num_bytes > self._max_bytes:
+      _, old = self._entries.popitem(last=False)
+      self._num_bytes -= old.nbytes
+
+  def get(self, key):
+    """Return the array cached under key in memory, or None."""
+    im = self._entries.pop(key, None)
+    if im is not None:
+      # Move it to the most recently used end
+      self._entries[key] = im
+    return im
+
+  def imread(self, path, flags=cv2.IMREAD_COLOR):
+    """Drop-in replacement of cv2.imread."""
+    key = (path, flags)
+    im = self.get(key)
+    if im is not None:
+      self.hits += 1
+      return im
+    im = self._load(path, flags)
+    if im is not None and self._max_bytes > 0:
+      if isinstance(im, np.memmap):
+        # Read memory-mapped arrays in full once they get here
+        im = np.array(im)
+      self.put(key, im)
+    return im
+
+  @property
+  def num_bytes(self):
+    return self._num_bytes
+
+  def counters(self):
+    """Return (hits, disk hits, misses, bytes in memory)."""
+    return self.hits, self.disk_hits, self.misses, self._num_bytes
+
+  def stats(self):
+    """Return the hit and miss counters as a printable string."""
+    return format_stats(self.counters())
+
+
+def format_stats(counters):
+  """Printable string of ImageCache.counters, or of their sum over the
+  caches of several processes."""
+  hits, disk_hits, misses, num_bytes = counters
+  total = max(hits + disk_hits + misses, 1)
+  return ('image cache: {} hits, {} disk hits, {} misses ({:.1f}% hit rate), '
+          '{:.1f}MB in memory').format(
+    hits, disk_hits, misses, 100. * (hits + disk_hits) / total,
+    num_bytes / 1024. ** 2)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+# Gather the bbox (and sub-category) txt annotations of a mydataset image set
+# into one table, see datasets/annotation_table.py. Train or evaluate from it
+# with --set USE_ANNOTATION_TABLE True.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.config import cfg, cfg_from_file, cfg_from_list
+from datasets.factory import get_imdb
+from datasets.annotation_table import build_table, save_table
+import argparse
+import os, sys
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Build the annotation table of a dataset')
+  parser.add_argument('--cfg', dest='cfg_file',
+            help='optional config file', default=None, type=str)
+  parser.add_argument('--imdb', dest='imdb_name',
+            help='dataset to convert',
+            default='Lip_320_train', type=str)
+  parser.add_argument('--no_sub_category', dest='sub_category',
+            help='do not read the sub-category files',
+            action='store_false')
+  parser.add_argument('--set', dest='set_cfgs',
+            help='set config keys', default=None,
+            nargs=argparse.REMAINDER)
+
+  if len(sys.argv) == 1:
+    parser.print_help()
+    sys.exit(1)
+
+  args = parser.parse_args()
+  return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  print('Called with args:')
+  print(args)
+
+  if args.cfg_file is not None:
+    cfg_from_file(args.cfg_file)
+  if args.set_cfgs is not None:
+    cfg_from_list(args.set_cfgs)
+  # the annotations are read from the txt files
+  cfg.USE_ANNOTATION_TABLE = False
+
+  imdb = get_imdb(args.imdb_name)
+  read_boxes = lambda index: imdb._read_annotation('bbox', index)
+  read_sub_categorys = None
+  if args.sub_category:
+    read_sub_categorys = lambda index: imdb._read_annotation('sub_category_3', index)
+  table = build_table(list(imdb.image_index), read_boxes, read_sub_categorys)
+
+  filename = imdb.annotation_table_file
+  if not os.path.exists(os.path.dirname(filename)):
+    os.makedirs(os.path.dirname(filename))
+  save_table(filename, table)
+  print('Wrote {} boxes of {} images to {}'.format(
+    len(table['classes']), len(table['names']), filename))
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+# Pack the images, parsing labels and txt annotations of a mydataset image
+# set into a few shard files, see datasets/packed.py. Train or test on the
+# pack with --set USE_PACKED_DATA True.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.config import cfg, cfg_from_file, cfg_from_list
+from datasets.factory import get_imdb
+from datasets.packed import pack_files
+import argparse
+import os, sys
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Pack a dataset into shard files')
+  parser.add_argument('--cfg', dest='cfg_file',
+            help='optional config file', default=None, type=str)
+  parser.add_argument('--imdb', dest='imdb_name',
+            help='dataset to pack',
+            default='Lip_320_train', type=str)
+  parser.add_argument('--shard_size', dest='shard_size',
+            help='size of a shard file in MB',
+            default=1024, type=int)
+  parser.add_argument('--set', dest='set_cfgs',
+            help='set config keys', default=None,
+            nargs=argparse.REMAINDER)
+
+  if len(sys.argv) == 1:
+    parser.print_help()
+    sys.exit(1)
+
+  args = parser.parse_args()
+  return args
+
+
+def dataset_records(imdb):
+  """Yield the (kind, name, path) of every file of the image set."""
+  for index in imdb.image_index:
+    yield 'image', index, imdb.image_path_from_index(index)
+    label_path = os.path.join(imdb._parsing_label_path,
+                              index + imdb._parsing_label_ext)
+    if os.path.exists(label_path):
+      yield 'label', index, label_path
+    for kind in ('bbox', 'sub_category_3'):
+      path = imdb.annotation_path_from_index(kind, index)
+      if os.path.exists(path):
+        yield kind, index, path
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  print('Called with args:')
+  print(args)
+
+  if args.cfg_file is not None:
+    cfg_from_file(args.cfg_file)
+  if args.set_cfgs is not None:
+    cfg_from_list(args.set_cfgs)
+  # the files are read from their own paths
+  cfg.USE_PACKED_DATA = False
+
+  imdb = get_imdb(args.imdb_name)
+  prefix = imdb.packed_prefix
+  if not os.path.exists(os.path.dirname(prefix)):
+    os.makedirs(os.path.dirname(prefix))
+  index = pack_files(prefix, dataset_records(imdb),
+                     shard_size=args.shard_size * 1024 ** 2)
+  print('Packed {} records of {} images to {}'.format(
+    len(index), imdb.num_images, prefix))
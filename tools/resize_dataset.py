@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+# Pre-resize the images (and parsing labels) of a dataset to the scales of
+# TRAIN.SCALES / TRAIN.MAX_SIZE and TEST.SCALES / TEST.MAX_SIZE, see
+# datasets/resized.py. Train or test with --set RESIZED_DIR <out_dir> to
+# read them instead of resizing on the fly.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.config import cfg, cfg_from_file, cfg_from_list
+from datasets.factory import get_imdb
+from datasets.resized import resize_image, save_index
+import argparse
+import multiprocessing
+import os, sys
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Pre-resize a dataset')
+  parser.add_argument('out_dir', help='output directory', type=str)
+  parser.add_argument('--cfg', dest='cfg_file',
+            help='optional config file', default=None, type=str)
+  parser.add_argument('--imdb', dest='imdb_name',
+            help='dataset to resize',
+            default='Lip_320_train', type=str)
+  parser.add_argument('--workers', dest='workers',
+            help='number of worker processes',
+            default=multiprocessing.cpu_count(), type=int)
+  parser.add_argument('--set', dest='set_cfgs',
+            help='set config keys', default=None,
+            nargs=argparse.REMAINDER)
+
+  if len(sys.argv) == 1:
+    parser.print_help()
+    sys.exit(1)
+
+  args = parser.parse_args()
+  return args
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  print('Called with args:')
+  print(args)
+
+  if args.cfg_file is not None:
+    cfg_from_file(args.cfg_file)
+  if args.set_cfgs is not None:
+    cfg_from_list(args.set_cfgs)
+
+  sizes = sorted(set([(s, cfg.TRAIN.MAX_SIZE) for s in cfg.TRAIN.SCALES] +
+                     [(s, cfg.TEST.MAX_SIZE) for s in cfg.TEST.SCALES]))
+  for target_size, max_size in sizes:
+    for kind in ('image', 'label'):
+      size_dir = os.path.join(args.out_dir, '{}_{}'.format(target_size, max_size), kind)
+      if not os.path.exists(size_dir):
+        os.makedirs(size_dir)
+
+  imdb = get_imdb(args.imdb_name)
+  tasks = []
+  for i in range(imdb.num_images):
+    label_path = imdb.parsing_label_path_at(i) if cfg.DO_PARSING else None
+    tasks.append((args.out_dir, imdb.image_index[i], imdb.image_path_at(i),
+                  label_path, sizes))
+
+  records = {}
+  pool = multiprocessing.Pool(args.workers)
+  for i, (path, variants) in enumerate(pool.imap_unordered(resize_image, tasks, chunksize=16)):
+    records[path] = variants
+    if (i + 1) % 1000 == 0:
+      print('resized {:d}/{:d}'.format(i + 1, len(tasks)))
+  pool.close()
+  pool.join()
+
+  save_index(args.out_dir, records)
+  print('Wrote {} sizes of {} images to {}'.format(
+    len(sizes), len(records), args.out_dir))
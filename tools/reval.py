@@ -17,6 +17,7 @@ from model.test import apply_nms
 from model.config import cfg
 from datasets.factory import get_imdb
 import pickle
+import multiprocessing
 import os, sys, argparse
 import numpy as np
 
@@ -38,6 +39,9 @@ def parse_args():
                       action='store_true')
   parser.add_argument('--nms', dest='apply_nms', help='apply nms',
                       action='store_true')
+  parser.add_argument('--workers', dest='workers',
+                      help='number of processes applying nms',
+                      default=multiprocessing.cpu_count(), type=int)
 
   if len(sys.argv) == 1:
     parser.print_help()
@@ -56,7 +60,7 @@ def from_dets(imdb_name, output_dir, args):
 
   if args.apply_nms:
     print('Applying NMS to all detections')
-    nms_dets = apply_nms(dets, cfg.TEST.NMS)
+    nms_dets = apply_nms(dets, cfg.TEST.NMS, args.workers)
   else:
     nms_dets = dets
 
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+# Recall of the RPN proposals for several proposal counts and NMS
+# thresholds. The head and the RPN run once over the imdb, and the ranked
+# proposals before NMS are cached in the output directory; the sweep then
+# only applies NMS and truncation to the cache.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.test import _get_blobs
+from model.config import cfg, cfg_from_file, cfg_from_list, get_output_dir
+from model.nms_wrapper import nms
+from datasets.factory import get_imdb
+from datasets.packed import imread
+from utils.timer import Timer
+import argparse
+import hashlib
+import pickle
+import os, sys
+import numpy as np
+
+from nets.vgg16 import vgg16
+from nets.resnet_v1 import resnetv1
+from nets.mobilenet_v1 import mobilenetv1
+
+import torch
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Benchmark the recall of the RPN proposals')
+  parser.add_argument('--cfg', dest='cfg_file',
+            help='optional config file', default=None, type=str)
+  parser.add_argument('--model', dest='model',
+            help='model to test',
+            default=None, type=str)
+  parser.add_argument('--imdb', dest='imdb_name',
+            help='dataset to test',
+            default='voc_2007_test', type=str)
+  parser.add_argument('--tag', dest='tag',
+                        help='tag of the model',
+                        default='', type=str)
+  parser.add_argument('--net', dest='net',
+                      help='vgg16, res50, res101, res152, mobile',
+                      default='res50', type=str)
+  parser.add_argument('--pre_nms_top_n', dest='pre_nms_top_n',
+            help='number of ranked proposals cached per image',
+            default=6000, type=int)
+  parser.add_argument('--top_n', dest='top_ns',
+            help='proposal counts (RPN_POST_NMS_TOP_N / RPN_TOP_N) to try',
+            default='50,100,200,300,500,1000', type=str)
+  parser.add_argument('--nms_thresh', dest='nms_threshs',
+            help='RPN_NMS_THRESH values to try, "none" for the top mode',
+            default='0.5,0.6,0.7,0.8,none', type=str)
+  parser.add_argument('--clean', dest='clean',
+            help='recompute the cached proposals',
+            action='store_true')
+  parser.add_argument('--set', dest='set_cfgs',
+                        help='set config keys', default=None,
+                        nargs=argparse.REMAINDER)
+
+  if len(sys.argv) == 1:
+    parser.print_help()
+    sys.exit(1)
+
+  args = parser.parse_args()
+  return args
+
+
+def compute_proposals(net, imdb, pre_nms_top_n):
+  """Return the N x 5 (x1, y1, x2, y2, score) proposals of every image,
+  ranked by score and without NMS, in image coordinates."""
+  # keep every proposal of the pre-NMS top n, the test settings are
+  # restored afterwards
+  keys = ('MODE', 'RPN_PRE_NMS_TOP_N', 'RPN_NMS_THRESH', 'RPN_POST_NMS_TOP_N')
+  saved = dict((k, cfg.TEST[k]) for k in keys)
+  cfg.TEST.MODE = 'nms'
+  cfg.TEST.RPN_PRE_NMS_TOP_N = pre_nms_top_n
+  cfg.TEST.RPN_NMS_THRESH = 1.
+  cfg.TEST.RPN_POST_NMS_TOP_N = -1
+
+  timer = Timer()
+  proposals = []
+  try:
+    for i in range(imdb.num_images):
+      im = imread(imdb.image_path_at(i))
+      timer.tic()
+      blobs, im_scales = _get_blobs(im)
+      assert len(im_scales) == 1, "Only single-image batch implemented"
+      im_blob = blobs['data']
+      im_info = np.array([im_blob.shape[2], im_blob.shape[3], im_scales[0]], dtype=np.float32)
+      rois, scores = net.test_rpn(im_blob, im_info)
+      boxes = rois[:, 1:5] / im_scales[0]
+      proposals.append(np.hstack((boxes, scores.reshape((-1, 1)))).astype(np.float32))
+      timer.toc()
+      print('rpn: {:d}/{:d} {:.3f}s'.format(i + 1, imdb.num_images, timer.average_time()))
+  finally:
+    for k, v in saved.items():
+      cfg.TEST[k] = v
+  return proposals
+
+
+def proposals_key(net_name, pre_nms_top_n):
+  """Hash of what the cached proposals depend on besides the model."""
+  settings = (net_name, pre_nms_top_n, list(cfg.TEST.SCALES), cfg.TEST.MAX_SIZE,
+              list(cfg.ANCHOR_SCALES), list(cfg.ANCHOR_RATIOS),
+              cfg.PIXEL_MEANS.tolist())
+  return hashlib.md5(repr(settings).encode('utf-8')).hexdigest()[:8]
+
+
+def apply_rpn_nms(proposals, thresh, top_n):
+  """The first top_n proposals of each image kept by NMS at thresh, or
+  simply the first top_n ones if thresh is None."""
+  boxes = []
+  for dets in proposals:
+    if thresh is not None and dets.shape[0] > 0:
+      keep = nms(torch.from_numpy(dets), thresh).numpy()
+      dets = dets[keep, :]
+    boxes.append(dets[:top_n, :4])
+  return boxes
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  print('Called with args:')
+  print(args)
+
+  if args.cfg_file is not None:
+    cfg_from_file(args.cfg_file)
+  if args.set_cfgs is not None:
+    cfg_from_list(args.set_cfgs)
+
+  top_ns = [int(n) for n in args.top_ns.split(',')]
+  nms_threshs = [None if t == 'none' else float(t) for t in args.nms_threshs.split(',')]
+  # the top mode is read off the cached ranking, which has to be long enough
+  assert None not in nms_threshs or max(top_ns) <= args.pre_nms_top_n, \
+    '--top_n above --pre_nms_top_n with --nms_thresh none'
+
+  tag = args.tag if args.tag else 'default'
+  filename = tag + '/' + os.path.splitext(os.path.basename(args.model))[0]
+  imdb = get_imdb(args.imdb_name)
+  output_dir = get_output_dir(imdb, filename)
+  cache_file = os.path.join(output_dir, 'rpn_proposals_{:d}_{}.pkl'.format(
+    args.pre_nms_top_n, proposals_key(args.net, args.pre_nms_top_n)))
+
+  if os.path.exists(cache_file) and not args.clean:
+    with open(cache_file, 'rb') as f:
+      proposals = pickle.load(f)
+    print('rpn proposals loaded from {}'.format(cache_file))
+  else:
+    # load network
+    if args.net == 'vgg16':
+      net = vgg16()
+    elif args.net == 'res50':
+      net = resnetv1(num_layers=50)
+    elif args.net == 'res101':
+      net = resnetv1(num_layers=101)
+    elif args.net == 'res152':
+      net = resnetv1(num_layers=152)
+    elif args.net == 'mobile':
+      net = mobilenetv1()
+    else:
+      raise NotImplementedError
+    net.create_architecture(imdb.num_classes, tag='default',
+                            anchor_scales=cfg.ANCHOR_SCALES,
+                            anchor_ratios=cfg.ANCHOR_RATIOS)
+    net.eval()
+    net.cuda()
+    print(('Loading model check point from {:s}').format(args.model))
+    net.load_state_dict(torch.load(args.model))
+
+    proposals = compute_proposals(net, imdb, args.pre_nms_top_n)
+    with open(cache_file, 'wb') as f:
+      pickle.dump(proposals, f, pickle.HIGHEST_PROTOCOL)
+    print('rpn proposals cached in {}'.format(cache_file))
+
+  print('{:>6s} {:>6s} {:>8s} {:>8s} {:>8s}'.format(
+    'nms', 'top_n', 'R@0.5', 'R@0.7', 'AR'))
+  for thresh in nms_threshs:
+    boxes = apply_rpn_nms(proposals, thresh, max(top_ns))
+    results = imdb.evaluate_recall_sweep(boxes, limits=top_ns)
+    for top_n, res in zip(top_ns, results):
+      # thresholds are 0.50:0.05:0.95
+      print('{:>6s} {:6d} {:8.4f} {:8.4f} {:8.4f}'.format(
+        'none' if thresh is None else '{:.2f}'.format(thresh), top_n,
+        res['recalls'][0], res['recalls'][4], res['ar']))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+# Re-run the post-processing of test_net (score threshold, NMS,
+# max_per_image) over a grid of settings on the raw detections it cached
+# with TEST.RAW_CACHE_TOP_N, and report the mAP of each setting.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import _init_paths
+from model.test import postprocess_detections
+from model.config import cfg, cfg_from_file, cfg_from_list
+from datasets.factory import get_imdb
+import itertools
+import multiprocessing
+import pickle
+import os, sys, argparse
+import numpy as np
+
+
+def parse_args():
+  """
+  Parse input arguments
+  """
+  parser = argparse.ArgumentParser(description='Sweep the post-processing settings')
+  parser.add_argument('output_dir', nargs=1, help='results directory',
+                      type=str)
+  parser.add_argument('--imdb', dest='imdb_name',
+                      help='dataset to re-evaluate',
+                      default='voc_2007_test', type=str)
+  parser.add_argument('--cfg', dest='cfg_file',
+                      help='optional config file', default=None, type=str)
+  parser.add_argument('--nms', dest='nms_threshs',
+                      help='TEST.NMS values to try',
+                      default='0.3,0.4,0.5', type=str)
+  parser.add_argument('--thresh', dest='threshs',
+                      help='score thresholds to try',
+                      default='0.0,0.01,0.05', type=str)
+  parser.add_argument('--max_per_image', dest='max_per_images',
+                      help='max_per_image values to try',
+                      default='100', type=str)
+  parser.add_argument('--workers', dest='workers',
+                      help='number of processes',
+                      default=multiprocessing.cpu_count(), type=int)
+  parser.add_argument('--set', dest='set_cfgs',
+                      help='set config keys', default=None,
+                      nargs=argparse.REMAINDER)
+
+  if len(sys.argv) == 1:
+    parser.print_help()
+    sys.exit(1)
+
+  args = parser.parse_args()
+  return args
+
+
+# raw detections, evaluation gt and imdb, shared with the forked workers
+_raw_dets = None
+_eval_gt = None
+_imdb = None
+
+def _evaluate_setting(setting):
+  nms_thresh, thresh, max_per_image = setting
+  all_boxes = postprocess_detections(_raw_dets, nms_thresh, thresh, max_per_image)
+  num_classes = len(all_boxes)
+  # matched as the evaluation of the imdb does
+  accumulator = _imdb.ap_accumulator()
+  for i, gt in enumerate(_eval_gt):
+    accumulator.add_image([all_boxes[j][i] for j in range(num_classes)],
+                          gt['boxes'], gt['gt_classes'], gt['difficult'])
+  summary = accumulator.summary()
+  num_dets = sum(len(all_boxes[j][i]) for j in range(1, num_classes)
+                 for i in range(len(_eval_gt)))
+  return summary['map'], summary['recall'], num_dets
+
+
+if __name__ == '__main__':
+  args = parse_args()
+
+  if args.cfg_file is not None:
+    cfg_from_file(args.cfg_file)
+  if args.set_cfgs is not None:
+    cfg_from_list(args.set_cfgs)
+
+  output_dir = os.path.abspath(args.output_dir[0])
+  _imdb = get_imdb(args.imdb_name)
+  with open(os.path.join(output_dir, 'raw_detections.pkl'), 'rb') as f:
+    cache = pickle.load(f)
+  assert cache['image_index'] == list(_imdb.image_index), \
+    'the raw detections are not of the images of {}'.format(_imdb.name)
+  _raw_dets = cache['dets']
+  _eval_gt = _imdb.evaluation_gt()
+
+  settings = list(itertools.product(
+    [float(t) for t in args.nms_threshs.split(',')],
+    [float(t) for t in args.threshs.split(',')],
+    [int(n) for n in args.max_per_images.split(',')]))
+  pool = multiprocessing.Pool(min(args.workers, len(settings)))
+  try:
+    results = pool.map(_evaluate_setting, settings, chunksize=1)
+  finally:
+    pool.close()
+    pool.join()
+
+  print('{:>6s} {:>8s} {:>8s} {:>8s} {:>8s} {:>10s}'.format(
+    'nms', 'thresh', 'max_det', 'mAP', 'recall', 'dets'))
+  for (nms_thresh, thresh, max_per_image), (ap, rec, num_dets) in \
+      sorted(zip(settings, results), key=lambda r: -r[1][0]):
+    print('{:6.2f} {:8.3f} {:8d} {:8.4f} {:8.4f} {:10d}'.format(
+      nms_thresh, thresh, max_per_image, ap, rec, num_dets))
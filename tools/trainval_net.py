@@ -9,6 +9,8 @@ from __future__ import print_function
 
 import _init_paths
 from model.train_val import get_training_roidb, train_net
+from roi_data_layer.lazy_roidb import LazyRoidb
+from roi_data_layer.compact_roidb import CompactRoidb
 from model.config import cfg, cfg_from_file, cfg_from_list, get_output_dir, get_output_tb_dir
 from datasets.factory import get_imdb
 import datasets.imdb
@@ -75,8 +77,14 @@ def combined_roidb(imdb_names):
   roidbs = [get_roidb(s) for s in imdb_names.split('+')]
   roidb = roidbs[0]
   if len(roidbs) > 1:
-    for r in roidbs[1:]:
-      roidb.extend(r)
+    if isinstance(roidb, LazyRoidb):
+      roidb = LazyRoidb([imdb for r in roidbs for imdb in r.imdbs],
+                        cfg.TRAIN.LAZY_ROIDB_CACHE)
+    elif isinstance(roidb, CompactRoidb):
+      roidb = CompactRoidb.concatenate(roidbs)
+    else:
+      for r in roidbs[1:]:
+        roidb.extend(r)
     tmp = get_imdb(imdb_names.split('+')[1])
     imdb = datasets.imdb.imdb(imdb_names, tmp.classes)
   else:
@@ -112,12 +120,9 @@ if __name__ == '__main__':
   tb_dir = get_output_tb_dir(imdb, args.tag)
   print('TensorFlow summaries will be saved to `{:s}`'.format(tb_dir))
 
-  # also add the validation set, but with no flipping images
-  orgflip = cfg.TRAIN.USE_FLIPPED
-  cfg.TRAIN.USE_FLIPPED = False
+  # also add the validation set, its data layer does not flip the images
   _, valroidb = combined_roidb(args.imdbval_name)
   print('{:d} validation roidb entries'.format(len(valroidb)))
-  cfg.TRAIN.USE_FLIPPED = orgflip
 
   # load network
   if args.net == 'vgg16':
@@ -2,23 +2,48 @@ import numpy as np
 class ConfusionMatrix:
     def __init__(self, size):
         self.size = size
-        self.diag = np.zeros(self.size)
-        self.act_sum = np.zeros(self.size)
-        self.pre_sum = np.zeros(self.size)
+        # counts[actual, predicted], labels out of [0, size) count as the
+        # extra class size, so that they still count in the sums of the
+        # other side as before
+        self.counts = np.zeros((self.size + 1, self.size + 1), dtype=np.int64)
 
     def reset(self):
-        self.diag = np.zeros(self.size)
-        self.act_sum = np.zeros(self.size)
-        self.pre_sum = np.zeros(self.size)
+        self.counts = np.zeros((self.size + 1, self.size + 1), dtype=np.int64)
+
+    def _labels(self, labels):
+        labels = np.asarray(labels).ravel().astype(np.int64)
+        labels[(labels < 0) | (labels >= self.size)] = self.size
+        return labels
 
     def update(self, actual, predicted):
-        for i in range(self.size):
-            act = actual == i
-            pre = predicted == i
-            I = act & pre
-            self.diag[i] += np.sum(I)
-            self.act_sum[i] += np.sum(act)
-            self.pre_sum[i] += np.sum(pre)
+        actual = self._labels(actual)
+        predicted = self._labels(predicted)
+        n = self.size + 1
+        self.counts += np.bincount(actual * n + predicted,
+                                   minlength=n * n).reshape((n, n))
+
+    def merge(self, other):
+        '''add the counts of another matrix, e.g. from a parallel worker'''
+        assert other.size == self.size
+        self.counts += other.counts
+        return self
+
+    @property
+    def matrix(self):
+        '''size x size confusion matrix, rows are the actual labels'''
+        return self.counts[:self.size, :self.size]
+
+    @property
+    def diag(self):
+        return np.diag(self.counts)[:self.size].astype(np.float64)
+
+    @property
+    def act_sum(self):
+        return self.counts[:self.size, :].sum(axis=1).astype(np.float64)
+
+    @property
+    def pre_sum(self):
+        return self.counts[:, :self.size].sum(axis=0).astype(np.float64)
 
     def accuracy(self):
         ''' accuracy '''